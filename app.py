@@ -54,13 +54,22 @@ def initialize_session_state():
 def main():
     """Main function to run the Streamlit application."""
     initialize_session_state()
+    # ทุก section ใน rerun นี้ใช้ DataFrame ชุดเดียวกัน (โหลดครั้งเดียวต่อ ตาราง/portfolio/projection)
+    db_handler.begin_rerun_data_context()
     supabase_client = db_handler.get_supabase_client()
-    df_portfolios_gs = db_handler.load_portfolios()  
-    
-    if not st.session_state.initial_portfolio_setup_done and not df_portfolios_gs.empty:
-        st.session_state.active_portfolio_id_gs = df_portfolios_gs.iloc[0]['PortfolioID']
-        st.session_state.active_portfolio_name_gs = df_portfolios_gs.iloc[0]['PortfolioName']
-        st.session_state.initial_portfolio_setup_done = True
+    db_handler.start_write_behind_worker()
+    # ครั้งแรกยังไม่รู้ Portfolio: เลือก Portfolio แรกก่อน (Portfolios ที่โหลดตรงนี้อยู่ใน rerun context แล้ว
+    # prefetch ด้านล่างจึงไม่โหลดซ้ำ) เพื่อให้ prefetch ทำงานครั้งเดียวต่อ rerun
+    if not st.session_state.initial_portfolio_setup_done:
+        df_portfolios_gs = db_handler.load_portfolios()
+        if not df_portfolios_gs.empty:
+            st.session_state.active_portfolio_id_gs = df_portfolios_gs.iloc[0]['PortfolioID']
+            st.session_state.active_portfolio_name_gs = df_portfolios_gs.iloc[0]['PortfolioName']
+            st.session_state.initial_portfolio_setup_done = True
+
+    # โหลดทุกตารางของ Portfolio ที่เลือกพร้อมกัน (section ต่าง ๆ จะได้ข้อมูลจาก cache ที่อุ่นไว้แล้ว)
+    prefetched = db_handler.prefetch_startup_data(st.session_state.active_portfolio_id_gs)
+    df_portfolios_gs = prefetched['portfolios']
 
     # ======================================================================================
     # --- START: โค้ดที่แก้ไขตรรกะการจัดการ BALANCE ทั้งหมด ---
@@ -70,16 +79,16 @@ def main():
         st.session_state.current_portfolio_details = current_portfolio_details_df.iloc[0].to_dict() if not current_portfolio_details_df.empty else None
 
         latest_equity_from_sheet = None
-        df_summaries = db_handler.load_statement_summaries()
+        df_summaries = prefetched.get('statement_summaries', pd.DataFrame())
         
         if not df_summaries.empty:
             # ---- START: การแก้ไขที่สำคัญที่สุด ----
-            # บังคับให้คอลัมน์ PortfolioID เป็นประเภท string เพื่อให้การเปรียบเทียบถูกต้องเสมอ
-            if 'PortfolioID' in df_summaries.columns:
-                df_summaries['PortfolioID'] = df_summaries['PortfolioID'].astype(str)
+            # เทียบ PortfolioID แบบ string เพื่อให้การเปรียบเทียบถูกต้องเสมอ
+            # (ไม่แก้ df_summaries ในที่ เพราะเป็น DataFrame ที่แชร์กับ section อื่นใน rerun นี้)
+            summary_portfolio_ids = df_summaries['PortfolioID'].astype(str)
             # ---- END: การแก้ไขที่สำคัญที่สุด ----
 
-            portfolio_summaries = df_summaries[df_summaries['PortfolioID'] == st.session_state.active_portfolio_id_gs].copy()
+            portfolio_summaries = df_summaries[summary_portfolio_ids == st.session_state.active_portfolio_id_gs].copy()
             
             if not portfolio_summaries.empty:
                 portfolio_summaries['Timestamp'] = pd.to_datetime(portfolio_summaries['Timestamp'], errors='coerce')
@@ -0,0 +1,145 @@
+# benchmarks/bench_statement_parser.py
+"""
+Parse-throughput benchmark for core.statement_processor.extract_data_from_report_content.
+
+Every size runs in its own subprocess so peak memory (max RSS) is measured per size and
+one run cannot warm caches or leak memory into the next. Results can be stored as
+baselines (benchmarks/baselines.json) and later runs are compared against them.
+
+Usage (from the repository root):
+    python -m benchmarks.bench_statement_parser                          # 1k, 10k, 100k, 1M deals
+    python -m benchmarks.bench_statement_parser --sizes 1000,10000 --format html
+    python -m benchmarks.bench_statement_parser --save-baseline          # record current numbers
+    python -m benchmarks.bench_statement_parser --fail-on-regression     # exit 1 when slower than baseline
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines.json"
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _run_child(statement_path: str, repeat: int, output_format: str) -> dict:
+    """Runs inside the benchmark subprocess: parses the file `repeat` times and reports the best run."""
+    from core import statement_processor
+
+    file_bytes = Path(statement_path).read_bytes()
+    baseline_rss = _peak_rss_mb()
+    timings, deals = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        extracted = statement_processor.extract_data_from_report_content(
+            file_bytes, debug=False, output_format=output_format
+        )
+        timings.append(time.perf_counter() - started)
+        deals = len(extracted['deals']) if output_format == 'pandas' else extracted['deals'].num_rows
+        del extracted
+    best = min(timings)
+    return {
+        'seconds': best,
+        'deals': deals,
+        'bytes': len(file_bytes),
+        'rows_per_sec': deals / best if best else 0.0,
+        'mb_per_sec': len(file_bytes) / 1e6 / best if best else 0.0,
+        'peak_rss_mb': _peak_rss_mb(),
+        'parse_rss_mb': _peak_rss_mb() - baseline_rss,
+    }
+
+def run_size(n_deals: int, fmt: str, repeat: int, output_format: str, workdir: str) -> dict:
+    """Generates a statement with n_deals deals and benchmarks it in a fresh interpreter."""
+    from benchmarks.statement_generator import generate_statement
+
+    statement_path = os.path.join(workdir, f"statement_{n_deals}.{fmt}")
+    if not os.path.exists(statement_path):
+        with open(statement_path, "wb") as handle:
+            handle.write(generate_statement(n_deals, fmt=fmt))
+
+    completed = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_statement_parser", "--child", statement_path,
+         "--repeat", str(repeat), "--output-format", output_format],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['size'] = n_deals
+    return result
+
+def _baseline_key(fmt: str, output_format: str, n_deals: int) -> str:
+    return f"{fmt}/{output_format}/{n_deals}"
+
+def load_baselines() -> dict:
+    if not BASELINE_PATH.exists():
+        return {}
+    return json.loads(BASELINE_PATH.read_text(encoding="utf-8"))
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Returns human-readable regressions of result vs baseline (throughput down or memory up by more than tolerance)."""
+    regressions = []
+    if baseline.get('rows_per_sec') and result['rows_per_sec'] < baseline['rows_per_sec'] * (1 - tolerance):
+        regressions.append(f"throughput {result['rows_per_sec']:,.0f} rows/s < baseline {baseline['rows_per_sec']:,.0f} rows/s")
+    if baseline.get('parse_rss_mb') and result['parse_rss_mb'] > baseline['parse_rss_mb'] * (1 + tolerance):
+        regressions.append(f"memory {result['parse_rss_mb']:,.1f} MB > baseline {baseline['parse_rss_mb']:,.1f} MB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark statement parsing throughput and memory")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="comma-separated deal counts")
+    parser.add_argument("--format", choices=("csv", "html"), default="csv")
+    parser.add_argument("--output-format", choices=("pandas", "arrow"), default="pandas")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size (best is reported)")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="allowed slowdown / memory growth vs baseline")
+    parser.add_argument("--save-baseline", action="store_true", help=f"write results to {BASELINE_PATH.name}")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--workdir", default=None, help="keep generated statements here (default: temp dir)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(_run_child(args.child, args.repeat, args.output_format)))
+        return 0
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    baselines = load_baselines()
+    all_regressions = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        workdir = args.workdir or temp_dir
+        os.makedirs(workdir, exist_ok=True)
+        print(f"{'deals':>10} {'MB':>8} {'seconds':>9} {'rows/s':>12} {'MB/s':>8} {'parse MB':>9}  vs baseline")
+        for n_deals in sizes:
+            result = run_size(n_deals, args.format, args.repeat, args.output_format, workdir)
+            key = _baseline_key(args.format, args.output_format, n_deals)
+            regressions = compare(result, baselines.get(key, {}), args.tolerance) if key in baselines else []
+            status = "no baseline" if key not in baselines else ("; ".join(regressions) or "ok")
+            print(f"{n_deals:>10,} {result['bytes'] / 1e6:>8.1f} {result['seconds']:>9.3f} "
+                  f"{result['rows_per_sec']:>12,.0f} {result['mb_per_sec']:>8.1f} {result['parse_rss_mb']:>9.1f}  {status}")
+            all_regressions.extend(f"{key}: {message}" for message in regressions)
+            if args.save_baseline:
+                baselines[key] = dict(result, python=platform.python_version(), machine=platform.machine())
+
+    if args.save_baseline:
+        BASELINE_PATH.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"Baselines written to {BASELINE_PATH}")
+
+    if all_regressions:
+        print("\nRegressions:\n  " + "\n  ".join(all_regressions))
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# benchmarks/statement_generator.py
+"""
+Synthetic MT5-style trade history statements for benchmarking core.statement_processor.
+
+The section headers come from settings.SECTION_RAW_HEADERS_STATEMENT_PARSING, numbers use the
+MT5 "10 000.00" style, and the Summary / Results blocks are computed from the generated deals,
+so no real client file is needed.
+
+Usage:
+    python -m benchmarks.statement_generator --deals 100000 --out /tmp/statement_100k.csv
+    python -m benchmarks.statement_generator --deals 1000 --format html --out /tmp/statement_1k.html
+"""
+
+import argparse
+import csv
+import html
+import io
+import random
+from datetime import datetime, timedelta
+
+from config import settings
+
+_SYMBOLS = [
+    ("XAUUSD", 2010.0, 2), ("EURUSD", 1.0850, 5), ("GBPUSD", 1.2650, 5),
+    ("USDJPY", 148.50, 3), ("US30", 37500.0, 1), ("NAS100", 16800.0, 1),
+]
+_ROW_WIDTH = 14 # จำนวนคอลัมน์ของแถวใน CSV export ของ MT5
+
+def _money(value: float) -> str:
+    """MT5 number style: space as thousands separator, two decimals ("-10 000.00")."""
+    return f"{value:,.2f}".replace(",", " ")
+
+def _price(value: float, digits: int) -> str:
+    return f"{value:,.{digits}f}".replace(",", " ")
+
+def _pad(*cells) -> str:
+    return ",".join(list(cells) + [""] * (_ROW_WIDTH - len(cells)))
+
+def _timestamp(moment: datetime) -> str:
+    return moment.strftime("%Y.%m.%d %H:%M:%S")
+
+def generate_statement_csv(n_deals: int, n_orders: int = None, n_positions: int = None,
+                           seed: int = 0, start: datetime = datetime(2024, 1, 1)) -> str:
+    """
+    Builds the text of an MT5 CSV statement.
+
+    Args:
+        n_deals: trade deals (one deposit balance deal and a withdrawal every ~5000 deals are added on top).
+        n_orders / n_positions: rows in those sections (default n_deals // 2).
+        seed: random seed, the same arguments always produce the same file.
+    """
+    rng = random.Random(seed)
+    n_orders = n_deals // 2 if n_orders is None else n_orders
+    n_positions = n_deals // 2 if n_positions is None else n_positions
+    step = timedelta(seconds=max(1, int(365 * 24 * 3600 / max(n_deals, 1))))
+    out = io.StringIO()
+    write = out.write
+
+    write(_pad("Trade History Report") + "\n")
+    write(_pad("Name:", "", "", "Benchmark Trader") + "\n")
+    write(_pad("Account:", "", "", '"10000001 (USD, Demo, Hedge)"') + "\n")
+    write(_pad("Company:", "", "", "Synthetic Broker Ltd") + "\n")
+    write(_pad("Date:", "", "", start.strftime("%Y.%m.%d %H:%M")) + "\n")
+
+    # --- Positions ---
+    write(_pad("Positions") + "\n")
+    write(settings.SECTION_RAW_HEADERS_STATEMENT_PARSING["Positions"] + "\n")
+    moment = start
+    for i in range(n_positions):
+        symbol, base_price, digits = rng.choice(_SYMBOLS)
+        open_price = base_price * rng.uniform(0.98, 1.02)
+        close_price = open_price * rng.uniform(0.995, 1.005)
+        moment += step * 2
+        write(",".join([
+            _timestamp(moment), str(500000 + i), symbol, rng.choice(("buy", "sell")), f"{rng.choice((0.01, 0.1, 0.5, 1.0)):.2f}",
+            _price(open_price, digits), "", "", _timestamp(moment + step), _price(close_price, digits),
+            _money(-rng.uniform(0, 5)), _money(-rng.uniform(0, 2)), _money(rng.uniform(-300, 300)), "",
+        ]) + "\n")
+    write(_pad() + "\n")
+
+    # --- Orders ---
+    write(_pad("Orders") + "\n")
+    write(settings.SECTION_RAW_HEADERS_STATEMENT_PARSING["Orders"] + "\n")
+    moment = start
+    for i in range(n_orders):
+        symbol, base_price, digits = rng.choice(_SYMBOLS)
+        volume = rng.choice((0.01, 0.1, 0.5, 1.0))
+        moment += step * 2
+        order_type, price = ("buy", "market") if i % 3 else ("buy limit", _price(base_price * rng.uniform(0.98, 1.0), digits))
+        write(",".join([
+            _timestamp(moment), str(700000 + i), symbol, order_type, f"{volume:.2f} / {volume:.2f}", price,
+            "", "", _timestamp(moment), "filled" if i % 10 else "canceled", "", "", "", "",
+        ]) + "\n")
+    write(_pad() + "\n")
+
+    # --- Deals ---
+    write(_pad("Deals") + "\n")
+    write(settings.SECTION_RAW_HEADERS_STATEMENT_PARSING["Deals"] + "\n")
+    balance = 100000.0
+    moment = start
+    write(",".join([_timestamp(moment), "900000", "", "balance", "", "", "", "", "0.00", "0.00", "0.00",
+                    _money(balance), _money(balance), "Deposit"]) + "\n")
+    gross_profit = gross_loss = 0.0
+    wins = losses = 0
+    withdrawals = 0.0
+    for i in range(n_deals):
+        moment += step
+        if i and i % 5000 == 0:
+            amount = round(rng.uniform(100, 1000), 2)
+            balance -= amount
+            withdrawals += amount
+            write(",".join([_timestamp(moment), str(800000 + i), "", "balance", "", "", "", "", "0.00", "0.00", "0.00",
+                            _money(-amount), _money(balance), f"Withdrawal W-{i}"]) + "\n")
+        symbol, base_price, digits = rng.choice(_SYMBOLS)
+        closing = i % 2 == 1
+        profit = round(rng.uniform(-250, 260), 2) if closing else 0.0
+        commission = -round(rng.uniform(0, 5), 2)
+        balance += profit + commission
+        if profit > 0:
+            gross_profit, wins = gross_profit + profit, wins + 1
+        elif profit < 0:
+            gross_loss, losses = gross_loss + profit, losses + 1
+        write(",".join([
+            _timestamp(moment), str(1000000 + i), symbol, rng.choice(("buy", "sell")), "out" if closing else "in",
+            f"{rng.choice((0.01, 0.1, 0.5, 1.0)):.2f}", _price(base_price * rng.uniform(0.98, 1.02), digits),
+            str(700000 + i // 2), _money(commission), "0.00", "0.00", _money(profit), _money(balance),
+            rng.choice(("", "", "sl", "tp", f"#{i}")),
+        ]) + "\n")
+    write(_pad() + "\n")
+    write(_pad() + "\n")
+
+    # --- Summary / Results ---
+    net_profit = gross_profit + gross_loss
+    total_trades = wins + losses
+    profit_factor = gross_profit / abs(gross_loss) if gross_loss else 0.0
+    write(_pad("Summary") + "\n")
+    write(_pad("Balance:", "", "", _money(balance), "", "Free Margin:", "", "", _money(balance)) + "\n")
+    write(_pad("Credit Facility:", "", "", "0.00", "", "Margin:", "", "", "0.00") + "\n")
+    write(_pad("Floating P/L:", "", "", "0.00", "", "Margin Level:", "", "", "0.00%") + "\n")
+    write(_pad("Equity:", "", "", _money(balance)) + "\n")
+    write(_pad() + "\n")
+    write(_pad("Results") + "\n")
+    write(_pad("Total Net Profit:", "", "", _money(net_profit), "Gross Profit:", "", "", _money(gross_profit),
+               "Gross Loss:", "", "", _money(gross_loss)) + "\n")
+    write(_pad("Profit Factor:", "", "", f"{profit_factor:.2f}", "Expected Payoff:", "", "",
+               f"{(net_profit / total_trades if total_trades else 0.0):.2f}") + "\n")
+    write(_pad("Total Trades:", "", "", str(total_trades), "Short Trades (won %):", "", "", f"{total_trades // 2} (50.00%)",
+               "Long Trades (won %):", "", "", f"{total_trades - total_trades // 2} (50.00%)") + "\n")
+    write(_pad("", "", "", "", "Profit Trades (% of total):", "", "",
+               f"{wins} ({(100 * wins / total_trades if total_trades else 0):.2f}%)",
+               "Loss Trades (% of total):", "", "", f"{losses} ({(100 * losses / total_trades if total_trades else 0):.2f}%)") + "\n")
+    write(_pad("Balance Drawdown Absolute:", "", "", "0.00", "Balance Drawdown Maximal:", "", "", f"{_money(withdrawals)} (1.00%)",
+               "Balance Drawdown Relative:", "", "", f"1.00% ({_money(withdrawals)})") + "\n")
+    return out.getvalue()
+
+def csv_to_html(csv_text: str) -> bytes:
+    """Converts a generated CSV statement to an MT5-like HTML report (UTF-16, colspan cells, hidden filler cells)."""
+    out = ['<!DOCTYPE html>', '<html><head><meta charset="utf-16"><title>Report</title></head><body>',
+           '<div><table cellspacing="1">']
+    for row in csv.reader(io.StringIO(csv_text)):
+        cells, i = [], 0
+        while i < len(row):
+            j = i + 1
+            while j < len(row) and row[j] == '' and row[i] != '':
+                j += 1
+            span = f' colspan="{j - i}"' if j - i > 1 else ''
+            cells.append(f'<td{span}>{html.escape(row[i])}</td>')
+            i = j
+        out.append('<tr align="right">' + ''.join(cells) + '<td class="hidden" colspan="8"></td></tr>')
+    out.append('</table></div></body></html>')
+    return '\n'.join(out).encode('utf-16')
+
+def generate_statement(n_deals: int, n_orders: int = None, n_positions: int = None,
+                       seed: int = 0, fmt: str = 'csv') -> bytes:
+    """Returns the file bytes of a synthetic statement ('csv' as UTF-8, 'html' as UTF-16)."""
+    csv_text = generate_statement_csv(n_deals, n_orders, n_positions, seed)
+    if fmt == 'html':
+        return csv_to_html(csv_text)
+    if fmt != 'csv':
+        raise ValueError(f"fmt must be 'csv' or 'html', got {fmt!r}")
+    return csv_text.encode('utf-8')
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic MT5 statement")
+    parser.add_argument("--deals", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=None)
+    parser.add_argument("--positions", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=("csv", "html"), default="csv")
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+    with open(args.out, "wb") as handle:
+        handle.write(generate_statement(args.deals, args.orders, args.positions, args.seed, args.format))
+
+if __name__ == "__main__":
+    main()
@@ -36,7 +36,7 @@ WORKSHEET_HEADERS = {
         'EnableScaling', 'ScalingCheckFrequency', 'ScaleUp_MinWinRate',
         'ScaleUp_MinGainPercent', 'ScaleUp_RiskIncrementPercent', 'ScaleDown_MaxLossPercent',
         'ScaleDown_LowWinRate', 'ScaleDown_RiskDecrementPercent', 'MinRiskPercentAllowed',
-        'MaxRiskPercentAllowed', 'CurrentRiskPercent',
+        'MaxRiskPercentAllowed', 'CurrentRiskPercent', 'ConsistencyRulePercent',
         'AccountID',
         'AccountType'
     ],
@@ -102,6 +102,91 @@ WORKSHEET_HEADERS = {
     ]
 }
 
+# --- Time column of each table (server-side time-range filters in supabase_handler) ---
+TABLE_TIME_COLUMNS = {
+    SUPABASE_TABLE_ACTUAL_TRADES: "Time_Deal",
+    SUPABASE_TABLE_ACTUAL_ORDERS: "Open_Time_Ord",
+    SUPABASE_TABLE_ACTUAL_POSITIONS: "Time_Pos",
+    SUPABASE_TABLE_DEPOSIT_WITHDRAWAL_LOGS: "DateTime",
+    SUPABASE_TABLE_STATEMENT_SUMMARIES: "Timestamp",
+    SUPABASE_TABLE_PLANNED_LOGS: "Timestamp",
+    SUPABASE_TABLE_UPLOAD_HISTORY: "UploadTimestamp",
+}
+
+# --- Named column projections (load_data_from_table(..., columns="<name>")) ---
+# ผู้ใช้ข้อมูลแต่ละจุดโหลดเฉพาะคอลัมน์ที่ต้องใช้ แต่ละ projection ถูก cache แยกกัน
+# ทุกคอลัมน์ต้องอยู่ใน WORKSHEET_HEADERS ของตารางนั้น (ตรวจตอน import ใน supabase_handler)
+TABLE_PROJECTIONS = {
+    "edge_score": {
+        "table": SUPABASE_TABLE_ACTUAL_TRADES,
+        "columns": ["PortfolioID", "Type_Deal", "Direction_Deal", "Profit_Deal", "Time_Deal"],
+    },
+    "sidebar_portfolios": {
+        "table": SUPABASE_TABLE_PORTFOLIOS,
+        "columns": ["PortfolioID", "PortfolioName", "InitialBalance", "ProfitTargetPercent", "ConsistencyRulePercent"],
+    },
+}
+
+# --- Paginated loads (supabase_handler._fetch_all_pages) ---
+# ขนาดหน้าไม่ควรเกิน max-rows ของ PostgREST (ค่าเริ่มต้น 1000) และจำนวน thread ที่ดึงหน้าพร้อมกัน
+SUPABASE_PAGE_SIZE = 1000
+SUPABASE_FETCH_MAX_WORKERS = 4
+
+# --- Local mirror (core/local_mirror.py) ---
+# ตารางใหญ่ที่โหลดต่อ portfolio เก็บสำเนาเป็น Parquet ในเครื่อง และ sync เฉพาะแถวใหม่ด้วย watermark column
+# ImportBatchID = เวลา import (epoch วินาที) ถูกเขียนใหม่ทุกครั้งที่ upsert จึงเห็นทั้งแถวใหม่และแถวที่ถูกแก้
+LOCAL_MIRROR_ENABLED = True
+LOCAL_MIRROR_DIR = ".cache/table_mirror"
+LOCAL_MIRROR_SYNC_COLUMNS = {
+    SUPABASE_TABLE_ACTUAL_TRADES: "ImportBatchID",
+    SUPABASE_TABLE_ACTUAL_ORDERS: "ImportBatchID",
+    SUPABASE_TABLE_ACTUAL_POSITIONS: "ImportBatchID",
+    SUPABASE_TABLE_STATEMENT_SUMMARIES: "ImportBatchID",
+    SUPABASE_TABLE_PLANNED_LOGS: "Timestamp",
+}
+# โหลดเต็มใหม่เป็นระยะ เพื่อให้เห็นแถวที่ถูกลบฝั่ง server (delta sync มองไม่เห็นการลบ)
+LOCAL_MIRROR_FULL_RESYNC_HOURS = 24
+
+# --- Write-behind queue (core/write_behind.py) ---
+# Trade plan / checklist ถูกเก็บลง spool (SQLite) ในเครื่องก่อน แล้วส่งเป็น batch เบื้องหลัง
+# เมื่อค้างครบ WRITE_BEHIND_BATCH_SIZE รายการ หรือทุก WRITE_BEHIND_FLUSH_INTERVAL_SECONDS วินาที
+WRITE_BEHIND_ENABLED = True
+WRITE_BEHIND_SPOOL_PATH = ".cache/write_behind.sqlite3"
+WRITE_BEHIND_BATCH_SIZE = 50
+WRITE_BEHIND_FLUSH_INTERVAL_SECONDS = 2.0
+# worker ส่งซ้ำได้ (at-least-once) จึงเขียนด้วย upsert(on_conflict=key, ignore_duplicates=True) ไม่ให้เกิดแถวซ้ำ
+# key เป็น id ที่สร้างฝั่ง client ตอน enqueue ตาราง trades ต้อง migrate ก่อนจึงจะกันแถวซ้ำได้:
+#   ALTER TABLE trades ADD COLUMN IF NOT EXISTS client_action_id text UNIQUE;
+# ถ้ายังไม่มีคอลัมน์/unique constraint worker จะถอยไปใช้ insert ธรรมดา (ดู supabase_handler._write_behind_batch)
+WRITE_BEHIND_CONFLICT_KEYS = {
+    SUPABASE_TABLE_PLANNED_LOGS: "LogID",
+    "trades": "client_action_id",
+}
+
+# จำนวน query ที่ยิงพร้อมกันตอนเริ่มหน้า (supabase_handler.prefetch_startup_data)
+STARTUP_PREFETCH_MAX_WORKERS = 6
+
+# --- Resilience (supabase_handler._execute, core/resilience.py) ---
+# timeout ต่อ request, retry แบบ jittered exponential backoff สำหรับการอ่าน/upsert ที่ล้มเหลวชั่วคราว
+# และ circuit breaker: ล้มเหลวติดกัน N ครั้ง -> หยุดเรียก backend (ใช้ข้อมูลล่าสุดที่มี) เป็นเวลา RESET วินาที
+SUPABASE_TIMEOUT_SECONDS = 10
+SUPABASE_RETRY_ATTEMPTS = 3
+SUPABASE_RETRY_BASE_DELAY_SECONDS = 0.3
+SUPABASE_RETRY_MAX_DELAY_SECONDS = 5.0
+# HTTP status ที่ถือว่าชั่วคราว (rate limit / gateway / server ล่มชั่วคราว) ส่วน 4xx อื่นเป็น error ถาวร
+SUPABASE_RETRY_HTTP_STATUSES = (429, 500, 502, 503, 504)
+SUPABASE_CIRCUIT_FAILURE_THRESHOLD = 5
+SUPABASE_CIRCUIT_RESET_SECONDS = 30
+# จำนวน (ตาราง, portfolio) ที่เก็บผลโหลดสำเร็จล่าสุดไว้ในหน่วยความจำเพื่อแสดงแทนเมื่อ backend ล่ม (LRU)
+SUPABASE_STALE_FRAMES_MAX_ENTRIES = 32
+
+# --- Chunked statement saves (supabase_handler.save_statement_data) ---
+# จำนวนแถวต่อ request, จำนวน request ที่ส่งพร้อมกัน และจำนวนครั้งที่ retry chunk ที่ล้มเหลว (backoff เพิ่มเท่าตัว)
+SUPABASE_WRITE_CHUNK_ROWS = 500
+SUPABASE_WRITE_MAX_WORKERS = 4
+SUPABASE_WRITE_MAX_RETRIES = 3
+SUPABASE_WRITE_RETRY_BACKOFF_SECONDS = 0.5
+
 WORKSHEET_HEADERS_MAPPER = {
     "deals": "ActualTrades",
     "orders": "ActualOrders",
@@ -131,6 +216,103 @@ SECTION_RAW_HEADERS_STATEMENT_PARSING = {
     "Deals": "Time,Deal,Symbol,Type,Direction,Volume,Price,Order,Commission,Fee,Swap,Profit,Balance,Comment"
 }
 
+# --- Numeric columns of each statement section ---
+# ทุกคอลัมน์ในรายการนี้จะถูกทำความสะอาด (ช่องว่าง, จุลภาค, ขีดยาว) และแปลงเป็นตัวเลขในรอบเดียว
+STATEMENT_NUMERIC_COLUMNS = {
+    SUPABASE_TABLE_ACTUAL_TRADES: [
+        "Volume_Deal", "Price_Deal", "Commission_Deal", "Fee_Deal", "Swap_Deal", "Profit_Deal", "Balance_Deal"
+    ],
+    SUPABASE_TABLE_ACTUAL_ORDERS: [
+        "Price_Ord", "S_L_Ord", "T_P_Ord", "Volume_Ord"
+    ],
+    SUPABASE_TABLE_ACTUAL_POSITIONS: [
+        "Volume_Pos", "Price_Open_Pos", "S_L_Pos", "T_P_Pos", "Price_Close_Pos", "Commission_Pos", "Swap_Pos", "Profit_Pos"
+    ],
+    SUPABASE_TABLE_DEPOSIT_WITHDRAWAL_LOGS: ["Amount"], # สร้างจาก Profit_Deal ที่แปลงแล้ว
+}
+# ข้อความที่ MT5 เขียนในช่องตัวเลขโดยตั้งใจ (เช่น Price ของ market order = "market") -> 0 เหมือนเดิม และไม่นับเป็น coercion issue
+STATEMENT_NUMERIC_ZERO_TOKENS = ["market"]
+
+# --- Fallback IDs for statement rows with a blank ID ---
+# (ID column, prefix, stable fields hashed together with the PortfolioID)
+# ไฟล์เดิมที่นำเข้าซ้ำจะได้ ID เดิมเสมอ ทำให้ upsert ไม่สร้างแถวซ้ำ
+STATEMENT_ID_FALLBACK_FIELDS = {
+    SUPABASE_TABLE_ACTUAL_TRADES: (
+        "Deal_ID", "DEAL-", ["Time_Deal", "Symbol_Deal", "Type_Deal", "Volume_Deal", "Price_Deal"]
+    ),
+    SUPABASE_TABLE_ACTUAL_ORDERS: (
+        "Order_ID_Ord", "ORD-", ["Open_Time_Ord", "Symbol_Ord", "Type_Ord", "Volume_Ord", "Price_Ord"]
+    ),
+    SUPABASE_TABLE_ACTUAL_POSITIONS: (
+        "Position_ID", "POS-", ["Time_Pos", "Symbol_Pos", "Type_Pos", "Volume_Pos", "Price_Open_Pos"]
+    ),
+}
+
+# --- Classification of balance deals (Type = balance) by their comment ---
+# ตรวจตามลำดับ กฎแรกที่ตรงจะถูกใช้ (เทียบแบบ substring ไม่สนตัวพิมพ์เล็ก/ใหญ่)
+# Balance deals that match no rule are labelled "Unknown" and not logged.
+DEPOSIT_WITHDRAWAL_COMMENT_RULES = [
+    ("Withdrawal", ["w", "withdraw"]),
+    ("Deposit", ["d", "deposit", "create"]),
+]
+
+# --- Time columns of each statement section and how to read them ---
+STATEMENT_TIME_COLUMNS = {
+    SUPABASE_TABLE_ACTUAL_TRADES: ["Time_Deal"],
+    SUPABASE_TABLE_ACTUAL_ORDERS: ["Open_Time_Ord", "Close_Time_Ord"],
+    SUPABASE_TABLE_ACTUAL_POSITIONS: ["Time_Pos", "Time_Close_Pos"],
+    SUPABASE_TABLE_DEPOSIT_WITHDRAWAL_LOGS: ["DateTime"], # สร้างจาก Time_Deal ที่แปลงแล้ว
+}
+# Low-cardinality text columns that are dictionary-encoded in the columnar (Arrow) output
+# (the import metadata columns hold one value per file)
+_STATEMENT_IMPORT_METADATA_COLUMNS = ["PortfolioID", "PortfolioName", "SourceFile", "ImportBatchID"]
+STATEMENT_DICTIONARY_COLUMNS = {
+    SUPABASE_TABLE_ACTUAL_TRADES: ["Symbol_Deal", "Type_Deal", "Direction_Deal"] + _STATEMENT_IMPORT_METADATA_COLUMNS,
+    SUPABASE_TABLE_ACTUAL_ORDERS: ["Symbol_Ord", "Type_Ord", "State_Ord"] + _STATEMENT_IMPORT_METADATA_COLUMNS,
+    SUPABASE_TABLE_ACTUAL_POSITIONS: ["Symbol_Pos", "Type_Pos"] + _STATEMENT_IMPORT_METADATA_COLUMNS,
+    SUPABASE_TABLE_DEPOSIT_WITHDRAWAL_LOGS: ["Type"] + _STATEMENT_IMPORT_METADATA_COLUMNS,
+}
+# Candidate formats; the parser sniffs one per file from the first time values it sees
+STATEMENT_TIME_FORMATS = [
+    "%Y.%m.%d %H:%M:%S", "%Y.%m.%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M",
+    "%d.%m.%Y %H:%M:%S", "%d/%m/%Y %H:%M:%S",
+]
+# Timezone of the broker's trade server (the clock shown in the statement), e.g. "EET" or "Etc/GMT-3"
+# เวลาใน Statement จะถูกตีความตาม timezone นี้แล้วแปลงเป็น UTC ก่อนบันทึก
+BROKER_SERVER_TIMEZONE = "UTC"
+# พิมพ์ผลลัพธ์ที่ parse ได้ทั้งหมดลง console (ใช้ตอน debug เท่านั้น เพราะช้ามากกับไฟล์ใหญ่)
+STATEMENT_PARSER_DEBUG = False
+# จำนวนแถวต่อ chunk ที่ส่งให้ pd.read_csv ระหว่างสแกนไฟล์ (จำกัดหน่วยความจำกับ statement ขนาดใหญ่)
+STATEMENT_PARSE_CHUNK_ROWS = 20000
+
+# --- Parse cache (core/parse_cache.py) ---
+# ผลการ parse ของแต่ละไฟล์ถูกเก็บลงดิสก์ (Parquet) ตาม file hash + parser version
+# อัปโหลดซ้ำ / ลองใหม่หลังบันทึกล้มเหลว / ใช้ไฟล์เดิมกับอีก Portfolio จะไม่ต้อง parse ใหม่
+STATEMENT_PARSE_CACHE_ENABLED = True
+STATEMENT_PARSE_CACHE_DIR = ".cache/statement_parse"
+STATEMENT_PARSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# --- Batch statement ingest ---
+# จำนวน worker process สูงสุดตอน parse หลายไฟล์พร้อมกัน (None = ตามจำนวน CPU)
+STATEMENT_BATCH_MAX_WORKERS = 4
+# วิธีสร้าง worker process: Streamlit มีหลาย thread (tornado, write-behind, prefetch) การ fork อาจค้างเพราะ lock ที่ติดมา
+# จึงใช้ "spawn" (หรือ "forkserver") แทนค่าเริ่มต้น "fork" ของ Linux
+STATEMENT_BATCH_START_METHOD = "spawn"
+# อัปโหลดเฉพาะรายการที่ใหม่กว่า deal ล่าสุดที่เคย import (high-water mark ต่อ Portfolio)
+STATEMENT_INCREMENTAL_INGEST = True
+# Unique key ที่ใช้ upsert ของแต่ละตาราง (ใช้ตัดแถวซ้ำข้ามไฟล์ก่อนบันทึกรวมครั้งเดียว)
+STATEMENT_UPSERT_CONFLICT_KEYS = {
+    SUPABASE_TABLE_ACTUAL_TRADES: "Deal_ID",
+    SUPABASE_TABLE_ACTUAL_ORDERS: "Order_ID_Ord",
+    SUPABASE_TABLE_ACTUAL_POSITIONS: "Position_ID",
+    SUPABASE_TABLE_DEPOSIT_WITHDRAWAL_LOGS: "TransactionID",
+    SUPABASE_TABLE_UPLOAD_HISTORY: "FileHash",
+    SUPABASE_TABLE_STATEMENT_SUMMARIES: "PortfolioID",
+    SUPABASE_TABLE_PORTFOLIOS: "PortfolioID",
+}
+# Unique column used to order paged loads (a stable order keeps concurrent pages from overlapping)
+TABLE_PAGINATION_KEYS = {**STATEMENT_UPSERT_CONFLICT_KEYS, SUPABASE_TABLE_PLANNED_LOGS: "LogID"}
+
 # =========================================================================
 # II. APPLICATION DEFAULTS & BEHAVIOR
 # =========================================================================
@@ -7,12 +7,14 @@ def calculate_edge_score_metrics(df_all_actual_trades: pd.DataFrame, active_port
     คำนวณ Metrics ทั้งหมดที่เกี่ยวข้องกับ Edge Score จากข้อมูลการเทรดจริง
 
     Args:
-        df_all_actual_trades (pd.DataFrame): DataFrame ที่มีข้อมูลการเทรดจริงทั้งหมด
+        df_all_actual_trades (pd.DataFrame | pyarrow.Table): ข้อมูลการเทรดจริงทั้งหมด
         active_portfolio_id (str): ID ของพอร์ตที่กำลังใช้งาน
 
     Returns:
         dict: Dictionary ที่มีค่าสถิติทั้งหมด หรือ None หากมีข้อมูลไม่เพียงพอ
     """
+    if hasattr(df_all_actual_trades, 'to_pandas'): # columnar pyarrow.Table
+        df_all_actual_trades = df_all_actual_trades.to_pandas()
     if df_all_actual_trades is None or df_all_actual_trades.empty or not active_portfolio_id:
         return None
 
@@ -20,6 +22,15 @@ def calculate_edge_score_metrics(df_all_actual_trades: pd.DataFrame, active_port
     df = df_all_actual_trades[df_all_actual_trades['PortfolioID'] == active_portfolio_id].copy()
     if df.empty:
         return None
+    # ตาราง ActualTrades เก็บทุก deal (projection "edge_score"): นับเป็นเทรดเฉพาะ deal ปิด buy/sell
+    # ไม่รวมฝาก/ถอน (balance) และ deal เปิด (in) ที่กำไรเป็น 0 เสมอ
+    if 'Type_Deal' in df.columns and 'Direction_Deal' in df.columns:
+        deal_types = df['Type_Deal'].astype(str).str.strip().str.lower()
+        deal_directions = df['Direction_Deal'].astype(str).str.strip().str.lower()
+        df = df[deal_types.isin(['buy', 'sell']) & deal_directions.isin(['out', 'in/out'])]
+        if df.empty:
+            return None
+    df = df.rename(columns={'Profit_Deal': 'Profit', 'Time_Deal': 'Time_Close'})
 
     # 2. แปลงชนิดข้อมูลให้ถูกต้องและคำนวณค่าพื้นฐาน
     df['Profit'] = pd.to_numeric(df['Profit'], errors='coerce').fillna(0)
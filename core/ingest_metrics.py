@@ -0,0 +1,72 @@
+# core/ingest_metrics.py
+"""
+Stage-level instrumentation for the statement ingest path
+(decode -> scan -> CSV read -> numeric clean -> time parse -> save per table).
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class IngestProfile:
+    """
+    Collects one record per ingest stage: wall time, row count and bytes.
+    Stages are recorded flat: a stage opened inside another one (e.g. the chunked csv_read
+    stages inside "decode+scan") is subtracted from the outer stage, so the records add up
+    to the real elapsed time and total_seconds() is a plain sum.
+    as_records() returns plain dicts so the UI (st.dataframe) or a log sink can consume them.
+    """
+
+    def __init__(self, source_name: str = ""):
+        self.source_name = source_name
+        self.stages = []
+        self._open_stages = [] # [record, seconds spent in nested stages]
+
+    @contextmanager
+    def stage(self, name: str, rows: int = None, bytes_count: int = None, merge: bool = False):
+        """
+        Times the enclosed block. The yielded record can be updated inside the block
+        (e.g. record['rows'] = len(df)) when the counts are only known afterwards.
+        merge=True adds into an existing record with the same name (stages run once per chunk).
+        """
+        record = {'stage': name, 'seconds': 0.0, 'rows': rows, 'bytes': bytes_count}
+        existing = self._find(name) if merge else None
+        if existing is None:
+            # Appended up front so an outer stage is listed before the stages nested in it
+            self.stages.append(record)
+        frame = [record, 0.0]
+        self._open_stages.append(frame)
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            elapsed = time.perf_counter() - started
+            self._open_stages.pop()
+            record['seconds'] = elapsed - frame[1]
+            if self._open_stages:
+                self._open_stages[-1][1] += elapsed
+            if existing is not None:
+                for key in ('seconds', 'rows', 'bytes'):
+                    if record[key] is not None:
+                        existing[key] = (existing[key] or 0) + record[key]
+
+    def _find(self, name: str):
+        return next((record for record in reversed(self.stages) if record['stage'] == name), None)
+
+    def add(self, name: str, seconds: float, rows: int = None, bytes_count: int = None):
+        self.stages.append({'stage': name, 'seconds': seconds, 'rows': rows, 'bytes': bytes_count})
+
+    def total_seconds(self) -> float:
+        return sum(record['seconds'] for record in self.stages)
+
+    def as_records(self) -> list:
+        return [{'source': self.source_name, **record} for record in self.stages]
+
+    def log(self, level: int = logging.INFO):
+        for record in self.stages:
+            logger.log(level, "ingest %s | %-28s %8.3fs rows=%s bytes=%s",
+                       self.source_name, record['stage'], record['seconds'], record['rows'], record['bytes'])
+        logger.log(level, "ingest %s | total %.3fs", self.source_name, self.total_seconds())
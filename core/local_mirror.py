@@ -0,0 +1,139 @@
+# core/local_mirror.py
+"""
+Local Parquet mirror of the large per-portfolio tables, kept current by delta sync.
+
+Each (table, portfolio) pair is one partition: <LOCAL_MIRROR_DIR>/<table>/<portfolio hash>.parquet
+plus a .json sidecar with the sync watermark. A sync asks the server only for rows whose
+watermark column (settings.LOCAL_MIRROR_SYNC_COLUMNS) is greater than or equal to the stored
+watermark, merges them into the partition by the table's key (settings.TABLE_PAGINATION_KEYS,
+newest row wins) and rewrites the file atomically.
+
+The comparison is inclusive because a whole statement import shares one ImportBatchID (and
+plan logs can share a Timestamp): rows of the watermark batch that were still being written
+during the previous sync are picked up by the next one. The re-sent rows of that batch are
+merged away by key, and the file is only rewritten when the delta changes something. Rows
+deleted on the server are picked up by the full re-fetch every
+settings.LOCAL_MIRROR_FULL_RESYNC_HOURS; drop_portfolio() is called when a portfolio is deleted.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_partition_locks = {}
+_partition_locks_guard = threading.Lock()
+
+def is_mirrored(table_name: str) -> bool:
+    return settings.LOCAL_MIRROR_ENABLED and table_name in settings.LOCAL_MIRROR_SYNC_COLUMNS
+
+def _partition_path(table_name: str, portfolio_id: str) -> Path:
+    portfolio_key = hashlib.sha256(str(portfolio_id).encode()).hexdigest()[:16]
+    return Path(settings.LOCAL_MIRROR_DIR) / table_name / f"{portfolio_key}.parquet"
+
+def _partition_lock(path: Path) -> threading.Lock:
+    # prefetch โหลดตารางเดียวกันหลาย projection พร้อมกัน: sync partition เดียวกันทีละ thread
+    with _partition_locks_guard:
+        return _partition_locks.setdefault(str(path), threading.Lock())
+
+def _read_partition(path: Path):
+    """คืนค่า (DataFrame, meta) ของ partition หรือ (None, {}) ถ้ายังไม่มี/อ่านไม่ได้"""
+    meta_path = path.with_suffix(".json")
+    if not path.exists() or not meta_path.exists():
+        return None, {}
+    try:
+        return pd.read_parquet(path), json.loads(meta_path.read_text(encoding="utf-8"))
+    except Exception as e:
+        logger.warning("ignoring unreadable mirror partition %s: %s", path, e)
+        return None, {}
+
+def _write_partition(path: Path, df: pd.DataFrame, meta: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".tmp-{os.getpid()}-{threading.get_ident()}-{path.name}")
+    try:
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path) # ผู้อ่านจะไม่เห็นไฟล์ที่เขียนไม่ครบ
+        path.with_suffix(".json").write_text(json.dumps(meta), encoding="utf-8")
+    except Exception as e:
+        # mirror เป็นแค่ตัวเร่ง: เขียนไม่ได้ (เช่น คอลัมน์ชนิดปนกัน) ก็ลบทิ้ง ครั้งหน้าจะโหลดเต็มใหม่
+        logger.warning("could not write mirror partition %s: %s", path, e)
+        for stale in (tmp_path, path, path.with_suffix(".json")):
+            stale.unlink(missing_ok=True)
+
+def _merge_rows(local_df, delta_df: pd.DataFrame, table_name: str) -> pd.DataFrame:
+    if local_df is None or local_df.empty:
+        merged = delta_df
+    elif delta_df.empty:
+        return local_df
+    else:
+        merged = pd.concat([local_df, delta_df], ignore_index=True)
+    key = settings.TABLE_PAGINATION_KEYS.get(table_name)
+    if key and key in merged.columns:
+        merged = merged.drop_duplicates(subset=[key], keep='last')
+    return merged.reset_index(drop=True)
+
+def _already_local(local_df: pd.DataFrame, delta_df: pd.DataFrame, table_name: str) -> bool:
+    """True ถ้าทุกแถวใน delta (ปกติคือ batch ของ watermark ที่ถูกส่งซ้ำ) มีอยู่ในเครื่องแล้วด้วยค่าเดียวกัน"""
+    key = settings.TABLE_PAGINATION_KEYS.get(table_name)
+    if not key or key not in delta_df.columns or key not in local_df.columns or list(delta_df.columns) != list(local_df.columns):
+        return False
+    local_rows = local_df[local_df[key].isin(delta_df[key])]
+    if len(local_rows) != len(delta_df):
+        return False
+    as_text = lambda df: df.sort_values(key).astype(str).reset_index(drop=True)
+    return as_text(local_rows).equals(as_text(delta_df))
+
+def load_synced(table_name: str, portfolio_id: str, fetch_rows) -> pd.DataFrame:
+    """
+    คืนค่าทุกแถวของ table_name สำหรับ portfolio_id จาก mirror หลัง sync แถวใหม่จาก server แล้ว
+    fetch_rows(since) ต้องคืน DataFrame ของแถวที่ sync column >= since (since=None = ทุกแถว)
+    """
+    path = _partition_path(table_name, portfolio_id)
+    sync_column = settings.LOCAL_MIRROR_SYNC_COLUMNS[table_name]
+    with _partition_lock(path):
+        started = time.perf_counter()
+        local_df, meta = _read_partition(path)
+        full_resync_due = time.time() - meta.get('full_sync_at', 0) > settings.LOCAL_MIRROR_FULL_RESYNC_HOURS * 3600
+        since = None if local_df is None or full_resync_due else meta.get('watermark')
+
+        delta_df = fetch_rows(since)
+        merged = delta_df if since is None else _merge_rows(local_df, delta_df, table_name)
+        if since is not None and (delta_df.empty or _already_local(local_df, delta_df, table_name)):
+            logger.info("mirror %s/%s: up to date (%d rows local)", table_name, portfolio_id, len(merged))
+            return merged
+
+        watermarks = merged[sync_column].dropna().astype(str) if sync_column in merged.columns else pd.Series(dtype=str)
+        meta = {
+            'table': table_name,
+            'portfolio_id': str(portfolio_id),
+            'watermark': watermarks.max() if not watermarks.empty else None,
+            'full_sync_at': time.time() if since is None else meta.get('full_sync_at', 0),
+        }
+        _write_partition(path, merged, meta)
+        logger.info("mirror %s/%s: %s sync pulled %d rows, %d rows local (%.3fs)", table_name, portfolio_id,
+                    "full" if since is None else "delta", len(delta_df), len(merged), time.perf_counter() - started)
+        return merged
+
+def read_local(table_name: str, portfolio_id: str):
+    """partition ในเครื่องตามที่มีอยู่ (ไม่ sync) ใช้เป็นข้อมูลเก่าเมื่อ backend ไม่พร้อม คืนค่า None ถ้าไม่มี"""
+    path = _partition_path(table_name, portfolio_id)
+    with _partition_lock(path):
+        local_df, _ = _read_partition(path)
+    return local_df
+
+def drop_portfolio(portfolio_id: str):
+    """ลบ partition ทั้งหมดของ portfolio นี้ (ใช้เมื่อ portfolio ถูกลบ)"""
+    for table_name in settings.LOCAL_MIRROR_SYNC_COLUMNS:
+        path = _partition_path(table_name, portfolio_id)
+        with _partition_lock(path):
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
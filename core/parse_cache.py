@@ -0,0 +1,155 @@
+# core/parse_cache.py
+"""
+On-disk cache of parsed statements, keyed by file hash + parser version.
+
+Each entry is a directory holding one Parquet file per table (deals, orders, positions,
+deposit_withdrawal_logs) and a meta.json with the summary dicts. Entries live under a
+directory named after the parser fingerprint, so any change to PARSER_VERSION, the parser
+source or the parsing settings starts a fresh namespace; older namespaces are purged.
+Total size is bounded by settings.STATEMENT_PARSE_CACHE_MAX_BYTES with LRU eviction
+(recency = directory mtime, refreshed on every hit).
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from config import settings
+from core import statement_processor
+
+_TABLE_KEYS = ('deals', 'orders', 'positions', 'deposit_withdrawal_logs')
+_META_KEYS = ('balance_summary', 'results_summary', 'portfolio_details', 'final_summary_data', 'coercion_issues')
+# ไฟล์ที่ไม่มีแถวไหนใช้ fallback ID ให้ผลเหมือนกันทุก Portfolio จึงแชร์ entry เดียว
+_SHARED_SCOPE = "any"
+
+def _parser_fingerprint() -> str:
+    """PARSER_VERSION + hash of the parser source and the settings it reads."""
+    digest = hashlib.sha256(statement_processor.PARSER_VERSION.encode())
+    digest.update(Path(statement_processor.__file__).read_bytes())
+    for name in statement_processor.PARSER_SETTINGS:
+        digest.update(f"{name}={getattr(settings, name, None)!r}".encode())
+    return f"v{statement_processor.PARSER_VERSION}-{digest.hexdigest()[:12]}"
+
+_PARSER_FINGERPRINT = _parser_fingerprint()
+
+def _cache_root() -> Path:
+    return Path(settings.STATEMENT_PARSE_CACHE_DIR)
+
+def _entry_dir(file_hash: str, scope: str) -> Path:
+    scope_key = _SHARED_SCOPE if scope == _SHARED_SCOPE else hashlib.sha256(str(scope).encode()).hexdigest()[:16]
+    return _cache_root() / _PARSER_FINGERPRINT / f"{file_hash}-{scope_key}"
+
+def _uses_fallback_ids(extracted_data: dict) -> bool:
+    """True when any row got a generated ID (those IDs include the portfolio, so the entry is portfolio-specific)."""
+    for key, table_name in (('deals', settings.SUPABASE_TABLE_ACTUAL_TRADES),
+                            ('orders', settings.SUPABASE_TABLE_ACTUAL_ORDERS),
+                            ('positions', settings.SUPABASE_TABLE_ACTUAL_POSITIONS)):
+        df = extracted_data.get(key)
+        id_col, prefix, _ = settings.STATEMENT_ID_FALLBACK_FIELDS[table_name]
+        if isinstance(df, pd.DataFrame) and id_col in df.columns and df[id_col].astype(str).str.startswith(prefix).any():
+            return True
+    return False
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    raise TypeError(f"Cannot serialize {type(value)}")
+
+def _entry_size(path: Path) -> int:
+    return sum(child.stat().st_size for child in path.iterdir() if child.is_file())
+
+def load_cached_parse(file_hash: str, portfolio_id=None):
+    """
+    Returns the cached extracted_data for this file (shared entry first, then the
+    portfolio-specific one), or None on a miss. A hit refreshes the entry's LRU position.
+    """
+    if not settings.STATEMENT_PARSE_CACHE_ENABLED:
+        return None
+    for scope in (_SHARED_SCOPE, str(portfolio_id or '')):
+        entry = _entry_dir(file_hash, scope)
+        meta_path = entry / "meta.json"
+        if not meta_path.exists():
+            continue
+        try:
+            started = time.perf_counter()
+            extracted_data = json.loads(meta_path.read_text(encoding="utf-8"))
+            for key in _TABLE_KEYS:
+                extracted_data[key] = pd.read_parquet(entry / f"{key}.parquet")
+            os.utime(entry)
+            extracted_data['ingest_profile'] = [{'source': '', 'stage': 'parse_cache_hit',
+                                                 'seconds': time.perf_counter() - started, 'rows': None, 'bytes': None}]
+            return extracted_data
+        except Exception as e:
+            print(f"Warning: ignoring unreadable parse cache entry {entry}: {e}")
+            shutil.rmtree(entry, ignore_errors=True)
+    return None
+
+def store_parsed_result(file_hash: str, portfolio_id, extracted_data: dict) -> bool:
+    """
+    Writes extracted_data (pandas output of extract_data_from_report_content) to the cache,
+    then evicts least recently used entries beyond the size limit. Never raises.
+    """
+    if not settings.STATEMENT_PARSE_CACHE_ENABLED:
+        return False
+    scope = str(portfolio_id or '') if _uses_fallback_ids(extracted_data) else _SHARED_SCOPE
+    entry = _entry_dir(file_hash, scope)
+    try:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=".tmp-", dir=entry.parent))
+        for key in _TABLE_KEYS:
+            df = extracted_data.get(key)
+            if not isinstance(df, pd.DataFrame):
+                df = pd.DataFrame()
+            df.to_parquet(staging / f"{key}.parquet")
+        meta = {key: extracted_data.get(key, {}) for key in _META_KEYS}
+        (staging / "meta.json").write_text(json.dumps(meta, default=_json_default), encoding="utf-8")
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(staging, entry) # เขียนเสร็จแล้วค่อยย้ายเข้าที่ ผู้อ่านจะไม่เห็น entry ที่เขียนไม่ครบ
+    except Exception as e:
+        print(f"Warning: could not write parse cache entry {entry}: {e}")
+        if 'staging' in locals():
+            shutil.rmtree(staging, ignore_errors=True)
+        return False
+    evict_parse_cache()
+    return True
+
+def evict_parse_cache(max_bytes: int = None):
+    """Drops other parser versions, then least recently used entries until the cache fits in max_bytes."""
+    root = _cache_root()
+    if not root.exists():
+        return
+    max_bytes = settings.STATEMENT_PARSE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    for version_dir in root.iterdir():
+        if version_dir.is_dir() and version_dir.name != _PARSER_FINGERPRINT:
+            shutil.rmtree(version_dir, ignore_errors=True)
+
+    current = root / _PARSER_FINGERPRINT
+    if not current.exists():
+        return
+    entries = []
+    for entry in current.iterdir():
+        if entry.name.startswith(".tmp-"):
+            # staging dir ของการเขียนที่ค้างไว้ (process ถูก kill กลางทาง)
+            if time.time() - entry.stat().st_mtime > 3600:
+                shutil.rmtree(entry, ignore_errors=True)
+            continue
+        if entry.is_dir():
+            try:
+                entries.append((entry.stat().st_mtime, _entry_size(entry), entry))
+            except OSError:
+                continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries, key=lambda item: item[0]):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
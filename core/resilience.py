@@ -0,0 +1,107 @@
+# core/resilience.py
+"""
+Retry with jittered exponential backoff and a circuit breaker for calls to the database.
+
+retry_call() retries only transient failures (network errors, timeouts, 5xx/429) and only for
+idempotent operations. Every attempt goes through the CircuitBreaker: after
+failure_threshold consecutive transient failures it opens and rejects calls immediately
+(CircuitOpenError) for reset_seconds, so a degraded backend is not hammered by every section;
+then one trial call is let through (half-open) and its outcome closes or re-opens the circuit.
+"""
+
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the backend while the circuit is open."""
+
+
+class CircuitBreaker:
+    """Closed -> (failure_threshold transient failures) -> open -> (reset_seconds) -> half-open -> closed/open."""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def before_call(self):
+        """Raises CircuitOpenError when the call must not reach the backend."""
+        with self._lock:
+            state = self._state()
+            if state == "open" or (state == "half-open" and self._trial_in_flight):
+                raise CircuitOpenError(f"{self.name} circuit is open (backend unhealthy), skipping call")
+            if state == "half-open":
+                self._trial_in_flight = True # ปล่อยผ่านแค่ call เดียวเพื่อทดสอบ
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("%s circuit closed (backend healthy again)", self.name)
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            was_trial, self._trial_in_flight = self._trial_in_flight, False
+            if was_trial or self._failures >= self.failure_threshold:
+                if self._opened_at is None or was_trial:
+                    logger.warning("%s circuit opened after %d failures", self.name, self._failures)
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """Call ended without telling anything about backend health (e.g. a 4xx): free the trial slot."""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+def retry_call(fn, *, is_transient, idempotent: bool, breaker: CircuitBreaker = None,
+               attempts: int = 3, base_delay: float = 0.3, max_delay: float = 5.0, name: str = "call"):
+    """
+    Runs fn() and returns its result. Transient failures of idempotent calls are retried up to
+    `attempts` times in total with full-jitter exponential backoff; everything else is raised.
+    """
+    attempts = max(int(attempts), 1) if idempotent else 1
+    for attempt in range(1, attempts + 1):
+        if breaker is not None:
+            breaker.before_call()
+        try:
+            result = fn()
+        except Exception as e:
+            transient = is_transient(e)
+            if breaker is not None:
+                if transient:
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+            if not transient or attempt == attempts:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+            logger.warning("%s failed (attempt %d/%d): %s; retrying in %.2fs", name, attempt, attempts, e, delay)
+            time.sleep(delay)
+        else:
+            if breaker is not None:
+                breaker.record_success()
+            return result
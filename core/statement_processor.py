@@ -6,33 +6,705 @@ import re
 from datetime import datetime
 from config import settings
 import numpy as np
-import pytz
-import uuid # เพิ่ม import uuid ตรงนี้
+import codecs
+import csv
+import itertools
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from functools import lru_cache
+from html.parser import HTMLParser
+
+# Bump whenever the parsed output changes shape or meaning (invalidates core.parse_cache entries)
+PARSER_VERSION = "1"
+# Settings that influence the parsed output (also part of the parse cache fingerprint)
+PARSER_SETTINGS = (
+    "WORKSHEET_HEADERS", "SECTION_RAW_HEADERS_STATEMENT_PARSING", "STATEMENT_NUMERIC_COLUMNS",
+    "STATEMENT_NUMERIC_ZERO_TOKENS", "STATEMENT_ID_FALLBACK_FIELDS", "DEPOSIT_WITHDRAWAL_COMMENT_RULES", "STATEMENT_TIME_COLUMNS",
+    "STATEMENT_TIME_FORMATS", "BROKER_SERVER_TIMEZONE",
+)
+
+# --- Section layout: precompiled once, shared by every parse ---
+_SECTION_ORDER = ["Positions", "Orders", "Deals"]
+
+def _compile_section_header_pattern(header_text: str) -> re.Pattern:
+    """Builds the tolerant header regex (flexible spaces, optional trailing commas)."""
+    return re.compile(r'^' + re.escape(header_text).replace(r'\ ', r'\s*').replace(r'\,', ',') + r'\s*,*$')
+
+_SECTION_HEADER_PATTERNS = {
+    name: _compile_section_header_pattern(header_text)
+    for name, header_text in settings.SECTION_RAW_HEADERS_STATEMENT_PARSING.items()
+}
+# Lines that close the current table: summary blocks and bare section titles ("Orders,,,,")
+_SUMMARY_START_PATTERN = re.compile(r"^(?:Balance:|Credit Facility:|Total Net Profit:|Open Positions|Results)")
+_SECTION_TITLE_PATTERN = re.compile(r"^[A-Za-z][A-Za-z ]*,*$")
+_BLANK_ROW_PATTERN = re.compile(r",*")
+
+_SECTION_TARGET_TABLES = {
+    "Positions": settings.SUPABASE_TABLE_ACTUAL_POSITIONS,
+    "Orders": settings.SUPABASE_TABLE_ACTUAL_ORDERS,
+    "Deals": settings.SUPABASE_TABLE_ACTUAL_TRADES,
+}
+
+def _match_section_header(line_stripped: str):
+    """Returns the section name whose raw header matches this line, or None."""
+    if not line_stripped[:1].isalpha(): # headers start with a letter, data rows with a date/number
+        return None
+    for name, pattern in _SECTION_HEADER_PATTERNS.items():
+        if pattern.match(line_stripped):
+            return name
+    return None
+
+@lru_cache(maxsize=None)
+def _template_column_names(section_name: str) -> tuple:
+    """Column names pandas infers from the raw header template (e.g. 'Time.1', 'Unnamed: 10')."""
+    temp_io = io.StringIO(settings.SECTION_RAW_HEADERS_STATEMENT_PARSING[section_name])
+    return tuple(pd.read_csv(temp_io, nrows=0, skipinitialspace=True, dtype=str).columns)
+
+def _clean_and_float(value_str):
+    if value_str is None: return 0.0
+    s = str(value_str).strip().replace(' ', '').replace(',', '').replace('–', '-').replace('—', '-')
+    if s.endswith('%'): s = s[:-1]
+    try: return float(s)
+    except (ValueError, TypeError): return 0.0
+
+_SUMMARY_VALUE_CONVERTERS = {
+    'float': _clean_and_float,
+    'int': lambda value: int(_clean_and_float(value)),
+    'text': lambda value: value.strip(),
+}
+
+# --- Summary lines: one declarative table, dispatched by the line's leading label ---
+# Each rule: (leading labels that route to it, target dict, pattern, ((field, converter), ...) per group)
+# Labels that share a line in the MT5 layout (e.g. "Credit Facility: ... Floating P/L: ... Equity:")
+# are listed together so the rule fires whichever of them leads the line.
+_NUM = r"([-+]?\s*\d[\d\s\.,-]*)"
+_BALANCE_BLOCK_LABELS = ("Balance", "Credit Facility", "Floating P/L", "Equity", "Free Margin", "Margin", "Margin Level")
+_DRAWDOWN_LABELS = ("Balance Drawdown Absolute", "Balance Drawdown Maximal", "Balance Drawdown Relative")
+
+_SUMMARY_LINE_RULES = [
+    (("Account",), 'portfolio_details', r"Account:.*?,*?\"?(\d+)(?:\s*\(.*?\))?\"?", (('account_id', 'text'),)),
+    (("Name",), 'portfolio_details', r"Name:,*\s*([^,]+)", (('account_name', 'text'),)),
+    (("Client",), 'portfolio_details', r"Client:\s*(.+)", (('client_name', 'text'),)),
+
+    (_BALANCE_BLOCK_LABELS, 'balance_summary', r"Balance:,(?:,*?)" + _NUM, (('Balance', 'float'),)),
+    (_BALANCE_BLOCK_LABELS, 'balance_summary', r"Equity:,(?:,*?)" + _NUM, (('Equity', 'float'),)),
+    (_BALANCE_BLOCK_LABELS, 'balance_summary', r"Floating P/L:,(?:,*?)" + _NUM, (('Floating_P_L', 'float'),)),
+    (_BALANCE_BLOCK_LABELS, 'balance_summary', r"Credit Facility:,(?:,*?)" + _NUM, (('Credit_Facility', 'float'),)),
+
+    (("Total Net Profit",), 'results_summary',
+     r"Total Net Profit:,(?:,*?)" + _NUM + r",*?Gross Profit:,(?:,*?)" + _NUM + r",*?Gross Loss:,(?:,*?)" + _NUM,
+     (('Total_Net_Profit_Text', 'float'), ('Gross_Profit', 'float'), ('Gross_Loss', 'float'))),
+    (("Profit Factor",), 'results_summary',
+     r"Profit Factor:,(?:,*?)" + _NUM + r",*?Expected Payoff:,(?:,*?)" + _NUM,
+     (('Profit_Factor', 'float'), ('Expected_Payoff', 'float'))),
+    (("Recovery Factor",), 'results_summary',
+     r"Recovery Factor:,(?:,*?)" + _NUM + r",*?Sharpe Ratio:,(?:,*?)" + _NUM,
+     (('Recovery_Factor', 'float'), ('Sharpe_Ratio', 'float'))),
+    (_DRAWDOWN_LABELS, 'results_summary',
+     r"Balance Drawdown Maximal:,(?:,*?)" + _NUM + r"\s*\(" + _NUM + r"\%\),*?Balance Drawdown Relative:,(?:,*?)" + _NUM + r"\%\s*\(" + _NUM + r"\)",
+     (('Maximal_Drawdown_Value', 'float'), ('Maximal_Drawdown_Percent', 'float'),
+      ('Balance_Drawdown_Relative_Percent', 'float'), ('Balance_Drawdown_Relative_Value', 'float'))),
+    (_DRAWDOWN_LABELS, 'results_summary', r"Balance Drawdown Absolute:,(?:,*?)" + _NUM, (('Balance_Drawdown_Absolute', 'float'),)),
+
+    (("Total Trades",), 'results_summary',
+     r"Total Trades:(?:,+)\s*(\d+)(?:,+)\s*Short Trades \(won %\):(?:\s*,+)\s*(\d+)\s*\(([-+]?\s*\d*\.?\d+)%\)(?:,+)\s*Long Trades \(won %\):(?:\s*,+)\s*(\d+)\s*\(([-+]?\s*\d*\.?\d+)%\)",
+     (('Total_Trades', 'int'), ('Short_Trades_Count', 'int'), ('Short_Trades_Won_Percent', 'float'),
+      ('Long_Trades_Count', 'int'), ('Long_Trades_Won_Percent', 'float'))),
+    (("Profit Trades (% of total)",), 'results_summary',
+     r"Profit Trades \(\% of total\):,(?:,*?)(\d+)\s*\(([-+]?\s*\d*\.?\d+)%\),*?Loss Trades \(\% of total\):,(?:,*?)(\d+)\s*\(([-+]?\s*\d*\.?\d+)%\)",
+     (('Profit_Trades_Count', 'int'), ('Profit_Trades_Percent', 'float'),
+      ('Loss_Trades_Count', 'int'), ('Loss_Trades_Percent', 'float'))),
+    (("Largest profit trade",), 'results_summary',
+     r"Largest profit trade:,(?:,*?)" + _NUM + r",*?Largest loss trade:,(?:,*?)" + _NUM,
+     (('Largest_Profit_Trade', 'float'), ('Largest_Loss_Trade', 'float'))),
+    (("Average profit trade",), 'results_summary',
+     r"Average profit trade:,(?:,*?)" + _NUM + r",*?Average loss trade:,(?:,*?)" + _NUM,
+     (('Average_Profit_Trade', 'float'), ('Average_Loss_Trade', 'float'))),
+    (("Maximum consecutive wins ($)",), 'results_summary',
+     r"Maximum consecutive wins \(\$\):,(?:,*?)(\d+)\s*\(" + _NUM + r"\),*?Maximum consecutive losses \(\$\):,(?:,*?)(\d+)\s*\(" + _NUM + r"\)",
+     (('Max_Consecutive_Wins_Count', 'int'), ('Max_Consecutive_Wins_Profit', 'float'),
+      ('Max_Consecutive_Losses_Count', 'int'), ('Max_Consecutive_Losses_Profit', 'float'))),
+    (("Maximal consecutive profit (count)",), 'results_summary',
+     r"Maximal consecutive profit \(count\):,(?:,*?)" + _NUM + r"\s*\(([-+]?\s*\d+)\),*?Maximal consecutive loss \(count\):,(?:,*?)" + _NUM + r"\s*\(([-+]?\s*\d+)\)",
+     (('Maximal_Consecutive_Profit_Value', 'float'), ('Maximal_Consecutive_Profit_Count', 'int'),
+      ('Maximal_Consecutive_Loss_Value', 'float'), ('Maximal_Consecutive_Loss_Count', 'int'))),
+    (("Average consecutive wins",), 'results_summary',
+     r"Average consecutive wins:(?:,+)\s*([-\s\d\.]+)(?:,+)\s*Average consecutive losses:(?:,+)\s*([-\s\d\.]+)",
+     (('Average_Consecutive_Wins', 'int'), ('Average_Consecutive_Losses', 'int'))),
+]
+
+def _build_summary_dispatch(rules) -> dict:
+    """Compiles the rule table into {leading label: [(target, pattern, fields), ...]}."""
+    dispatch = {}
+    for labels, target, pattern_str, fields in rules:
+        compiled_rule = (target, re.compile(pattern_str), fields)
+        for label in labels:
+            dispatch.setdefault(label, []).append(compiled_rule)
+    return dispatch
+
+_SUMMARY_DISPATCH = _build_summary_dispatch(_SUMMARY_LINE_RULES)
+
+def _extract_summary_fields(line_stripped: str, targets: dict):
+    """
+    Routes one line to the summary rules registered for its leading label
+    and writes every captured value into the matching target dict.
+    """
+    if not line_stripped or line_stripped[0].isdigit(): # แถวตาราง (เริ่มด้วยวันที่/เลข) ข้ามได้ทันที
+        return
+    label, colon, _ = line_stripped.lstrip(', ').partition(':')
+    if not colon:
+        return
+    for target, pattern, fields in _SUMMARY_DISPATCH.get(label.strip(), ()):
+        match = pattern.search(line_stripped)
+        if not match:
+            continue
+        for (field, converter_name), value in zip(fields, match.groups()):
+            targets[target][field] = _SUMMARY_VALUE_CONVERTERS[converter_name](value)
+
+# --- Input decoding: CSV text or streamed HTML, both yielded as CSV-style lines ---
+# Input is read and decoded incrementally, so neither the full decoded text nor a full
+# list of lines is ever materialized (bytes, a binary file-like object or a path via mmap).
+_READ_CHUNK_SIZE = 256 * 1024
+
+def _sniff_encoding(head: bytes) -> str:
+    """MT5 HTML reports are usually UTF-16 with a BOM; CSV exports are UTF-8 (optionally with BOM)."""
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    return 'utf-8-sig'
+
+def _looks_like_html(text_head: str) -> bool:
+    return text_head.lstrip().lower().startswith(('<!doctype html', '<html', '<head', '<meta', '<table', '<body'))
+
+class _StatementHTMLRowParser(HTMLParser):
+    """
+    Event-based reader for MT5 HTML reports. Each <tr> is emitted as one CSV line,
+    with colspan expanded into empty cells so rows line up with the CSV export.
+    No DOM is built: only the row currently being read is held in memory.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._completed_lines = []
+        self._cells = None
+        self._cell_parts = None
+        self._cell_span = 1
+        self._cell_hidden = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._finish_row()
+            self._cells = []
+        elif tag in ('td', 'th'):
+            self._finish_cell()
+            if self._cells is None: # เซลล์ที่ไม่มี <tr> ครอบ
+                self._cells = []
+            attr_map = dict(attrs)
+            try:
+                self._cell_span = max(int(attr_map.get('colspan') or 1), 1)
+            except ValueError:
+                self._cell_span = 1
+            self._cell_hidden = 'hidden' in (attr_map.get('class') or '')
+            self._cell_parts = []
+        elif tag == 'br' and self._cell_parts is not None:
+            self._cell_parts.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'th'):
+            self._finish_cell()
+        elif tag in ('tr', 'table'):
+            self._finish_row()
+
+    def handle_data(self, data):
+        if self._cell_parts is not None:
+            self._cell_parts.append(data)
+
+    def close(self):
+        super().close()
+        self._finish_row()
+
+    def drain(self) -> list:
+        """Returns (and forgets) the lines completed since the last call."""
+        completed, self._completed_lines = self._completed_lines, []
+        return completed
+
+    def _finish_cell(self):
+        if self._cell_parts is None:
+            return
+        if not self._cell_hidden:
+            text = ' '.join(''.join(self._cell_parts).split())
+            self._cells.extend([text] + [''] * (self._cell_span - 1))
+        self._cell_parts = None
+
+    def _finish_row(self):
+        self._finish_cell()
+        if self._cells:
+            buffer = io.StringIO()
+            csv.writer(buffer, lineterminator='').writerow(self._cells)
+            self._completed_lines.append(buffer.getvalue())
+        self._cells = None
+
+def _iter_html_lines(text_chunks):
+    """Feeds decoded text chunks to the HTML row parser and yields rows as soon as they close."""
+    parser = _StatementHTMLRowParser()
+    for chunk in text_chunks:
+        parser.feed(chunk)
+        yield from parser.drain()
+    parser.close()
+    yield from parser.drain()
+
+def _iter_byte_chunks(source, chunk_size: int = _READ_CHUNK_SIZE):
+    """
+    Yields the raw input in chunks: bytes-like objects are sliced without copying,
+    os.PathLike paths are memory-mapped, anything else is read() from as a binary file object.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        view = memoryview(source)
+        for offset in range(0, len(view), chunk_size):
+            yield view[offset:offset + chunk_size]
+    elif isinstance(source, os.PathLike):
+        with open(source, 'rb') as handle:
+            if os.fstat(handle.fileno()).st_size == 0:
+                return
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for offset in range(0, len(mapped), chunk_size):
+                    yield mapped[offset:offset + chunk_size]
+    else:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+def _iter_decoded_chunks(byte_chunks, encoding: str):
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    for chunk in byte_chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+def _iter_text_lines(text_chunks):
+    """Splits decoded text chunks into lines, carrying the unfinished tail over to the next chunk."""
+    pending = ''
+    for chunk in text_chunks:
+        if not chunk:
+            continue
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+def _input_size(file_content_input):
+    if isinstance(file_content_input, (bytes, bytearray, memoryview, str)):
+        return len(file_content_input)
+    if isinstance(file_content_input, os.PathLike):
+        return os.path.getsize(file_content_input)
+    return None
+
+def _iter_report_lines(file_content_input):
+    """
+    Returns an iterable of report lines for CSV or HTML input, or None for unsupported input.
+    Accepts str (already decoded text), bytes-like content, a binary file-like object
+    (e.g. the upload buffer) or an os.PathLike path to a file on disk.
+    """
+    if isinstance(file_content_input, str):
+        if _looks_like_html(file_content_input[:512]):
+            return _iter_html_lines([file_content_input])
+        return file_content_input.strip().split('\n')
+    if not isinstance(file_content_input, (bytes, bytearray, memoryview, os.PathLike)) \
+            and not hasattr(file_content_input, 'read'):
+        return None
+
+    byte_chunks = _iter_byte_chunks(file_content_input)
+    head = next(byte_chunks, b'')
+    # Decode as utf-8-sig to handle BOM (Byte Order Mark) if present
+    text_chunks = _iter_decoded_chunks(itertools.chain([head], byte_chunks), _sniff_encoding(bytes(head[:4])))
+    text_head = next(text_chunks, '')
+    text_chunks = itertools.chain([text_head], text_chunks)
+    if _looks_like_html(text_head[:1024]):
+        return _iter_html_lines(text_chunks)
+    return _iter_text_lines(text_chunks)
+
+# --- Numeric cleaning: one batched pass over every numeric column of a section ---
+_NUMERIC_CLEAN_TABLE = str.maketrans({' ': None, ',': None, '\u00a0': None, '–': '-', '—': '-'})
+_COERCION_ISSUE_SAMPLE_SIZE = 20
+
+def _clean_numeric_columns(df: pd.DataFrame, section_name: str, coercion_issues: list):
+    """
+    Converts all numeric columns of a section (settings.STATEMENT_NUMERIC_COLUMNS) in place.
+    The columns are stacked into one block so the character clean-up and pd.to_numeric
+    each run once per section instead of once per column.
+    Empty cells and known tokens (settings.STATEMENT_NUMERIC_ZERO_TOKENS, e.g. "market")
+    become 0.0 as before; other non-empty cells that fail conversion stay NaN and are
+    reported in coercion_issues (one entry per column).
+    """
+    table_name = _SECTION_TARGET_TABLES[section_name]
+    columns = [col for col in settings.STATEMENT_NUMERIC_COLUMNS.get(table_name, []) if col in df.columns]
+    if not columns or df.empty:
+        return
+
+    n_rows = len(df)
+    raw_block = pd.Series(df[columns].to_numpy(dtype=object).ravel(order='F'), dtype=object)
+    cleaned = raw_block.where(raw_block.notna(), '').astype(str).str.translate(_NUMERIC_CLEAN_TABLE).str.strip()
+    is_blank = cleaned.eq('') | cleaned.str.lower().isin(settings.STATEMENT_NUMERIC_ZERO_TOKENS)
+    values = pd.to_numeric(cleaned.mask(is_blank), errors='coerce')
+    failed = values.isna() & ~is_blank
+    values = values.mask(is_blank, 0.0)
+
+    value_matrix = values.to_numpy(dtype=float).reshape((n_rows, len(columns)), order='F')
+    for position, col in enumerate(columns):
+        df[col] = value_matrix[:, position]
+
+    if failed.any():
+        failed_matrix = failed.to_numpy().reshape((n_rows, len(columns)), order='F')
+        raw_matrix = raw_block.to_numpy().reshape((n_rows, len(columns)), order='F')
+        for position, col in enumerate(columns):
+            failed_rows = np.flatnonzero(failed_matrix[:, position])
+            if failed_rows.size == 0:
+                continue
+            rows = df.index[failed_rows[:_COERCION_ISSUE_SAMPLE_SIZE]].tolist()
+            values = {str(v) for v in raw_matrix[failed_rows[:_COERCION_ISSUE_SAMPLE_SIZE], position]}
+            # Large sections are cleaned chunk by chunk: keep one entry per column
+            issue = next((i for i in coercion_issues if i['section'] == section_name and i['column'] == col), None)
+            if issue is None:
+                coercion_issues.append({'section': section_name, 'column': col, 'count': int(failed_rows.size),
+                                        'rows': rows, 'values': sorted(values)})
+            else:
+                issue['count'] += int(failed_rows.size)
+                issue['rows'] = (issue['rows'] + rows)[:_COERCION_ISSUE_SAMPLE_SIZE]
+                issue['values'] = sorted(set(issue['values']) | values)[:_COERCION_ISSUE_SAMPLE_SIZE]
+
+def _fill_missing_ids(df: pd.DataFrame, section_name: str, portfolio_id=None):
+    """
+    Fills blank IDs with a deterministic hash of the row's stable fields + portfolio
+    (settings.STATEMENT_ID_FALLBACK_FIELDS), so re-importing the same rows upserts
+    instead of inserting duplicates. Fully vectorized; identical rows are told apart
+    by their occurrence number.
+    """
+    id_col, prefix, stable_fields = settings.STATEMENT_ID_FALLBACK_FIELDS[_SECTION_TARGET_TABLES[section_name]]
+    if id_col not in df.columns:
+        return
+    ids = df[id_col].fillna('').astype(str)
+    missing = ids.str.strip().eq('')
+    if missing.any():
+        stable = df.loc[missing, [col for col in stable_fields if col in df.columns]].astype(str)
+        stable['PortfolioID'] = str(portfolio_id or '')
+        stable['Occurrence'] = stable.groupby(list(stable.columns), sort=False).cumcount().astype(str)
+        row_hashes = pd.util.hash_pandas_object(stable, index=False)
+        ids.loc[missing] = prefix + row_hashes.astype(str)
+    df[id_col] = ids
+
+# --- Timestamps: sniff the format once per file, convert each column once ---
+_TIME_FORMAT_SNIFF_SAMPLE = 20
+
+def _new_time_context(server_timezone: str = None, issues: list = None) -> dict:
+    """
+    Per-file timestamp state: the sniffed format is shared by every time column of the file.
+    Ambiguous times that could not be resolved are reported into issues (the file's coercion_issues).
+    """
+    return {'format': None, 'timezone': server_timezone or settings.BROKER_SERVER_TIMEZONE,
+            'issues': issues if issues is not None else []}
+
+def _sniff_time_format(sample: pd.Series):
+    """Picks the candidate in settings.STATEMENT_TIME_FORMATS that parses the most sample values."""
+    best_format, best_hits = None, 0
+    for fmt in settings.STATEMENT_TIME_FORMATS:
+        hits = int(pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum())
+        if hits > best_hits:
+            best_format, best_hits = fmt, hits
+            if hits == len(sample):
+                break
+    return best_format
+
+def _parse_time_columns(df: pd.DataFrame, section_name: str, time_context: dict):
+    """
+    Converts the section's time columns (settings.STATEMENT_TIME_COLUMNS) in place:
+    one pass with the sniffed format, a row-wise fallback only for rows that missed,
+    then localization from the broker server timezone to UTC in the same step.
+    Row alignment is preserved (unparseable cells become NaT).
+    """
+    table_name = _SECTION_TARGET_TABLES[section_name]
+    for col in settings.STATEMENT_TIME_COLUMNS.get(table_name, []):
+        if col not in df.columns:
+            continue
+        raw = df[col]
+        if pd.api.types.is_datetime64_any_dtype(raw):
+            parsed = raw
+        else:
+            raw = raw.astype(object).where(raw.notna(), None)
+            present = raw.notna() & raw.astype(str).str.strip().ne('')
+            if time_context['format'] is None and present.any():
+                time_context['format'] = _sniff_time_format(raw[present].head(_TIME_FORMAT_SNIFF_SAMPLE))
+
+            if time_context['format']:
+                parsed = pd.to_datetime(raw, format=time_context['format'], errors='coerce')
+            else:
+                parsed = pd.Series(pd.NaT, index=raw.index, dtype='datetime64[ns]')
+            missed = parsed.isna() & present
+            if missed.any():
+                parsed.loc[missed] = pd.to_datetime(raw[missed], format='mixed', errors='coerce')
+
+        if parsed.dt.tz is None:
+            parsed = _localize_server_times(parsed, df[col], section_name, col, time_context)
+        df[col] = parsed.dt.tz_convert('UTC')
+
+def _localize_server_times(parsed: pd.Series, raw: pd.Series, section_name: str, col: str, time_context: dict) -> pd.Series:
+    """
+    Localizes naive server times to the broker timezone. Wall times in a DST fall-back hour exist
+    twice; they are resolved per day from the row order: statements list rows chronologically,
+    so a single step back in time among that day's ambiguous rows marks the switch from the DST
+    pass to the standard-time pass. Days without that evidence fall back to the DST (first)
+    occurrence and are reported in time_context['issues'] like a coercion issue; the time is kept.
+    """
+    timezone = time_context['timezone']
+    localized = parsed.dt.tz_localize(timezone, ambiguous='NaT', nonexistent='shift_forward')
+    ambiguous = (localized.isna() & parsed.notna()).to_numpy()
+    if not ambiguous.any():
+        return localized
+
+    is_dst = np.ones(len(parsed), dtype=bool)
+    unresolved = []
+    ambiguous_positions = np.flatnonzero(ambiguous)
+    ambiguous_values = parsed.to_numpy()[ambiguous_positions]
+    ambiguous_days = ambiguous_values.astype('datetime64[D]')
+    for day in np.unique(ambiguous_days):
+        positions = ambiguous_positions[ambiguous_days == day]
+        steps_back = np.flatnonzero(np.diff(ambiguous_values[ambiguous_days == day]) < np.timedelta64(0))
+        if steps_back.size == 1:
+            is_dst[positions[steps_back[0] + 1:]] = False
+        else:
+            unresolved.extend(positions.tolist())
+
+    if unresolved:
+        sample = unresolved[:_COERCION_ISSUE_SAMPLE_SIZE]
+        time_context['issues'].append({
+            'section': section_name, 'column': col, 'count': len(unresolved), 'kind': 'ambiguous_time',
+            'rows': parsed.index[sample].tolist(), 'values': sorted({str(v) for v in raw.iloc[sample]}),
+        })
+    return parsed.dt.tz_localize(timezone, ambiguous=is_dst, nonexistent='shift_forward')
+
+def _profile_stage(profile, name: str, rows: int = None, bytes_count: int = None, merge: bool = False):
+    """Timing block for an optional IngestProfile (core.ingest_metrics); no-op when profile is None."""
+    if profile is None:
+        return nullcontext({})
+    return profile.stage(name, rows=rows, bytes_count=bytes_count, merge=merge)
+
+def _read_section_chunk(section_name: str, header_line: str, section_lines: list, coercion_issues: list,
+                        row_offset: int = 0, profile=None) -> pd.DataFrame:
+    """
+    Reads one chunk of a section's CSV rows into columns named after settings.WORKSHEET_HEADERS
+    and converts the numeric columns. Time columns stay raw text until the section is complete.
+    The index continues from row_offset so coercion issue rows refer to the whole section.
+    """
+    expected_columns = settings.WORKSHEET_HEADERS[_SECTION_TARGET_TABLES[section_name]]
+    section_text = "\n".join([header_line] + section_lines)
+    with _profile_stage(profile, f"csv_read:{section_name}", rows=len(section_lines), bytes_count=len(section_text), merge=True):
+        df_parsed_raw = pd.read_csv(io.StringIO(section_text),
+                                    header=0,
+                                    skipinitialspace=True,
+                                    dtype=str)
+    del section_text
+    df_parsed_raw.index = pd.RangeIndex(row_offset, row_offset + len(df_parsed_raw))
+
+    column_rename_map = {}
+    pandas_inferred_headers_from_template = _template_column_names(section_name)
+
+    for i, inferred_col in enumerate(pandas_inferred_headers_from_template):
+        if i < len(expected_columns):
+            column_rename_map[inferred_col] = expected_columns[i]
+
+    df_final = df_parsed_raw.rename(columns=column_rename_map)
+    df_final = df_final.reindex(columns=expected_columns)
+
+    if 'id' in df_final.columns:
+        df_final.drop(columns=['id'], inplace=True, errors='ignore')
+
+    if section_name == "Orders":
+        # "0.01 / 0.01" (filled / requested) -> เก็บเฉพาะค่าแรก แล้วแปลงพร้อมคอลัมน์ตัวเลขอื่น
+        if 'Volume_Ord_Raw' in df_final.columns:
+            df_final['Volume_Ord'] = df_final['Volume_Ord_Raw'].str.split('/', n=1).str[0]
+            df_final.drop(columns=['Volume_Ord_Raw'], inplace=True, errors='ignore')
+        else:
+            df_final['Volume_Ord'] = None
+
+    with _profile_stage(profile, f"numeric_clean:{section_name}", rows=len(df_final), merge=True):
+        _clean_numeric_columns(df_final, section_name, coercion_issues)
+    return df_final
+
+def _finish_section_frame(section_name: str, chunks: list, time_context: dict, portfolio_id=None, profile=None) -> pd.DataFrame:
+    """Joins a section's chunks, fills missing IDs and parses the time columns."""
+    expected_columns = settings.WORKSHEET_HEADERS[_SECTION_TARGET_TABLES[section_name]]
+    if not chunks:
+        return pd.DataFrame(columns=expected_columns)
+    df_final = chunks[0] if len(chunks) == 1 else pd.concat(chunks)
+    chunks.clear()
+    if df_final.empty:
+        return pd.DataFrame(columns=expected_columns)
+
+    # ID fallback hashes cleaned numbers + raw time text, so it must run before time parsing
+    _fill_missing_ids(df_final, section_name, portfolio_id)
+
+    if section_name == "Positions":
+        # คอลัมน์ Time ตัวที่สองคือเวลาปิด position
+        if 'Time_Close_Pos_Raw' in df_final.columns:
+            df_final['Time_Close_Pos'] = df_final.pop('Time_Close_Pos_Raw')
+        else:
+            df_final['Time_Close_Pos'] = pd.NaT
+
+    with _profile_stage(profile, f"time_parse:{section_name}", rows=len(df_final)):
+        _parse_time_columns(df_final, section_name, time_context)
+
+    if section_name == "Orders":
+        df_final.drop(columns=['Filler_Ord_1', 'Filler_Ord_2'], inplace=True, errors='ignore')
+
+    return df_final.dropna(how='all')
 
-# --- NEW: Helper function to ensure datetime is timezone-aware and in UTC ---
-def _ensure_utc_datetime(series: pd.Series) -> pd.Series:
+class _SectionChunkBuffer:
     """
-    Ensures a pandas Series of datetime objects is timezone-aware (UTC)
-    for consistent comparisons.
+    Collects the CSV rows of one section and converts them to typed DataFrame chunks every
+    settings.STATEMENT_PARSE_CHUNK_ROWS rows, so raw text lines never pile up for a whole section.
     """
-    if not pd.api.types.is_datetime64_any_dtype(series):
-        series = pd.to_datetime(series, errors='coerce')
 
-    series = series.dropna()
+    def __init__(self, section_name: str, header_line: str, coercion_issues: list, profile=None):
+        self.section_name = section_name
+        self.header_line = header_line
+        self.coercion_issues = coercion_issues
+        self.profile = profile
+        self.chunk_rows = max(int(settings.STATEMENT_PARSE_CHUNK_ROWS or 0), 1)
+        self.lines = []
+        self.chunks = []
+        self.rows_read = 0
+        self.failed = False
+
+    def append(self, line: str):
+        self.lines.append(line)
+        if len(self.lines) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.lines or self.failed:
+            self.lines = []
+            return
+        try:
+            self.chunks.append(_read_section_chunk(self.section_name, self.header_line, self.lines,
+                                                   self.coercion_issues, self.rows_read, self.profile))
+            self.rows_read += len(self.lines)
+        except Exception as e:
+            print(f"Error parsing {self.section_name} section: {e}")
+            self.failed = True
+            self.chunks = []
+        self.lines = []
+
+    def discard(self):
+        """A repeated header restarts the section: drop everything read so far, including its issues."""
+        self.lines, self.chunks, self.failed = [], [], True
+        self.coercion_issues[:] = [i for i in self.coercion_issues if i['section'] != self.section_name]
+
+    def build(self, time_context: dict, portfolio_id=None) -> pd.DataFrame:
+        self.flush()
+        if self.failed:
+            return pd.DataFrame(columns=settings.WORKSHEET_HEADERS[_SECTION_TARGET_TABLES[self.section_name]])
+        try:
+            return _finish_section_frame(self.section_name, self.chunks, time_context, portfolio_id, self.profile)
+        except Exception as e:
+            print(f"Error parsing {self.section_name} section: {e}")
+            return pd.DataFrame(columns=settings.WORKSHEET_HEADERS[_SECTION_TARGET_TABLES[self.section_name]])
 
-    if series.empty:
-        return series
 
-    if series.dt.tz is None:
-        return series.dt.tz_localize(pytz.utc)
-    elif series.dt.tz != pytz.utc:
-        return series.dt.tz_convert(pytz.utc)
-    return series
+def _classify_balance_deals(deals_df: pd.DataFrame):
+    """
+    Labels every balance deal as Deposit / Withdrawal / Unknown in one vectorized step
+    (rules from settings.DEPOSIT_WITHDRAWAL_COMMENT_RULES) and builds the
+    DepositWithdrawalLogs frame straight from the typed deal columns.
 
-def extract_data_from_report_content(file_content_input: bytes):
+    Returns:
+        tuple: (DataFrame of Deposit/Withdrawal rows, total deposit, total withdrawal)
+    """
+    balance_deals = deals_df[deals_df['Type_Deal'].fillna('').str.lower() == 'balance']
+    comments = balance_deals['Comment_Deal'].fillna('').astype(str).str.lower()
+
+    rules = settings.DEPOSIT_WITHDRAWAL_COMMENT_RULES
+    conditions = [comments.str.contains('|'.join(re.escape(k) for k in keywords), regex=True) for _, keywords in rules]
+    transaction_types = np.select(conditions, [label for label, _ in rules], default='Unknown') if rules else 'Unknown'
+
+    dw_df = pd.DataFrame({
+        "TransactionID": balance_deals['Deal_ID'].astype(str),
+        "DateTime": balance_deals['Time_Deal'],
+        "Type": transaction_types,
+        "Amount": balance_deals['Profit_Deal'].fillna(0.0),
+        "Comment": balance_deals['Comment_Deal'],
+    })
+    dw_df = dw_df[dw_df['Type'] != 'Unknown'].reset_index(drop=True)
+
+    amount_by_type = dw_df.groupby('Type')['Amount'].sum()
+    return dw_df, float(amount_by_type.get('Deposit', 0.0)), float(amount_by_type.get('Withdrawal', 0.0))
+
+# --- Columnar output: typed Arrow tables instead of object-dtype frames ---
+_COLUMNAR_OUTPUT_TABLES = {
+    'deals': settings.SUPABASE_TABLE_ACTUAL_TRADES,
+    'orders': settings.SUPABASE_TABLE_ACTUAL_ORDERS,
+    'positions': settings.SUPABASE_TABLE_ACTUAL_POSITIONS,
+    'deposit_withdrawal_logs': settings.SUPABASE_TABLE_DEPOSIT_WITHDRAWAL_LOGS,
+}
+_OUTPUT_FORMATS = ('pandas', 'arrow')
+
+def to_columnar_table(df: pd.DataFrame, table_name: str):
+    """
+    Converts a parsed statement frame to a typed pyarrow.Table:
+    numeric columns -> float64, time columns -> timestamp[ns, UTC],
+    settings.STATEMENT_DICTIONARY_COLUMNS -> dictionary<int32, string>, other text -> string.
+    pyarrow is imported lazily (it ships with streamlit).
+    """
+    import pyarrow as pa
+
+    numeric_columns = set(settings.STATEMENT_NUMERIC_COLUMNS.get(table_name, []))
+    time_columns = set(settings.STATEMENT_TIME_COLUMNS.get(table_name, []))
+    dictionary_columns = set(settings.STATEMENT_DICTIONARY_COLUMNS.get(table_name, []))
+
+    arrays = {}
+    for col in df.columns:
+        series = df[col]
+        if col in time_columns or pd.api.types.is_datetime64_any_dtype(series):
+            values = series if pd.api.types.is_datetime64_any_dtype(series) else pd.to_datetime(series, errors='coerce')
+            values = values.dt.tz_localize('UTC') if values.dt.tz is None else values.dt.tz_convert('UTC')
+            arrays[col] = pa.array(values, type=pa.timestamp('ns', tz='UTC'), from_pandas=True)
+        elif col in numeric_columns:
+            arrays[col] = pa.array(pd.to_numeric(series, errors='coerce').astype('float64'), type=pa.float64(), from_pandas=True)
+        else:
+            values = series.where(series.isna(), series.astype(str))
+            column = pa.array(values, type=pa.string(), from_pandas=True)
+            arrays[col] = _dictionary_encode(column) if col in dictionary_columns else column
+    return pa.table(arrays)
+
+def _dictionary_encode(column):
+    """Dictionary-encodes a string array with the narrowest index type that fits its distinct values."""
+    import pyarrow as pa
+
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    encoded = column.dictionary_encode()
+    distinct = len(encoded.dictionary)
+    index_type = pa.int8() if distinct <= 127 else pa.int16() if distinct <= 32767 else pa.int32()
+    return encoded.cast(pa.dictionary(index_type, pa.string()))
+
+def extract_data_from_report_content(file_content_input: bytes, portfolio_id=None, profile=None, debug=None,
+                                     output_format: str = 'pandas'):
     """
-    Extracts data from a trading statement report content (CSV format).
+    Extracts data from a trading statement report content.
+    Accepts MT5 CSV exports and MT5 HTML reports (detected from the content itself);
+    both go through the same line classifier.
+    portfolio_id (optional) is mixed into the fallback IDs generated for rows without one.
+    profile (optional core.ingest_metrics.IngestProfile) receives per-stage timings;
+    its records are also returned under 'ingest_profile'.
+    debug dumps the extracted frames to the console (defaults to settings.STATEMENT_PARSER_DEBUG).
+    output_format='arrow' returns deals / orders / positions / deposit_withdrawal_logs as typed
+    pyarrow.Table objects (see to_columnar_table) instead of pandas DataFrames.
     """
+    if output_format not in _OUTPUT_FORMATS:
+        raise ValueError(f"output_format must be one of {_OUTPUT_FORMATS}, got {output_format!r}")
+
     extracted_data = {
         'deals': pd.DataFrame(),
         'orders': pd.DataFrame(),
@@ -40,426 +712,96 @@ def extract_data_from_report_content(file_content_input: bytes):
         'balance_summary': {},
         'results_summary': {},
         'portfolio_details': {},
-        'deposit_withdrawal_logs': []
+        'deposit_withdrawal_logs': [],
+        'coercion_issues': []
     }
     
-    lines = []
-    if isinstance(file_content_input, str):
-        # Decode as utf-8-sig to handle BOM (Byte Order Mark) if present
-        lines = file_content_input.strip().split('\n')
-    elif isinstance(file_content_input, bytes):
-        lines = file_content_input.decode('utf-8-sig', errors='replace').strip().split('\n')
-    else:
+    lines = _iter_report_lines(file_content_input)
+    if lines is None:
         return extracted_data
+    input_bytes = _input_size(file_content_input)
 
-    # --- 1. Extract Portfolio Details and other single-line summaries first ---
+    # --- 1. Extract Portfolio Details, single-line summaries and table rows in one pass ---
     portfolio_details = {}
     balance_summary_parsed_from_text = {} 
     results_summary_parsed_from_text = {} 
-    
-    def clean_and_float(value_str):
-        if value_str is None: return 0.0
-        s = str(value_str).strip().replace(' ', '').replace(',', '').replace('–', '-').replace('—', '-')
-        if s.endswith('%'): s = s[:-1]
-        try: return float(s)
-        except (ValueError, TypeError): return 0.0
-
-    # These parse_summary_line_item and parse_results_section_line are currently unused
-    def parse_summary_line_item(line, key_word): 
-        match = re.search(r"Average consecutive wins:,\s*([-\s\d\.]+)(?:,*\s*)Average consecutive losses:,\s*([-\s\d\.]+)", line) 
-        if match:
-            val1 = clean_and_float(match.group(1))
-            val2 = clean_and_float(match.group(2))
-            return val1, val2
-        return None, None
-
-    def parse_results_section_line(line): 
-        data = {}
-        patterns = {
-            "Total Net Profit": r"Total Net Profit:,,,\s*([-\s\d\.]+)",
-            "Gross Profit": r"Gross Profit:,,,\s*([-\s\d\.]+)",
-            "Gross Loss": r"Gross Loss:,,,\s*([-\s\d\.]+)",
-            "Profit Factor": r"Profit Factor:,,,\s*([-\s\d\.]+)",
-            "Expected Payoff": r"Expected Payoff:,,,\s*([-\s\d\.]+)",
-            "Recovery Factor": r"Recovery Factor:,,,\s*([-\s\d\.]+)",
-            "Sharpe Ratio": r"Sharpe Ratio:,,,\s*([-\s\d\.]+)",
-            "Balance Drawdown Absolute": r"Balance Drawdown Absolute:,,,\s*([-\s\d\.]+)",
-            "Balance Drawdown Maximal": r"Balance Drawdown Maximal:,,,\s*([-\s\d\.]+)\s*\(([-+]?\s*\d[\d\s\.,-]*)\%\)",
-            "Balance Drawdown Relative": r"Balance Drawdown Relative:,,,\s*([-\s\d\.]+)\%\s*\(([-+]?\s*\d[\d\s\.,-]*)\)",
-            "Total Trades": r"Total Trades:,,,\s*(\d+)",
-            "Short Trades \(won %\):": r"Short Trades \(won %\):,,,\s*(\d+)\s*\(([-+]?\d*\.?\d+)%\)",
-            "Long Trades \(won %\):": r"Long Trades \(won %\):,,,\s*(\d+)\s*\(([-+]?\d*\.?\d+)%\)",
-            "Profit Trades \(% of total\):": r"Profit Trades \(% of total\):,,,\s*(\d+)\s*\(([-+]?\s*\d*\.?\d+)%\)",
-            "Loss Trades \(% of total\):": r"Loss Trades \(% of total\):,,,\s*(\d+)\s*\(([-+]?\s*\d*\.?\d+)%\)",
-            "Largest profit trade": r"Largest profit trade:,,,\s*([-\s\d\.]+)",
-            "Largest loss trade": r"Largest loss trade:,,,\s*([-\s\d\.]+)",
-            "Average profit trade": r"Average profit trade:,,,\s*([-\s\d\.]+)",
-            "Average loss trade": r"Average loss trade:,,,\s*([-\s\d\.]+)",
-            "Maximum consecutive wins": r"Maximum consecutive wins \(\$\):,,,\s*(\d+)\s*\(([-+]?\s*\d[\d\s\.,-]*)\)",
-            "Maximum consecutive losses": r"Maximum consecutive losses \(\$\):,,,\s*(\d+)\s*\(([-+]?\s*\d[\d\s\.,-]*)\)",
-            "Maximal consecutive profit": r"Maximal consecutive profit \(count\):,,,\s*([-\s\d\.]+)\s*\(([-+]?\s*\d+)\)",
-            "Maximal consecutive loss": r"Maximal consecutive loss \(count\):,,,\s*([-\s\d\.]+)\s*\(([-+]?\s*\d+)\)",
-            "Average consecutive wins": r"Average consecutive wins:,,,\s*([-\s\d\.]+)",
-            "Average consecutive losses": r"Average consecutive losses:,,,\s*([-\s\d\.]+)"
-        }
-        
-        for key_prefix, pattern_str in patterns.items():
-            match = re.search(pattern_str, line)
-            if match:
-                if len(match.groups()) == 2:
-                    val1 = match.group(1)
-                    val2 = match.group(2)
-                    if key_prefix == "Balance Drawdown Maximal":
-                        data['Maximal_Drawdown_Value'] = clean_and_float(val1)
-                        data['Maximal_Drawdown_Percent'] = clean_and_float(val2)
-                    elif key_prefix == "Balance Drawdown Relative":
-                        data['Balance_Drawdown_Relative_Percent'] = clean_and_float(val1)
-                        data['Balance_Drawdown_Relative_Value'] = clean_and_float(val2)
-                    elif key_prefix == "Maximum consecutive wins": 
-                        data['Max_Consecutive_Wins_Count'] = int(clean_and_float(val1))
-                        data['Max_Consecutive_Wins_Profit'] = clean_and_float(val2)
-                    elif key_prefix == "Maximum consecutive losses": 
-                        data['Max_Consecutive_Losses_Count'] = int(clean_and_float(val1))
-                        data['Max_Consecutive_Losses_Profit'] = clean_and_float(val2)
-                    elif key_prefix == "Maximal consecutive profit": 
-                        data['Maximal_Consecutive_Profit_Value'] = clean_and_float(val1)
-                        data['Maximal_Consecutive_Profit_Count'] = int(clean_and_float(val2))
-                    elif key_prefix == "Maximal consecutive loss": 
-                        data['Maximal_Consecutive_Loss_Value'] = clean_and_float(val1)
-                        data['Maximal_Consecutive_Loss_Count'] = int(clean_and_float(val2))
-                else: 
-                    if key_prefix == "Total Trades":
-                        data[key_prefix] = int(clean_and_float(match.group(1)))
-                    elif key_prefix in ["Average consecutive wins", "Average consecutive losses"]:
-                        data[key_prefix] = int(clean_and_float(match.group(1))) 
-                    else:
-                        data[key_prefix] = clean_and_float(match.group(1))
-                break 
-        return data
+    summary_targets = {
+        'portfolio_details': portfolio_details,
+        'balance_summary': balance_summary_parsed_from_text,
+        'results_summary': results_summary_parsed_from_text,
+    }
 
     has_open_positions_flag = False
 
-    for line in lines:
-        line_stripped = line.strip()
-        
-        if "Open Positions" in line_stripped and len(line_stripped) < 30:
-            has_open_positions_flag = True
-
-        if line_stripped.startswith("Account:"):
-            match = re.search(r"Account:.*?,*?\"?(\d+)(?:\s*\(.*?\))?\"?", line_stripped)
-            if match: portfolio_details['account_id'] = match.group(1)
-        if line_stripped.startswith("Name:"):
-            match = re.search(r"Name:,(?:,*?)([^,]+)", line_stripped)
-            if match: portfolio_details['account_name'] = match.group(1).strip()
-            else:
-                match = re.search(r"Name:\s*(.+)", line_stripped)
-                if match: portfolio_details['account_name'] = match.group(1).strip()
-        if line_stripped.startswith("Client:"):
-            match = re.search(r"Client:\s*(.+)", line_stripped)
-            if match: portfolio_details['client_name'] = match.group(1).strip()
+    # --- Single sweep: every line is classified once as section header, table row or summary text ---
+    # Rows are handed to the CSV reader in chunks while scanning (see _SectionChunkBuffer)
+    section_buffers = {}
+    current_section = None
+    previous_line_blank = False
+
+    scanned_lines = 0
+    # chunked csv_read / numeric_clean stages run inside "decode+scan"; IngestProfile subtracts them from it
+    with _profile_stage(profile, "decode+scan", bytes_count=input_bytes) as scan_record:
+        for line in lines:
+            scanned_lines += 1
+            line_stripped = line.strip()
+
+            section_name = _match_section_header(line_stripped)
+            if section_name:
+                # A repeated header restarts its section (the last occurrence wins)
+                current_section = section_name
+                if section_name in section_buffers:
+                    section_buffers[section_name].discard()
+                section_buffers[section_name] = _SectionChunkBuffer(section_name, line_stripped,
+                                                                    extracted_data['coercion_issues'], profile)
+                current_buffer = section_buffers[section_name]
+                previous_line_blank = False
+                continue
+
+            line_blank = not line_stripped or _BLANK_ROW_PATTERN.fullmatch(line_stripped) is not None
+            if current_section:
+                if line_blank:
+                    if previous_line_blank:
+                        current_section = None # สองบรรทัดว่างติดกัน = จบตาราง
+                elif _SUMMARY_START_PATTERN.match(line_stripped) or _SECTION_TITLE_PATTERN.match(line_stripped):
+                    current_section = None
+                elif ',' in line_stripped:
+                    current_buffer.append(line_stripped)
+                    previous_line_blank = False
+                    continue
+            previous_line_blank = line_blank
         
-        if "Balance:" in line_stripped:
-            match = re.search(r"Balance:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)", line_stripped)
-            if match: balance_summary_parsed_from_text['Balance'] = clean_and_float(match.group(1))
-        
-        if "Equity:" in line_stripped:
-            match = re.search(r"Equity:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)", line_stripped)
-            if match: balance_summary_parsed_from_text['Equity'] = clean_and_float(match.group(1))
+            if "Open Positions" in line_stripped and len(line_stripped) < 30:
+                has_open_positions_flag = True
 
-        if "Floating P/L:" in line_stripped:
-            match = re.search(r"Floating P/L:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)", line_stripped)
-            if match: balance_summary_parsed_from_text['Floating_P_L'] = clean_and_float(match.group(1))
-        
-        if "Credit Facility:" in line_stripped:
-            val_match = re.search(r"Credit Facility:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)", line_stripped)
-            if val_match: balance_summary_parsed_from_text['Credit_Facility'] = clean_and_float(val_match.group(1))
-        
-        if "Total Net Profit:" in line_stripped and "Gross Profit:" in line_stripped and "Gross Loss:" in line_stripped:
-            match = re.search(r"Total Net Profit:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*),*?Gross Profit:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*),*?Gross Loss:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)", line_stripped)
-            if match:
-                results_summary_parsed_from_text['Total_Net_Profit_Text'] = clean_and_float(match.group(1))
-                results_summary_parsed_from_text['Gross_Profit'] = clean_and_float(match.group(2))
-                results_summary_parsed_from_text['Gross_Loss'] = clean_and_float(match.group(3))
-        if "Profit Factor:" in line_stripped and "Expected Payoff:" in line_stripped:
-            match = re.search(r"Profit Factor:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*),*?Expected Payoff:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)", line_stripped)
-            if match:
-                results_summary_parsed_from_text['Profit_Factor'] = clean_and_float(match.group(1))
-                results_summary_parsed_from_text['Expected_Payoff'] = clean_and_float(match.group(2))
-        if "Recovery Factor:" in line_stripped and "Sharpe Ratio:" in line_stripped:
-            match = re.search(r"Recovery Factor:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*),*?Sharpe Ratio:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)", line_stripped)
-            if match:
-                results_summary_parsed_from_text['Recovery_Factor'] = clean_and_float(match.group(1))
-                results_summary_parsed_from_text['Sharpe_Ratio'] = clean_and_float(match.group(2))
-        if "Balance Drawdown Maximal:" in line_stripped and "Balance Drawdown Relative:" in line_stripped:
-            match = re.search(r"Balance Drawdown Maximal:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)\s*\(([-+]?\s*\d[\d\s\.,-]*)\%\),*?Balance Drawdown Relative:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)\%\s*\(([-+]?\s*\d[\d\s\.,-]*)\)", line_stripped)
-            if match:
-                results_summary_parsed_from_text['Maximal_Drawdown_Value'] = clean_and_float(match.group(1))
-                results_summary_parsed_from_text['Maximal_Drawdown_Percent'] = clean_and_float(match.group(2))
-                results_summary_parsed_from_text['Balance_Drawdown_Relative_Percent'] = clean_and_float(match.group(3))
-                results_summary_parsed_from_text['Balance_Drawdown_Relative_Value'] = clean_and_float(match.group(4))
-        if "Balance Drawdown Absolute:" in line_stripped:
-            val_match = re.search(r"Balance Drawdown Absolute:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)", line_stripped)
-            if val_match: results_summary_parsed_from_text['Balance_Drawdown_Absolute'] = clean_and_float(val_match.group(1))
-        
-        if "Total Trades:" in line_stripped and "Short Trades (won %):" in line_stripped:
-            match = re.search(r"Total Trades:(?:,+)\s*(\d+)(?:,+)\s*Short Trades \(won %\):(?:\s*,+)\s*(\d+)\s*\(([-+]?\s*\d*\.?\d+)%\)(?:,+)\s*Long Trades \(won %\):(?:\s*,+)\s*(\d+)\s*\(([-+]?\s*\d*\.?\d+)%\)", line_stripped)
-            if match:
-                results_summary_parsed_from_text['Total_Trades'] = int(clean_and_float(match.group(1)))
-                results_summary_parsed_from_text['Short_Trades_Count'] = int(clean_and_float(match.group(2)))
-                results_summary_parsed_from_text['Short_Trades_Won_Percent'] = clean_and_float(match.group(3))
-                results_summary_parsed_from_text['Long_Trades_Count'] = int(clean_and_float(match.group(4)))
-                results_summary_parsed_from_text['Long_Trades_Won_Percent'] = clean_and_float(match.group(5))
-        if "Profit Trades (% of total):" in line_stripped and "Loss Trades (% of total):" in line_stripped:
-            match = re.search(r"Profit Trades \(\% of total\):,(?:,*?)(\d+)\s*\(([-+]?\s*\d*\.?\d+)%\),*?Loss Trades \(\% of total\):,(?:,*?)(\d+)\s*\(([-+]?\s*\d*\.?\d+)%\)", line_stripped)
-            if match:
-                results_summary_parsed_from_text['Profit_Trades_Count'] = int(clean_and_float(match.group(1)))
-                results_summary_parsed_from_text['Profit_Trades_Percent'] = clean_and_float(match.group(2))
-                results_summary_parsed_from_text['Loss_Trades_Count'] = int(clean_and_float(match.group(3)))
-                results_summary_parsed_from_text['Loss_Trades_Percent'] = clean_and_float(match.group(4))
-        if "Largest profit trade:" in line_stripped and "Largest loss trade:" in line_stripped:
-            match = re.search(r"Largest profit trade:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*),*?Largest loss trade:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)", line_stripped)
-            if match:
-                results_summary_parsed_from_text['Largest_Profit_Trade'] = clean_and_float(match.group(1))
-                results_summary_parsed_from_text['Largest_Loss_Trade'] = clean_and_float(match.group(2))
-        if "Average profit trade:" in line_stripped and "Average loss trade:" in line_stripped:
-            match = re.search(r"Average profit trade:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*),*?Average loss trade:,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)", line_stripped)
-            if match:
-                results_summary_parsed_from_text['Average_Profit_Trade'] = clean_and_float(match.group(1))
-                results_summary_parsed_from_text['Average_Loss_Trade'] = clean_and_float(match.group(2))
-        if "Maximum consecutive wins ($):" in line_stripped and "Maximum consecutive losses ($):" in line_stripped:
-            match = re.search(r"Maximum consecutive wins \(\$\):,(?:,*?)(\d+)\s*\(([-+]?\s*\d[\d\s\.,-]*)\),*?Maximum consecutive losses \(\$\):,(?:,*?)(\d+)\s*\(([-+]?\s*\d[\d\s\.,-]*)\)", line_stripped)
-            if match:
-                results_summary_parsed_from_text['Max_Consecutive_Wins_Count'] = int(clean_and_float(match.group(1)))
-                results_summary_parsed_from_text['Max_Consecutive_Wins_Profit'] = clean_and_float(match.group(2))
-                results_summary_parsed_from_text['Max_Consecutive_Losses_Count'] = int(clean_and_float(match.group(3)))
-                results_summary_parsed_from_text['Max_Consecutive_Losses_Profit'] = clean_and_float(match.group(4))
-        if "Maximal consecutive profit (count):" in line_stripped and "Maximal consecutive loss (count):" in line_stripped:
-            match = re.search(r"Maximal consecutive profit \(count\):,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)\s*\(([-+]?\s*\d+)\),*?Maximal consecutive loss \(count\):,(?:,*?)([-+]?\s*\d[\d\s\.,-]*)\s*\(([-+]?\s*\d+)\)", line_stripped)
-            if match:
-                results_summary_parsed_from_text['Maximal_Consecutive_Profit_Value'] = clean_and_float(match.group(1))
-                results_summary_parsed_from_text['Maximal_Consecutive_Profit_Count'] = int(clean_and_float(match.group(2)))
-                results_summary_parsed_from_text['Maximal_Consecutive_Loss_Value'] = clean_and_float(match.group(3))
-                results_summary_parsed_from_text['Maximal_Consecutive_Loss_Count'] = int(clean_and_float(match.group(4)))
-        if "Average consecutive wins:" in line_stripped and "Average consecutive losses:" in line_stripped:
-            match = re.search(r"(?:,*\s*)Average consecutive wins:(?:,+)\s*([-\s\d\.]+)(?:,+)\s*Average consecutive losses:(?:,+)\s*([-\s\d\.]+)", line_stripped)
-            if match:
-                results_summary_parsed_from_text['Average_Consecutive_Wins'] = int(clean_and_float(match.group(1)))
-                results_summary_parsed_from_text['Average_Consecutive_Losses'] = int(clean_and_float(match.group(2)))
+            _extract_summary_fields(line_stripped, summary_targets)
+        scan_record['rows'] = scanned_lines
 
     extracted_data['portfolio_details'] = portfolio_details
     extracted_data['balance_summary'].update(balance_summary_parsed_from_text) 
     extracted_data['results_summary'].update(results_summary_parsed_from_text)
 
-    # --- 2 & 3: การหาและดึงข้อมูลตาราง ---
-    section_headers_map = settings.SECTION_RAW_HEADERS_STATEMENT_PARSING
-    expected_columns_map_from_settings = {
-        "Positions": settings.WORKSHEET_HEADERS[settings.SUPABASE_TABLE_ACTUAL_POSITIONS],
-        "Orders": settings.WORKSHEET_HEADERS[settings.SUPABASE_TABLE_ACTUAL_ORDERS],
-        "Deals": settings.WORKSHEET_HEADERS[settings.SUPABASE_TABLE_ACTUAL_TRADES]
-    }
-
-    section_order = ["Positions", "Orders", "Deals"]
-    header_indices = {name: -1 for name in section_order}
-
-    for i, line in enumerate(lines):
-        line_stripped = line.strip()
-        for name, header_text in section_headers_map.items():
-            pattern = r'^' + re.escape(header_text).replace(r'\ ', r'\s*').replace(r'\,', ',') + r'\s*,*$' # เพิ่ม r'\s*,*$'
-            if re.match(pattern, line_stripped):
-                header_indices[name] = i
-                break
-
-    for i, section_name in enumerate(section_order):
-        start_index = header_indices[section_name]
-        if start_index == -1:
+    # --- 2 & 3: สร้าง DataFrame ของแต่ละตารางจากแถวที่คัดแยกไว้แล้ว ---
+    time_context = _new_time_context(issues=extracted_data['coercion_issues'])
+    for section_name in _SECTION_ORDER:
+        section_buffer = section_buffers.pop(section_name, None)
+        if section_buffer is None:
+            extracted_data[section_name.lower()] = pd.DataFrame(
+                columns=settings.WORKSHEET_HEADERS[_SECTION_TARGET_TABLES[section_name]])
             continue
-
-        data_start_line, data_end_line = start_index + 1, len(lines)
-        
-        for j, line_content in enumerate(lines[data_start_line:], start=data_start_line):
-            line_stripped = line_content.strip()
-            
-            found_next_header = False
-            for next_section_name in section_order[i+1:]:
-                next_header_text = section_headers_map[next_section_name]
-                next_pattern = r'^' + re.escape(next_header_text).replace(r'\ ', r'\s*').replace(r'\,', ',') + r'\s*,*$' # เพิ่ม r'\s*,*$'
-                if re.match(next_pattern, line_stripped):
-                    data_end_line = j
-                    found_next_header = True
-                    break
-            if found_next_header:
-                break
-            
-            summary_start_patterns_full = [
-                r"^Balance:", r"^Credit Facility:", r"^Total Net Profit:", 
-                r"^Open Positions", r"^Results"
-            ]
-            if any(re.match(pattern, line_stripped) for pattern in summary_start_patterns_full):
-                data_end_line = j
-                break
-            
-            if not line_stripped or re.fullmatch(r",*", line_stripped):
-                if j + 1 < len(lines):
-                    next_line_stripped = lines[j+1].strip()
-                    if not next_line_stripped or re.fullmatch(r",*", next_line_stripped):
-                        data_end_line = j
-                        break
-
-        section_lines = [line.strip() for line in lines[data_start_line:data_end_line] if line.strip() and ',' in line]
-        
-        if not section_lines:
-            extracted_data[section_name.lower()] = pd.DataFrame(columns=expected_columns_map_from_settings[section_name])
-            continue
-        
-        try:
-            raw_header_line = lines[start_index].strip()
-            
-            df_parsed_raw = pd.read_csv(io.StringIO("\n".join([raw_header_line] + section_lines)), 
-                                        header=0, 
-                                        skipinitialspace=True, 
-                                        dtype=str)
-            
-            column_rename_map = {}
-            target_cols_settings = expected_columns_map_from_settings[section_name]
-            
-            temp_io = io.StringIO(section_headers_map[section_name])
-            temp_df_for_pandas_headers = pd.read_csv(temp_io, nrows=0, skipinitialspace=True, dtype=str)
-            pandas_inferred_headers_from_template = list(temp_df_for_pandas_headers.columns)
-
-            for i, inferred_col in enumerate(pandas_inferred_headers_from_template):
-                if i < len(target_cols_settings):
-                    column_rename_map[inferred_col] = target_cols_settings[i]
-                
-            df_final = df_parsed_raw.rename(columns=column_rename_map)
-
-            df_final = df_final.reindex(columns=expected_columns_map_from_settings[section_name])
-            
-            if not df_final.empty:
-                if 'id' in df_final.columns:
-                    df_final.drop(columns=['id'], inplace=True, errors='ignore')
-
-                if section_name == "Deals":
-                    for col in ['Volume_Deal', 'Price_Deal', 'Commission_Deal', 'Fee_Deal', 'Swap_Deal', 'Profit_Deal', 'Balance_Deal']:
-                        if col in df_final.columns:
-                            df_final[col] = pd.to_numeric(df_final[col].astype(str).str.replace(' ', '').str.replace(',', '').str.replace('–', '-').str.replace('—', '-'), errors='coerce').fillna(0)
-                    
-                    if 'Deal_ID' in df_final.columns:
-                        df_final['Deal_ID'] = df_final['Deal_ID'].astype(str).replace('nan', '').apply(
-                            lambda x: x if x.strip() else str(uuid.uuid4())
-                        )
-
-                    if 'Time_Deal' in df_final.columns:
-                        df_final['Time_Deal'] = pd.to_datetime(df_final['Time_Deal'], format="%Y.%m.%d %H:%M:%S", errors='coerce')
-                        df_final['Time_Deal'] = df_final['Time_Deal'].fillna(pd.to_datetime(df_final['Time_Deal'].astype(str), errors='coerce'))
-                        df_final['Time_Deal'] = _ensure_utc_datetime(df_final['Time_Deal'])
-
-                elif section_name == "Orders":
-                    for col in ['Price_Ord', 'S_L_Ord', 'T_P_Ord']: 
-                        if col in df_final.columns:
-                            df_final[col] = pd.to_numeric(df_final[col].astype(str).str.replace(' ', '').str.replace(',', '').str.replace('–', '-').str.replace('—', '-'), errors='coerce').fillna(0)
-                    
-                    if 'Volume_Ord_Raw' in df_final.columns:
-                        df_final['Volume_Ord'] = df_final['Volume_Ord_Raw'].astype(str).apply(
-                            lambda x: pd.to_numeric(x.split(' ')[0], errors='coerce') if ' ' in x else pd.to_numeric(x, errors='coerce')
-                        ).fillna(0.0) 
-                        df_final.drop(columns=['Volume_Ord_Raw'], inplace=True, errors='ignore')
-                    else: 
-                        df_final['Volume_Ord'] = 0.0
-
-                    if 'Order_ID_Ord' in df_final.columns:
-                        df_final['Order_ID_Ord'] = df_final['Order_ID_Ord'].astype(str).replace('nan', '').apply(
-                            lambda x: x if x.strip() else str(uuid.uuid4())
-                        )
-
-                    for col in ['Open_Time_Ord', 'Close_Time_Ord']:
-                        if col in df_final.columns:
-                            df_final[col] = pd.to_datetime(df_final[col], format="%Y.%m.%d %H:%M:%S", errors='coerce')
-                            df_final[col] = df_final[col].fillna(pd.to_datetime(df_final[col].astype(str), errors='coerce')) 
-                            df_final[col] = _ensure_utc_datetime(df_final[col])
-                    
-                    df_final.drop(columns=['Filler_Ord_1', 'Filler_Ord_2'], inplace=True, errors='ignore')
-
-                elif section_name == "Positions":
-                    for col in ['Volume_Pos', 'Price_Open_Pos', 'S_L_Pos', 'T_P_Pos', 'Price_Close_Pos', 'Commission_Pos', 'Swap_Pos', 'Profit_Pos']:
-                        if col in df_final.columns:
-                            df_final[col] = pd.to_numeric(df_final[col].astype(str).str.replace(' ', '').str.replace(',', '').str.replace('–', '-').str.replace('—', '-'), errors='coerce').fillna(0)
-                    
-                    if 'Position_ID' in df_final.columns:
-                        df_final['Position_ID'] = df_final['Position_ID'].astype(str).replace('nan', '').apply(
-                            lambda x: x if x.strip() else str(uuid.uuid4())
-                        )
-
-                    if 'Time_Pos' in df_final.columns:
-                        df_final['Time_Pos'] = pd.to_datetime(df_final['Time_Pos'], format="%Y.%m.%d %H:%M:%S", errors='coerce')
-                        df_final['Time_Pos'] = df_final['Time_Pos'].fillna(pd.to_datetime(df_final['Time_Pos'].astype(str), errors='coerce'))
-                        df_final['Time_Pos'] = _ensure_utc_datetime(df_final['Time_Pos'])
-                    
-                    if 'Time_Close_Pos_Raw' in df_final.columns: 
-                        df_final['Time_Close_Pos'] = pd.to_datetime(df_final['Time_Close_Pos_Raw'], format="%Y.%m.%d %H:%M:%S", errors='coerce')
-                        df_final['Time_Close_Pos'] = df_final['Time_Close_Pos'].fillna(pd.to_datetime(df_final['Time_Close_Pos_Raw'].astype(str), errors='coerce')) 
-                        df_final['Time_Close_Pos'] = _ensure_utc_datetime(df_final['Time_Close_Pos'])
-                        df_final.drop(columns=['Time_Close_Pos_Raw'], inplace=True, errors='ignore')
-                    else: 
-                        df_final['Time_Close_Pos'] = pd.NaT 
-
-                extracted_data[section_name.lower()] = df_final.dropna(how='all')
-
-            else:
-                extracted_data[section_name.lower()] = pd.DataFrame(columns=expected_columns_map_from_settings[section_name])
-
-        except Exception as e: 
-            print(f"Error parsing {section_name} section: {e}")
-            extracted_data[section_name.lower()] = pd.DataFrame(columns=expected_columns_map_from_settings[section_name])
+        extracted_data[section_name.lower()] = section_buffer.build(time_context, portfolio_id)
 
     deals_df_processed = extracted_data.get('deals', pd.DataFrame()) 
 
     if not deals_df_processed.empty:
         extracted_data['results_summary']['Total_Net_Profit'] = deals_df_processed[deals_df_processed['Type_Deal'].str.lower().isin(['buy', 'sell'])]['Profit_Deal'].sum()
         
-        calculated_deposit = 0.0
-        calculated_withdrawal = 0.0
-        itemized_deposit_withdrawal_logs = []
-        balance_deals = deals_df_processed[deals_df_processed['Type_Deal'].str.lower() == 'balance'].copy()
-        
-        for _, row in balance_deals.iterrows():
-            comment = str(row.get('Comment_Deal', '')).lower()
-            profit_val = pd.to_numeric(row['Profit_Deal'], errors='coerce')
-            if pd.isna(profit_val):
-                profit_val = 0.0
-            transaction_type = 'Unknown'
-            
-            if 'w' in comment or 'withdraw' in comment:
-                transaction_type = 'Withdrawal'
-                calculated_withdrawal += profit_val
-            elif 'd' in comment or 'deposit' in comment or 'create' in comment:
-                transaction_type = 'Deposit'
-                calculated_deposit += profit_val
-            
-            if transaction_type != 'Unknown':
-                itemized_deposit_withdrawal_logs.append({
-                    "TransactionID": str(row.get('Deal_ID', '')), 
-                    "DateTime": str(row.get('Time_Deal', '')),
-                    "Type": transaction_type, 
-                    "Amount": profit_val, 
-                    "Comment": row.get('Comment_Deal', '')
-                })
+        dw_df, calculated_deposit, calculated_withdrawal = _classify_balance_deals(deals_df_processed)
         extracted_data['balance_summary']['Deposit'] = calculated_deposit
         extracted_data['balance_summary']['Withdrawal'] = calculated_withdrawal
 
-        if itemized_deposit_withdrawal_logs:
-            dw_df_raw = pd.DataFrame(itemized_deposit_withdrawal_logs)
-            if 'DateTime' in dw_df_raw.columns:
-                dw_df_raw['DateTime'] = pd.to_datetime(dw_df_raw['DateTime'], format="%Y.%m.%d %H:%M:%S", errors='coerce')
-                dw_df_raw['DateTime'] = dw_df_raw['DateTime'].fillna(pd.to_datetime(dw_df_raw['DateTime'].astype(str), errors='coerce'))
-                dw_df_raw['DateTime'] = _ensure_utc_datetime(dw_df_raw['DateTime'])
-            
-            if 'Amount' in dw_df_raw.columns:
-                dw_df_raw['Amount'] = pd.to_numeric(dw_df_raw['Amount'], errors='coerce').fillna(0)
-            
-            if 'id' in dw_df_raw.columns:
-                dw_df_raw.drop(columns=['id'], inplace=True, errors='ignore')
-
-            extracted_data['deposit_withdrawal_logs'] = dw_df_raw
+        if not dw_df.empty:
+            extracted_data['deposit_withdrawal_logs'] = dw_df
         else:
             extracted_data['deposit_withdrawal_logs'] = pd.DataFrame(columns=settings.WORKSHEET_HEADERS[settings.SUPABASE_TABLE_DEPOSIT_WITHDRAWAL_LOGS])
 
@@ -491,7 +833,21 @@ def extract_data_from_report_content(file_content_input: bytes):
         final_summary_data['Equity'] = extracted_data['balance_summary']['Equity']
 
     extracted_data['final_summary_data'] = final_summary_data
-    
+
+    if output_format == 'arrow':
+        with _profile_stage(profile, "columnar"):
+            for key, table_name in _COLUMNAR_OUTPUT_TABLES.items():
+                df = extracted_data.get(key)
+                if not isinstance(df, pd.DataFrame):
+                    df = pd.DataFrame(columns=settings.WORKSHEET_HEADERS[table_name])
+                extracted_data[key] = to_columnar_table(df, table_name)
+    extracted_data['ingest_profile'] = profile.as_records() if profile is not None else []
+
+    if debug is None:
+        debug = settings.STATEMENT_PARSER_DEBUG
+    if not debug:
+        return extracted_data
+
     print("\n--- DEBUG: Final extracted_data from statement_processor.py ---")
     for k, v in extracted_data.items():
         if isinstance(v, pd.DataFrame):
@@ -504,4 +860,135 @@ def extract_data_from_report_content(file_content_input: bytes):
             print(f"  {k} (Dict/Other): {v}")
     print("--------------------------------------------------\n")
 
-    return extracted_data
\ No newline at end of file
+    return extracted_data
+
+# --- Incremental ingest: keep only rows past the portfolio's high-water mark ---
+def _at_or_after(times: pd.Series, watermark_time) -> pd.Series:
+    """Rows at/after the watermark; unparseable times are kept so they are never silently dropped."""
+    return times.isna() | (times >= watermark_time)
+
+def apply_ingest_watermark(extracted_data: dict, watermark: dict) -> dict:
+    """
+    Trims deals / orders / positions / deposit-withdrawal rows to the delta past the
+    portfolio's high-water mark ({'Time_Deal', 'Deal_ID'} of the last imported deal), so
+    weekly re-imports of cumulative statements only upsert new rows.
+
+    The overlap is verified cheaply by looking up the watermark deal in this statement:
+    - found with the same time -> 'verified', rows before the mark are dropped
+    - missing but the statement starts after the mark -> 'ahead', nothing to drop
+    - otherwise -> 'mismatch', nothing is dropped (full upsert stays safe)
+    Summary fields are untouched because they are computed from the full statement.
+    The outcome is stored in extracted_data['watermark'].
+    """
+    deals_df = extracted_data.get('deals', pd.DataFrame())
+    status = {'status': 'none', 'time': None, 'deal_id': None, 'skipped': {}}
+    extracted_data['watermark'] = status
+    if not watermark or watermark.get('Time_Deal') is None or deals_df.empty:
+        return extracted_data
+
+    watermark_time = pd.Timestamp(watermark['Time_Deal'])
+    watermark_time = watermark_time.tz_localize('UTC') if watermark_time.tz is None else watermark_time.tz_convert('UTC')
+    watermark_id = str(watermark.get('Deal_ID') or '')
+    status.update({'time': watermark_time, 'deal_id': watermark_id})
+
+    deal_ids = deals_df['Deal_ID'].astype(str)
+    matched_times = deals_df.loc[deal_ids == watermark_id, 'Time_Deal']
+    if matched_times.empty:
+        status['status'] = 'ahead' if deals_df['Time_Deal'].min() > watermark_time else 'mismatch'
+        return extracted_data
+    if matched_times.iloc[0] != watermark_time:
+        status['status'] = 'mismatch'
+        return extracted_data
+    status['status'] = 'verified'
+
+    keep_masks = {
+        'deals': _at_or_after(deals_df['Time_Deal'], watermark_time) & (deal_ids != watermark_id),
+    }
+    orders_df = extracted_data.get('orders', pd.DataFrame())
+    if not orders_df.empty:
+        # order ที่เปิดก่อน mark แต่ fill/cancel หลัง mark ต้องอัปเดต state ด้วย
+        keep_masks['orders'] = _at_or_after(orders_df['Open_Time_Ord'], watermark_time) | (orders_df['Close_Time_Ord'] >= watermark_time)
+    positions_df = extracted_data.get('positions', pd.DataFrame())
+    if not positions_df.empty:
+        # position ที่เปิดก่อน mark แต่ยังไม่ปิด/ปิดหลัง mark ต้องอัปเดตด้วย
+        keep_masks['positions'] = _at_or_after(positions_df['Time_Close_Pos'], watermark_time) | (positions_df['Time_Pos'] >= watermark_time)
+    dw_df = extracted_data.get('deposit_withdrawal_logs')
+    if isinstance(dw_df, pd.DataFrame) and not dw_df.empty:
+        keep_masks['deposit_withdrawal_logs'] = _at_or_after(dw_df['DateTime'], watermark_time) & (dw_df['TransactionID'].astype(str) != watermark_id)
+
+    for key, keep in keep_masks.items():
+        df = extracted_data[key]
+        status['skipped'][key] = int((~keep).sum())
+        extracted_data[key] = df[keep]
+    return extracted_data
+
+# --- Batch ingest: parse many statements in worker processes ---
+def _init_parser_worker(parser_settings: dict):
+    """Worker initializer: a spawned process re-imports config.settings, so apply the parent's parser settings."""
+    for name, value in parser_settings.items():
+        setattr(settings, name, value)
+
+def _extract_report_file_job(file_name: str, file_content, portfolio_id=None) -> dict:
+    """
+    Worker entry point (must stay module-level so it can be pickled by ProcessPoolExecutor).
+    file_content is bytes or an os.PathLike path; a path is what keeps the pickled job small.
+    """
+    from core.ingest_metrics import IngestProfile
+    profile = IngestProfile(file_name)
+    return extract_data_from_report_content(file_content, portfolio_id=portfolio_id, profile=profile, debug=False)
+
+def extract_data_from_report_files(files, portfolio_id=None, max_workers=None, on_progress=None) -> dict:
+    """
+    Parses several statements in parallel worker processes.
+
+    Args:
+        files: iterable of (file_name, file_content); names must be unique. file_content is
+            bytes or an os.PathLike path to a spooled copy of the upload (preferred: only the
+            path crosses the process boundary and the worker memory-maps it).
+        portfolio_id: passed through to extract_data_from_report_content.
+        max_workers: pool size (defaults to settings.STATEMENT_BATCH_MAX_WORKERS, capped at the file count).
+        on_progress: optional callback(file_name, done_count, total_count, result) called
+            in the calling thread as each file finishes.
+
+    Returns:
+        dict: {file_name: extracted_data}. A file that failed to parse maps to {'error': message}.
+    """
+    files = list(files)
+    results = {}
+    if not files:
+        return results
+
+    total = len(files)
+    pool_size = max_workers or settings.STATEMENT_BATCH_MAX_WORKERS or os.cpu_count() or 1
+    pool_size = max(1, min(pool_size, total))
+
+    def _record(file_name, result):
+        results[file_name] = result
+        if on_progress:
+            on_progress(file_name, len(results), total, result)
+
+    if pool_size == 1:
+        # ไฟล์เดียว (หรือบังคับ 1 worker) ไม่คุ้มกับค่าใช้จ่ายในการสร้าง process
+        for file_name, file_content in files:
+            try:
+                _record(file_name, _extract_report_file_job(file_name, file_content, portfolio_id))
+            except Exception as e:
+                _record(file_name, {'error': str(e)})
+        return results
+
+    # ไม่ fork process ของ Streamlit ที่มีหลาย thread (ดู settings.STATEMENT_BATCH_START_METHOD)
+    with ProcessPoolExecutor(max_workers=pool_size,
+                             mp_context=multiprocessing.get_context(settings.STATEMENT_BATCH_START_METHOD),
+                             initializer=_init_parser_worker,
+                             initargs=({name: getattr(settings, name) for name in PARSER_SETTINGS},)) as executor:
+        futures = {
+            executor.submit(_extract_report_file_job, file_name, file_content, portfolio_id): file_name
+            for file_name, file_content in files
+        }
+        for future in as_completed(futures):
+            file_name = futures[future]
+            try:
+                _record(file_name, future.result())
+            except Exception as e:
+                _record(file_name, {'error': str(e)})
+    return results
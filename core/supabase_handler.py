@@ -1,87 +1,495 @@
 # core/supabase_handler.py (ฉบับแก้ไขสมบูรณ์)
 
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
+from postgrest.exceptions import APIError
+import httpx
 import pandas as pd
 from datetime import datetime, date
 from config import settings
+from core import local_mirror, write_behind, resilience
 import numpy as np
 import pytz 
 import uuid 
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
 # --- การเชื่อมต่อ (Connection) ---
 @st.cache_resource
 def get_supabase_client() -> Client:
     """
     สร้างและคืนค่า Supabase client โดยใช้ข้อมูลจาก st.secrets
-    ใช้ cache_resource เพื่อให้เชื่อมต่อเพียงครั้งเดียวต่อ session
+    ใช้ cache_resource เพื่อให้ทั้ง process ใช้ client (และ HTTP connection pool แบบ keep-alive) ตัวเดียวกัน
+    ทุก request มี timeout (settings.SUPABASE_TIMEOUT_SECONDS) ไม่ค้างรอ backend ที่ไม่ตอบ
     """
     try:
         url = st.secrets["supabase"]["url"]
         key = st.secrets["supabase"]["key"]
-        return create_client(url, key)
+        return create_client(url, key, options=ClientOptions(postgrest_client_timeout=settings.SUPABASE_TIMEOUT_SECONDS))
     except Exception as e:
         st.error(f"❌ ไม่สามารถเชื่อมต่อ Supabase ได้: {e}")
         return None
 
+# --- Resilience: retry + circuit breaker รอบทุก request (core/resilience.py) ---
+@st.cache_resource
+def _circuit_breaker() -> resilience.CircuitBreaker:
+    return resilience.CircuitBreaker("supabase", settings.SUPABASE_CIRCUIT_FAILURE_THRESHOLD,
+                                     settings.SUPABASE_CIRCUIT_RESET_SECONDS)
+
+# PostgREST ตอบ 503/504 ด้วย code เหล่านี้เมื่อต่อฐานข้อมูลไม่ได้ / connection pool เต็ม / schema cache ยังไม่พร้อม
+_POSTGREST_UNAVAILABLE_CODES = {'PGRST000': 503, 'PGRST001': 503, 'PGRST002': 503, 'PGRST003': 504}
+
+def _api_error_http_status(error: APIError):
+    """
+    HTTP status ของ APIError: error.code เป็น SQLSTATE/PGRST code ถ้า body เป็น JSON ของ PostgREST
+    แต่ถ้า body ไม่ใช่ JSON (เช่น 429/502 จาก gateway) postgrest จะใส่ status code เป็นตัวเลขแทน
+    """
+    code = str(error.code or '')
+    if code.isdigit() and len(code) == 3:
+        return int(code)
+    return _POSTGREST_UNAVAILABLE_CODES.get(code)
+
+def _is_transient_error(error: Exception) -> bool:
+    """
+    ลองใหม่เฉพาะ network error / timeout ของ httpx และ HTTP 429/5xx ชั่วคราว (settings.SUPABASE_RETRY_HTTP_STATUSES)
+    error ที่ server ตอบกลับมา (constraint, คอลัมน์ผิด) และ bug ในโค้ด (TypeError, KeyError, ...) ไม่ใช่
+    """
+    if isinstance(error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in settings.SUPABASE_RETRY_HTTP_STATUSES
+    if isinstance(error, APIError):
+        return _api_error_http_status(error) in settings.SUPABASE_RETRY_HTTP_STATUSES
+    return False
+
+def _execute(query, idempotent: bool, attempts: int = None, base_delay: float = None, name: str = "supabase"):
+    """
+    query.execute() ผ่าน circuit breaker: อ่าน/upsert (idempotent=True) retry แบบ jittered exponential backoff
+    เมื่อ error ชั่วคราว ส่วน insert/update/delete ส่งครั้งเดียว
+    """
+    return resilience.retry_call(
+        query.execute, is_transient=_is_transient_error, idempotent=idempotent, breaker=_circuit_breaker(),
+        attempts=settings.SUPABASE_RETRY_ATTEMPTS if attempts is None else attempts,
+        base_delay=settings.SUPABASE_RETRY_BASE_DELAY_SECONDS if base_delay is None else base_delay,
+        max_delay=settings.SUPABASE_RETRY_MAX_DELAY_SECONDS, name=name,
+    )
+
+def database_health() -> str:
+    """'closed' (ปกติ), 'open' (backend มีปัญหา กำลังใช้ข้อมูลเก่า) หรือ 'half-open' (กำลังทดสอบ)"""
+    return _circuit_breaker().state
+
 # --- ฟังก์ชัน LOAD (อ่านข้อมูล) ---
-@st.cache_data(ttl=300) # Cache for 5 minutes
-def load_data_from_table(table_name: str) -> pd.DataFrame:
+# --- Per-rerun data context ---
+# st.cache_data คืนสำเนาใหม่ทุกครั้งที่เรียก: ภายใน rerun เดียวกันเก็บ DataFrame ที่โหลดแล้วไว้ใน session_state
+# เพื่อให้ทุก section ที่ขอ (ตาราง, portfolio, ช่วงเวลา, projection) เดียวกันได้ object เดียวกันโดยไม่ต้อง copy ซ้ำ
+_RERUN_FRAMES_KEY = "_rerun_table_frames"
+
+def begin_rerun_data_context():
+    """เรียกครั้งเดียวตอนเริ่มทุก rerun (app.main) เพื่อเริ่ม context ใหม่ (ไม่ให้ข้อมูลค้างข้าม rerun)"""
+    st.session_state[_RERUN_FRAMES_KEY] = {}
+
+def _to_filter_value(value):
+    """แปลงค่า start/end เป็น ISO string (UTC) เพื่อใช้ทั้งเป็น filter และเป็น cache key ที่คงที่"""
+    if value is None or isinstance(value, str):
+        return value
+    timestamp = pd.Timestamp(value)
+    timestamp = timestamp.tz_localize('UTC') if timestamp.tz is None else timestamp.tz_convert('UTC')
+    return timestamp.isoformat()
+
+def _check_projection_columns(table_name: str, columns):
+    """คอลัมน์ที่ขอต้องมีอยู่จริงใน settings.WORKSHEET_HEADERS[table_name] (ไม่ตัดทิ้งเงียบๆ)"""
+    expected_headers = settings.WORKSHEET_HEADERS.get(table_name)
+    if expected_headers is None:
+        return
+    unknown = [col for col in columns if col not in expected_headers]
+    if unknown:
+        raise KeyError(f"Columns not in {table_name} headers: {unknown}")
+
+def _resolve_columns(table_name: str, columns):
     """
-    ฟังก์ชันกลางสำหรับโหลดข้อมูลทั้งหมดจากตารางที่ระบุ
+    columns = None (ทุกคอลัมน์), ชื่อ projection ใน settings.TABLE_PROJECTIONS หรือ list ของชื่อคอลัมน์
+    คืนค่าเป็น tuple เพื่อใช้เป็น cache key ได้
     """
-    supabase = get_supabase_client()
-    if not supabase:
-        return pd.DataFrame()
+    if columns is None:
+        return None
+    if isinstance(columns, str):
+        projection = settings.TABLE_PROJECTIONS.get(columns)
+        if projection is None:
+            raise KeyError(f"Unknown table projection: {columns}")
+        if projection["table"] != table_name:
+            raise KeyError(f"Projection {columns} is for {projection['table']}, not {table_name}")
+        columns = projection["columns"]
+    else:
+        _check_projection_columns(table_name, columns)
+    return tuple(columns)
+
+# projection ที่ตั้งชื่อผิด/ไม่มีในตารางต้องพังตั้งแต่ import ไม่ใช่คืนคอลัมน์ขาดไปตอนใช้งาน
+for _projection in settings.TABLE_PROJECTIONS.values():
+    _check_projection_columns(_projection["table"], _projection["columns"])
+
+def _select_clause(columns) -> str:
+    if not columns:
+        return '*'
+    # ชื่อคอลัมน์ที่มีช่องว่าง/สัญลักษณ์ (เช่น "Risk $") ต้องครอบด้วย " ใน PostgREST
+    return ','.join(col if col.replace('_', '').isalnum() else f'"{col}"' for col in columns)
+
+def load_data_from_table(table_name: str, portfolio_id=None, start=None, end=None, columns=None) -> pd.DataFrame:
+    """
+    ฟังก์ชันกลางสำหรับโหลดข้อมูลจากตารางที่ระบุ
+    portfolio_id / start / end (optional) ถูกส่งไปกรองฝั่ง server (PortfolioID = ..., เวลาในคอลัมน์
+    settings.TABLE_TIME_COLUMNS[table_name] ในช่วง [start, end)) แทนการโหลดทั้งตารางมากรองใน pandas
+    columns (optional) เลือกเฉพาะคอลัมน์ที่ต้องใช้: list ของชื่อคอลัมน์ หรือชื่อ projection ใน settings.TABLE_PROJECTIONS
+    แต่ละ scope (ตาราง + portfolio + ช่วงเวลา + projection) ถูก cache แยกกัน
+    และผูกกับ version ของ (ตาราง, portfolio) -> การเขียนข้อมูลจะทำให้เฉพาะ scope ที่เกี่ยวข้องโหลดใหม่
+    ภายใน rerun เดียวกัน (ดู begin_rerun_data_context) ทุกผู้เรียกได้ DataFrame object เดียวกัน: ห้ามแก้ไขในที่ (ใช้ .copy() ก่อน)
+    """
+    scope_key = _scope_key(table_name, portfolio_id, start, end, columns)
+    rerun_frames = st.session_state.get(_RERUN_FRAMES_KEY)
+    if rerun_frames is not None and scope_key in rerun_frames:
+        return rerun_frames[scope_key]
+    df, notice = _load_scope(scope_key)
+    return _publish_scope(scope_key, df, notice)
+
+def _scope_key(table_name: str, portfolio_id, start, end, columns) -> tuple:
+    """(ตาราง, portfolio, start, end, columns, cache version) ใช้เป็น key ของ rerun context"""
+    portfolio_key = None if portfolio_id is None else str(portfolio_id)
+    scope = (table_name, portfolio_key, _to_filter_value(start), _to_filter_value(end), _resolve_columns(table_name, columns))
+    return scope + (_cache_version(table_name, portfolio_key),)
+
+def _load_scope(scope_key: tuple):
+    """
+    โหลด scope หนึ่ง คืนค่า (DataFrame, notice) โดยไม่แตะ st.session_state หรือแสดงข้อความ
+    จึงเรียกจาก worker thread ได้ (prefetch_startup_data) notice = None หรือ (ระดับ, ข้อความ) ให้ script thread แสดง
+    """
+    scope, cache_version = scope_key[:-1], scope_key[-1]
+    table_name, portfolio_key = scope[0], scope[1]
     try:
-        response = supabase.table(table_name).select('*').execute()
-        return pd.DataFrame(response.data)
+        df = _load_table_scope(*scope, cache_version=cache_version)
+        _remember_good_frame(scope, df)
+        return df, None
     except Exception as e:
-        st.error(f"❌ Supabase Error (load {table_name}): {e}")
-        return pd.DataFrame()
+        # backend มีปัญหา: ใช้ข้อมูลล่าสุดที่เคยโหลดได้ (หรือจาก local mirror) แทนหน้าว่าง
+        df = _stale_frame(scope)
+        if df is None:
+            return pd.DataFrame(), ('error', f"❌ Supabase Error (load {table_name}): {e}")
+        logger.warning("serving stale %s (portfolio %s): %s", table_name, portfolio_key, e)
+        return df, ('warning', f"⚠️ ฐานข้อมูลไม่พร้อมใช้งานชั่วคราว กำลังแสดงข้อมูล {table_name} ล่าสุดที่มี")
+
+def _publish_scope(scope_key: tuple, df: pd.DataFrame, notice) -> pd.DataFrame:
+    """ส่วนที่ต้องทำบน script thread: แสดง notice และเก็บ DataFrame ไว้ใน rerun context"""
+    if notice is not None:
+        level, message = notice
+        (st.error if level == 'error' else st.warning)(message)
+    rerun_frames = st.session_state.get(_RERUN_FRAMES_KEY)
+    if rerun_frames is not None:
+        rerun_frames[scope_key] = df
+    return df
 
-def load_portfolios():
-    return load_data_from_table("Portfolios")
+@st.cache_resource
+def _last_good_frames() -> tuple:
+    """
+    ผลโหลดสำเร็จล่าสุดต่อ (ตาราง, portfolio) ใช้เมื่อ backend ล่ม: (lock, OrderedDict เรียงแบบ LRU)
+    จำกัดไว้ที่ settings.SUPABASE_STALE_FRAMES_MAX_ENTRIES รายการ
+    """
+    return threading.Lock(), OrderedDict()
+
+def _covers(stored_columns, columns) -> bool:
+    # None = ทุกคอลัมน์
+    return stored_columns is None or (columns is not None and set(columns) <= set(stored_columns))
+
+def _remember_good_frame(scope: tuple, df: pd.DataFrame):
+    table_name, portfolio_id, start, end, columns = scope
+    if start is not None or end is not None:
+        return # ช่วงเวลาย่อยไม่ใช่ข้อมูลทั้งตาราง: ไม่เก็บ (ไม่ให้ทุกช่วงที่เคยดูค้างอยู่ในหน่วยความจำ)
+    lock, frames = _last_good_frames()
+    key = (table_name, portfolio_id)
+    with lock:
+        stored = frames.get(key)
+        # projection แคบไม่ทับข้อมูลที่มีคอลัมน์มากกว่า (จะใช้แทน projection อื่นไม่ได้)
+        if stored is None or _covers(columns, stored[1]):
+            # เก็บสำเนา: DataFrame ที่คืนให้ผู้เรียกอาจถูกแก้ในที่ ข้อมูลสำรองต้องไม่เปลี่ยนตาม
+            frames[key] = (df.copy(), columns)
+        frames.move_to_end(key)
+        while len(frames) > max(int(settings.SUPABASE_STALE_FRAMES_MAX_ENTRIES), 1):
+            frames.popitem(last=False)
+
+def _stale_frame(scope: tuple):
+    table_name, portfolio_id, start, end, columns = scope
+    lock, frames = _last_good_frames()
+    with lock:
+        stored = frames.get((table_name, portfolio_id))
+        if stored is not None:
+            frames.move_to_end((table_name, portfolio_id))
+    time_column = settings.TABLE_TIME_COLUMNS.get(table_name)
+    time_filter_ok = (start is None and end is None) or (stored is not None and time_column in stored[0].columns)
+    if stored is not None and _covers(stored[1], columns) and time_filter_ok:
+        # คืนสำเนา: ผู้เรียกแก้ DataFrame ได้โดยไม่กระทบข้อมูลที่เก็บไว้
+        return _apply_scope_locally(stored[0], table_name, start, end, columns).copy()
+    if portfolio_id is not None and local_mirror.is_mirrored(table_name):
+        local_df = local_mirror.read_local(table_name, portfolio_id)
+        if local_df is not None:
+            return _apply_scope_locally(local_df, table_name, start, end, columns)
+    return None
 
-def load_all_planned_trade_logs():
-    return load_data_from_table("PlannedTradeLogs")
+@st.cache_data(ttl=300) # Cache for 5 minutes
+def _load_table_scope(table_name: str, portfolio_id: str = None, start: str = None, end: str = None,
+                      columns: tuple = None, cache_version: tuple = None) -> pd.DataFrame:
+    # cache_version ไม่ได้ใช้ในตัวฟังก์ชัน แต่เป็นส่วนหนึ่งของ cache key (ดู _cache_version)
+    supabase = get_supabase_client()
+    if not supabase:
+        return pd.DataFrame()
 
-def load_actual_trades():
-    return load_data_from_table("ActualTrades")
+    if portfolio_id is not None and local_mirror.is_mirrored(table_name):
+        try:
+            return _load_from_mirror(supabase, table_name, portfolio_id, start, end, columns)
+        except resilience.CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.warning("mirror load of %s failed, loading from Supabase: %s", table_name, e)
+
+    def build_query(count=None):
+        query = supabase.table(table_name).select(_select_clause(columns), count=count)
+        if portfolio_id is not None:
+            query = query.eq('PortfolioID', portfolio_id)
+        time_column = settings.TABLE_TIME_COLUMNS.get(table_name)
+        if time_column and start is not None:
+            query = query.gte(time_column, start)
+        if time_column and end is not None:
+            query = query.lt(time_column, end)
+        return query
+
+    # error ถูกส่งต่อ (st.cache_data ไม่ cache exception) ให้ load_data_from_table เลือกใช้ข้อมูลเก่าแทน
+    return _fetch_all_pages(build_query, table_name)
+
+def _load_from_mirror(supabase, table_name: str, portfolio_id: str, start: str, end: str, columns: tuple) -> pd.DataFrame:
+    """
+    อ่านทั้ง partition ของ portfolio จาก local mirror (ดึงเฉพาะแถวใหม่จาก server)
+    แล้วกรองช่วงเวลาและเลือกคอลัมน์ในเครื่องแทนการส่ง filter ไปที่ server
+    """
+    sync_column = settings.LOCAL_MIRROR_SYNC_COLUMNS[table_name]
+
+    def fetch_rows(since):
+        def build_query(count=None):
+            query = supabase.table(table_name).select('*', count=count).eq('PortfolioID', portfolio_id)
+            # >= : แถวที่เพิ่งเข้ามาใน batch / timestamp เดียวกับ watermark ก็ถูกดึงด้วย (merge ตาม key ตัดแถวซ้ำ)
+            return query if since is None else query.gte(sync_column, since)
+        return _fetch_all_pages(build_query, table_name)
+
+    return _apply_scope_locally(local_mirror.load_synced(table_name, portfolio_id, fetch_rows),
+                                table_name, start, end, columns)
+
+def _apply_scope_locally(df: pd.DataFrame, table_name: str, start: str, end: str, columns: tuple) -> pd.DataFrame:
+    """กรองช่วงเวลาและเลือกคอลัมน์ในเครื่อง (สำหรับข้อมูลจาก local mirror)"""
+    time_column = settings.TABLE_TIME_COLUMNS.get(table_name)
+    if time_column in df.columns and (start is not None or end is not None):
+        times = pd.to_datetime(df[time_column], utc=True, errors='coerce')
+        mask = pd.Series(True, index=df.index)
+        if start is not None:
+            mask &= times >= pd.Timestamp(_to_filter_value(pd.Timestamp(start)))
+        if end is not None:
+            mask &= times < pd.Timestamp(_to_filter_value(pd.Timestamp(end)))
+        df = df[mask]
+    if columns:
+        # คอลัมน์ถูกตรวจกับ WORKSHEET_HEADERS แล้ว: ถ้าข้อมูลในเครื่องไม่มี ให้เป็นค่าว่าง (เหมือน server ที่ยังไม่มีค่า)
+        df = df.reindex(columns=list(columns))
+    return df.reset_index(drop=True)
+
+def _fetch_all_pages(build_query, table_name: str) -> pd.DataFrame:
+    """
+    โหลดทุกแถวเป็นหน้า ๆ ด้วย range() (PostgREST ตัดผลลัพธ์ที่ max-rows ถ้าขอทีเดียว)
+    หน้าแรกขอ count='exact' เพื่อรู้จำนวนแถวทั้งหมด แล้วดึงหน้าที่เหลือพร้อมกันบน thread pool
+    แต่ละหน้าเป็น DataFrame ของตัวเองแล้ว concat ครั้งเดียวตอนจบ
+    สถิติ (จำนวนแถว, เวลาแต่ละหน้า) อยู่ใน df.attrs['fetch_stats'] และถูก log ไว้
+    """
+    page_size = max(int(settings.SUPABASE_PAGE_SIZE), 1)
+    order_key = settings.TABLE_PAGINATION_KEYS.get(table_name)
+    started = time.perf_counter()
+
+    def fetch_page(first_row: int, last_row: int, count=None):
+        page_started = time.perf_counter()
+        query = build_query(count)
+        if order_key:
+            query = query.order(order_key) # ลำดับคงที่ หน้าไม่ซ้อน/ไม่หายระหว่างดึงพร้อมกัน
+        response = _execute(query.range(first_row, last_row), idempotent=True, name=f"load {table_name}")
+        return response, time.perf_counter() - page_started
+
+    first_response, first_latency = fetch_page(0, page_size - 1, count='exact')
+    pages = {0: pd.DataFrame.from_records(first_response.data or [])}
+    page_latencies = [first_latency]
+    total_rows = getattr(first_response, 'count', None)
+    # server อาจตัดหน้าให้สั้นกว่าที่ขอ (max-rows) -> ใช้ขนาดหน้าจริงแทน
+    page_size = len(pages[0]) if 0 < len(pages[0]) < page_size and (total_rows or 0) > len(pages[0]) else page_size
+
+    if total_rows is not None:
+        offsets = list(range(len(pages[0]), total_rows, page_size))
+        with ThreadPoolExecutor(max_workers=max(int(settings.SUPABASE_FETCH_MAX_WORKERS), 1)) as executor:
+            futures = {executor.submit(fetch_page, offset, offset + page_size - 1): offset for offset in offsets}
+            for future in as_completed(futures):
+                response, latency = future.result()
+                pages[futures[future]] = pd.DataFrame.from_records(response.data or [])
+                page_latencies.append(latency)
+    else:
+        # ไม่รู้จำนวนแถวทั้งหมด: ดึงทีละหน้า หน้าแรกที่สั้นกว่าที่ขออาจเป็นแค่ max-rows ของ server (ไม่ใช่หน้าสุดท้าย)
+        # จึงใช้ขนาดที่ได้จริงเป็นขนาดหน้าแล้วขอต่อ หยุดเมื่อได้หน้าว่าง หรือหน้าที่สั้นกว่าขนาดหน้าที่ยืนยันแล้ว
+        offset = page_len = len(pages[0])
+        size_confirmed = page_len >= page_size
+        if 0 < page_len < page_size:
+            page_size = page_len
+        while page_len > 0 and (page_len >= page_size or not size_confirmed):
+            response, latency = fetch_page(offset, offset + page_size - 1)
+            page_latencies.append(latency)
+            last_page = pd.DataFrame.from_records(response.data or [])
+            page_len = len(last_page)
+            if last_page.empty:
+                break
+            pages[offset] = last_page
+            offset += page_len
+            size_confirmed = True
+
+    frames = [pages[offset] for offset in sorted(pages) if not pages[offset].empty]
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else (frames[0] if frames else pd.DataFrame())
+    stats = {
+        'table': table_name,
+        'rows': len(df),
+        'expected_rows': total_rows,
+        'pages': len(page_latencies),
+        'page_latency_seconds': page_latencies,
+        'seconds': time.perf_counter() - started,
+    }
+    df.attrs['fetch_stats'] = stats
+    logger.info("fetched %s: %d rows (expected %s) in %d pages, %.3fs (slowest page %.3fs)",
+                table_name, stats['rows'], total_rows, stats['pages'], stats['seconds'], max(page_latencies))
+    return df
+
+def load_portfolios(columns=None):
+    return load_data_from_table("Portfolios", columns=columns)
+
+def load_all_planned_trade_logs(portfolio_id=None, start=None, end=None, columns=None):
+    return load_data_from_table("PlannedTradeLogs", portfolio_id, start, end, columns)
+
+def load_actual_trades(portfolio_id=None, start=None, end=None, columns=None):
+    return load_data_from_table("ActualTrades", portfolio_id, start, end, columns)
+
+def load_deposit_withdrawal_logs(portfolio_id=None, start=None, end=None, columns=None):
+    return load_data_from_table("DepositWithdrawalLogs", portfolio_id, start, end, columns)
+
+def load_upload_history(portfolio_id=None, start=None, end=None, columns=None):
+    return load_data_from_table("UploadHistory", portfolio_id, start, end, columns)
+
+def load_statement_summaries(portfolio_id=None, start=None, end=None, columns=None):
+    return load_data_from_table("StatementSummaries", portfolio_id, start, end, columns)
+
+
+def prefetch_startup_data(portfolio_id=None) -> dict:
+    """
+    โหลดทุกตารางที่หน้าแรกใช้พร้อมกันบน thread pool แทนการโหลดต่อกันทีละตาราง
+    ใช้ scope (ตาราง / portfolio / projection) เดียวกับ loader ของแต่ละ section จึงอุ่น cache และ rerun context ให้ด้วย
+    worker thread คืนค่า (DataFrame, ข้อความ) กลับมา ส่วนการแสดง st.error / st.warning และการเขียน session_state ทำบน script thread
+    เมื่อ cache หมดอายุ เวลาที่รอจะเท่ากับ query ที่ช้าที่สุด ไม่ใช่ผลรวมของทุก query
+    คืนค่า {key: DataFrame}; ถ้ายังไม่รู้ portfolio_id จะโหลดเฉพาะ Portfolios
+    """
+    loads = {
+        'portfolios': ("Portfolios", None, None),
+        'sidebar_portfolios': ("Portfolios", None, "sidebar_portfolios"),
+    }
+    if portfolio_id:
+        loads.update({
+            'statement_summaries': ("StatementSummaries", portfolio_id, None),
+            'actual_trades': ("ActualTrades", portfolio_id, None),
+            'edge_score_trades': ("ActualTrades", portfolio_id, "edge_score"),
+            'planned_trade_logs': ("PlannedTradeLogs", portfolio_id, None),
+        })
+
+    started = time.perf_counter()
+    scope_keys = {key: _scope_key(table_name, table_portfolio_id, None, None, columns)
+                  for key, (table_name, table_portfolio_id, columns) in loads.items()}
+    # projection ของ scope ที่โหลดทั้งตารางอยู่แล้ว (เช่น sidebar_portfolios จาก Portfolios) ตัดคอลัมน์จาก frame เต็มแทนการ query ซ้ำ
+    full_scope_keys = {(table_name, table_portfolio_id): key
+                       for key, (table_name, table_portfolio_id, columns) in loads.items() if columns is None}
+    derived_from = {key: full_scope_keys[(table_name, table_portfolio_id)]
+                    for key, (table_name, table_portfolio_id, columns) in loads.items()
+                    if columns is not None and (table_name, table_portfolio_id) in full_scope_keys}
+    rerun_frames = st.session_state.get(_RERUN_FRAMES_KEY) or {}
+    results = {key: rerun_frames[scope_key] for key, scope_key in scope_keys.items() if scope_key in rerun_frames}
+    pending = {key: scope_key for key, scope_key in scope_keys.items() if key not in results and key not in derived_from}
+
+    loaded = {}
+    if pending:
+        ctx = get_script_run_ctx()
+        # worker thread เรียกแค่ _load_scope (cache + query) ส่วน st.error / st.warning / session_state ทำบน script thread ด้านล่าง
+        with ThreadPoolExecutor(max_workers=max(int(settings.STARTUP_PREFETCH_MAX_WORKERS), 1),
+                                initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)) as executor:
+            futures = {executor.submit(_load_scope, scope_key): key for key, scope_key in pending.items()}
+            for future in as_completed(futures):
+                try:
+                    loaded[futures[future]] = future.result()
+                except Exception as e:
+                    loaded[futures[future]] = (pd.DataFrame(), ('error', f"❌ Supabase Error (prefetch {futures[future]}): {e}"))
+        for key in pending: # ลำดับคงที่ตาม loads
+            df, notice = loaded[key]
+            results[key] = _publish_scope(pending[key], df, notice)
+    projected = [key for key in derived_from if key not in results]
+    for key in projected:
+        # reindex คืน DataFrame ใหม่เสมอ (frame เต็มแชร์กับ section อื่นใน rerun) notice แสดงไปแล้วกับ frame เต็ม
+        results[key] = _publish_scope(scope_keys[key], results[derived_from[key]].reindex(columns=list(scope_keys[key][4])), None)
+    logger.info("prefetched %d tables (%d loaded, %d projected locally) for portfolio %s in %.3fs",
+                len(results), len(pending), len(projected), portfolio_id, time.perf_counter() - started)
+    return results
 
-def load_deposit_withdrawal_logs():
-    return load_data_from_table("DepositWithdrawalLogs")
+# --- ฟังก์ชัน SAVE / UPDATE / DELETE ---
 
-def load_upload_history():
-    return load_data_from_table("UploadHistory")
+# --- Cache invalidation ---
+# แต่ละ (ตาราง, portfolio) มีตัวนับ version ที่แชร์กันทุก session (cache_resource)
+# การโหลดส่ง version ปัจจุบันเป็นส่วนหนึ่งของ cache key เมื่อเขียนข้อมูลก็เพิ่ม version ของ scope ที่ถูกแก้
+# entry เก่าจะไม่ถูกใช้อีกและหมดอายุไปเองตาม ttl ส่วน scope อื่น ๆ ยังใช้ cache เดิมได้
+_TABLE_WIDE = None       # การเขียนที่ไม่รู้ portfolio: ทุก scope ของตารางโหลดใหม่
+_ANY_PORTFOLIO = "*"     # เพิ่มทุกครั้งที่มีการเขียนของ portfolio ใดก็ตาม: ใช้กับการโหลดแบบไม่กรอง portfolio
 
-def load_statement_summaries():
-    return load_data_from_table("StatementSummaries")
+@st.cache_resource
+def _cache_version_store() -> dict:
+    return {'lock': threading.Lock(), 'versions': {}}
 
+def _cache_version(table_name: str, portfolio_id: str = None) -> tuple:
+    store = _cache_version_store()
+    scope = _ANY_PORTFOLIO if portfolio_id is None else str(portfolio_id)
+    with store['lock']:
+        versions = store['versions']
+        return (versions.get((table_name, _TABLE_WIDE), 0), versions.get((table_name, scope), 0))
 
-# --- ฟังก์ชัน SAVE / UPDATE / DELETE ---
+def invalidate_table_cache(table_name: str, portfolio_ids=None):
+    """
+    ทำให้ cache ของ table_name ที่เกี่ยวกับ portfolio_ids (str หรือ iterable) หมดอายุ
+    portfolio_ids=None -> ทุก scope ของตารางนี้
+    """
+    store = _cache_version_store()
+    if portfolio_ids is None:
+        scopes = [_TABLE_WIDE]
+    else:
+        if isinstance(portfolio_ids, str):
+            portfolio_ids = [portfolio_ids]
+        scopes = {str(portfolio_id) for portfolio_id in portfolio_ids} | {_ANY_PORTFOLIO}
+    with store['lock']:
+        versions = store['versions']
+        for scope in scopes:
+            versions[(table_name, scope)] = versions.get((table_name, scope), 0) + 1
+
+def _portfolio_ids_of(records: list):
+    """PortfolioID ทั้งหมดใน records หรือ None (ทั้งตาราง) ถ้ามีแถวที่ไม่ระบุ PortfolioID"""
+    portfolio_ids = {record.get('PortfolioID') for record in records}
+    return None if None in portfolio_ids or not portfolio_ids else portfolio_ids
 
 def clear_all_caches():
     """
-    ฟังก์ชันสำหรับล้าง cache ทั้งหมดหลังจากมีการเปลี่ยนแปลงข้อมูล
+    ล้าง cache ของทุกตารางทุก session (ใช้เมื่อต้องการโหลดใหม่ทั้งหมด การเขียนข้อมูลใช้ invalidate_table_cache)
     """
-    load_data_from_table.clear()
-
-
-# Helper function to convert various datetime types to ISO format string
-def _convert_datetime_to_iso_string(value):
-    if isinstance(value, (datetime, pd.Timestamp, np.datetime64)):
-        # Ensure it's a pandas Timestamp for .isoformat() then remove timezone if it's there (Supabase likes naive for 'timestamp' type)
-        # Or keep timezone if the Supabase column is 'timestamptz'
-        # For simplicity and broad compatibility with 'timestamp' or 'timestamptz' in Supabase:
-        # Convert to UTC and then to ISO format string.
-        if isinstance(value, np.datetime64):
-            value = pd.Timestamp(value)
-        
-        if value.tz is not None: # If timezone-aware, convert to UTC then naive
-             return value.tz_convert(None).isoformat() # Convert to naive UTC and then ISO string
-        else: # If timezone-naive, assume UTC for now and convert
-             return value.isoformat()
-    return value
+    _load_table_scope.clear()
 
 
 def _convert_datetime_to_iso_string(value):
@@ -111,6 +519,55 @@ def _convert_datetime_to_iso_string(value):
     return value
 
 
+# --- แปลงข้อมูลเป็น JSON-ready records ก่อนเขียนลงฐานข้อมูล ---
+def _json_ready_value(value):
+    """ค่าเดี่ยว: NaN/None/'' -> None, numpy scalar -> Python native, datetime -> ISO string (UTC, ลงท้าย Z)"""
+    if value is None or (isinstance(value, str) and value == ''):
+        return None
+    if isinstance(value, (datetime, pd.Timestamp, np.datetime64)):
+        return _convert_datetime_to_iso_string(value)
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def _json_ready_record(record: dict) -> dict:
+    return {k: _json_ready_value(v) for k, v in record.items()}
+
+def _json_ready_column(series: pd.Series) -> list:
+    """แปลงทั้งคอลัมน์ทีเดียว (vectorized) แทนการวนทีละ cell"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(series.cat.categories.dtype)
+    if pd.api.types.is_datetime64_any_dtype(series):
+        naive_utc = series.dt.tz_convert('UTC').dt.tz_localize(None) if series.dt.tz is not None else series
+        # รูปแบบเดียวกับ _convert_datetime_to_iso_string: 2024-01-01T05:00:00.000Z
+        iso = np.datetime_as_string(naive_utc.to_numpy(dtype='datetime64[ms]'), unit='ms')
+        values = np.char.add(iso, 'Z').astype(object)
+        missing = series.isna().to_numpy()
+    elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        # ndarray.astype(object) ให้ float/int/bool ของ Python อยู่แล้ว
+        values = series.to_numpy().astype(object)
+        missing = series.isna().to_numpy()
+    else:
+        inferred = pd.api.types.infer_dtype(series, skipna=True)
+        if inferred not in ('string', 'empty'):
+            # คอลัมน์ object ที่ปนชนิด (datetime, numpy scalar ฯลฯ) ใช้ตัวแปลงทีละค่า
+            return [_json_ready_value(v) for v in series.to_numpy()]
+        values = series.to_numpy(dtype=object)
+        missing = (series.isna() | (series == '')).to_numpy()
+    values[missing] = None
+    return values.tolist()
+
+def _json_ready_records(df: pd.DataFrame) -> list:
+    """DataFrame -> list ของ dict ที่ส่งให้ Supabase ได้ทันที (แปลงทีละคอลัมน์ แล้ว zip เป็นแถว)"""
+    if df.empty:
+        return []
+    columns = [str(col) for col in df.columns]
+    column_values = [_json_ready_column(df.iloc[:, i]) for i in range(df.shape[1])]
+    return [dict(zip(columns, row)) for row in zip(*column_values)]
+
+
 def save_planned_trade_logs(plan_data_list: list, trade_mode: str, asset_name: str, risk_percentage: float, trade_direction: str, portfolio_id: str, portfolio_name: str) -> tuple[bool, str]:
     """
     บันทึก Trade Plan ใหม่ (อาจมีหลาย entries) ลงในตาราง PlannedTradeLogs
@@ -137,23 +594,123 @@ def save_planned_trade_logs(plan_data_list: list, trade_mode: str, asset_name: s
                 **entry_data
             }
             # Clean values before insertion (e.g., NaN/None/empty string to None, and datetime to ISO string)
-            cleaned_entry = {}
-            for k, v in full_log_entry.items():
-                if pd.isna(v) or v == '':
-                    cleaned_entry[k] = None
-                else:
-                    cleaned_entry[k] = _convert_datetime_to_iso_string(v) # ใช้ helper function
-            rows_to_insert.append(cleaned_entry)
+            rows_to_insert.append(_json_ready_record(full_log_entry))
+
+        if settings.WRITE_BEHIND_ENABLED:
+            # ไม่รอ network: เก็บลง spool ในเครื่องแล้ว worker จะส่งเข้าฐานข้อมูลเบื้องหลัง (และล้าง cache ตอนส่งเสร็จ)
+            # ยังไม่ได้เขียนจริง: บอกว่าเข้าคิวแล้ว พร้อมสถานะของรายการที่ค้าง/ถูกปฏิเสธก่อนหน้า
+            enqueue_insert("PlannedTradeLogs", rows_to_insert)
+            status_message, _ = write_behind_status_message("PlannedTradeLogs")
+            return True, "เข้าคิวบันทึก Trade Plan แล้ว (จะส่งเข้าฐานข้อมูลเบื้องหลัง)" + (f"\n{status_message}" if status_message else "")
 
         if rows_to_insert:
-            response = supabase.table("PlannedTradeLogs").insert(rows_to_insert).execute()
+            response = _execute(supabase.table("PlannedTradeLogs").insert(rows_to_insert), idempotent=False)
         
-        clear_all_caches()
+        invalidate_table_cache("PlannedTradeLogs", portfolio_id)
         return True, "บันทึก Trade Plan สำเร็จ!"
     except Exception as e:
         return False, f"เกิดข้อผิดพลาดในการบันทึก Trade Plan: {e}"
 
 
+# --- Write-behind queue (core/write_behind.py) สำหรับ insert เล็ก ๆ ที่ไม่ควรทำให้ UI รอ ---
+@st.cache_resource
+def _write_behind_keyless_tables() -> dict:
+    """ตารางที่ฐานข้อมูลยังไม่รองรับ upsert ด้วย key ใน settings.WRITE_BEHIND_CONFLICT_KEYS: {table_name: ตัดคอลัมน์ key ทิ้งหรือไม่}"""
+    return {}
+
+def _missing_conflict_support(error: Exception, conflict_key: str):
+    """
+    None ถ้า error ไม่เกี่ยวกับ key ของ upsert, True ถ้าไม่มีคอลัมน์ key (42703 / PGRST204),
+    False ถ้ามีคอลัมน์แต่ไม่มี unique constraint (42P10)
+    """
+    if not isinstance(error, APIError):
+        return None
+    code, message = str(error.code or ''), f"{getattr(error, 'message', '')} {error}"
+    if code in ('42703', 'PGRST204') and conflict_key in message:
+        return True
+    if code == '42P10':
+        return False
+    return None
+
+def _write_behind_batch(table_name: str, records: list):
+    """
+    ถูกเรียกบน worker thread: เขียนหนึ่ง batch แล้วหมดอายุ cache ของ scope ที่ถูกเขียน (raise ถ้าไม่สำเร็จ)
+    ตารางที่มี key ใน settings.WRITE_BEHIND_CONFLICT_KEYS ใช้ upsert ที่ข้ามแถวที่มีอยู่แล้ว: batch ที่ถูกส่งซ้ำไม่สร้างแถวซ้ำ
+    ถ้า schema ยังไม่มีคอลัมน์/unique constraint ของ key (ยังไม่ได้ migrate) จะถอยไปใช้ insert ธรรมดา (ไม่กันแถวซ้ำ)
+    """
+    supabase = get_supabase_client()
+    if not supabase:
+        raise ConnectionError("ไม่สามารถเชื่อมต่อ Supabase ได้")
+    conflict_key = settings.WRITE_BEHIND_CONFLICT_KEYS.get(table_name)
+    keyless_tables = _write_behind_keyless_tables()
+    if conflict_key and table_name not in keyless_tables:
+        query = supabase.table(table_name).upsert(records, on_conflict=conflict_key, ignore_duplicates=True)
+        try:
+            response = _execute(query, idempotent=True, name=f"write-behind {table_name}")
+        except Exception as e:
+            strip_key = _missing_conflict_support(e, conflict_key)
+            if strip_key is None:
+                raise
+            logger.warning("%s has no usable %s for upsert (%s); falling back to plain inserts, "
+                           "re-sent batches may create duplicate rows", table_name, conflict_key, e)
+            keyless_tables[table_name] = strip_key
+            return _write_behind_batch(table_name, records)
+    else:
+        if keyless_tables.get(table_name):
+            records = [{k: v for k, v in record.items() if k != conflict_key} for record in records]
+        response = _execute(supabase.table(table_name).insert(records), idempotent=False, name=f"write-behind {table_name}")
+    if getattr(response, 'error', None) is not None:
+        raise RuntimeError(str(response.error))
+    invalidate_table_cache(table_name, _portfolio_ids_of(records))
+
+def _is_retryable_write_behind_error(error: Exception) -> bool:
+    """
+    error ถาวร (4xx, คอลัมน์ผิด, constraint) -> record ถูกย้ายไป dead_letter ไม่ขวางคิว
+    circuit เปิดอยู่ หรือยังไม่มี client (ConnectionError จาก _write_behind_batch) ไม่ได้แปลว่า record ผิด: เก็บไว้ส่งใหม่
+    """
+    return isinstance(error, (resilience.CircuitOpenError, ConnectionError)) or _is_transient_error(error)
+
+@st.cache_resource
+def _write_behind_queue() -> write_behind.WriteBehindQueue:
+    queue = write_behind.WriteBehindQueue(
+        settings.WRITE_BEHIND_SPOOL_PATH, _write_behind_batch,
+        batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+        flush_interval=settings.WRITE_BEHIND_FLUSH_INTERVAL_SECONDS,
+        is_transient=_is_retryable_write_behind_error,
+    )
+    queue.start() # ส่งรายการที่ค้างจากรอบก่อน (restart) ด้วย
+    return queue
+
+def start_write_behind_worker():
+    """เรียกตอนเริ่มแอป: สร้าง queue และ worker (ครั้งเดียวต่อ process)"""
+    if settings.WRITE_BEHIND_ENABLED:
+        _write_behind_queue().start()
+
+def enqueue_insert(table_name: str, records: list) -> int:
+    """เก็บ records (JSON-ready) ลง write-behind queue แล้วคืนค่าทันที คืนค่าจำนวนรายการที่รอส่ง"""
+    return _write_behind_queue().enqueue(table_name, records)
+
+def write_behind_stats(table_name: str = None) -> dict:
+    """depth, dead_letter, oldest_pending_seconds, last_flush_seconds, last_error ฯลฯ ของ write-behind queue (เฉพาะตารางถ้าระบุ)"""
+    return _write_behind_queue().stats(table_name)
+
+def write_behind_status_message(table_name: str):
+    """
+    สถานะของรายการใน table_name ที่ยังรอส่ง / ส่งไม่ผ่าน / ถูกฐานข้อมูลปฏิเสธ คืนค่า (ข้อความ หรือ None ถ้าไม่มีอะไรค้าง,
+    True ถ้ามีรายการที่ส่งไม่ผ่านหรือถูกปฏิเสธซึ่งผู้ใช้ควรรู้)
+    """
+    queue_stats = write_behind_stats(table_name)
+    parts = []
+    if queue_stats['depth']:
+        parts.append(f"⏳ รอส่งเข้าฐานข้อมูล {queue_stats['depth']} รายการ")
+    if queue_stats['last_error']:
+        parts.append(f"ส่งไม่สำเร็จ จะลองใหม่: {queue_stats['last_error']}")
+    if queue_stats['dead_letter']:
+        parts.append(f"⚠️ ถูกฐานข้อมูลปฏิเสธ {queue_stats['dead_letter']} รายการ (เก็บไว้ใน dead_letter ของ {settings.WRITE_BEHIND_SPOOL_PATH})"
+                     + (f": {queue_stats['last_dead_letter_error']}" if queue_stats['last_dead_letter_error'] else ""))
+    return (" · ".join(parts) if parts else None), bool(queue_stats['last_error'] or queue_stats['dead_letter'])
+
+
 def update_portfolio(portfolio_id: str, updated_data: dict) -> tuple[bool, str]:
     """
     อัปเดตข้อมูล Portfolio ที่มีอยู่
@@ -161,21 +718,112 @@ def update_portfolio(portfolio_id: str, updated_data: dict) -> tuple[bool, str]:
     supabase = get_supabase_client()
     try:
         # Clean data (e.g., NaN/None/empty string to None, and datetime to ISO string)
-        cleaned_data = {}
-        for k, v in updated_data.items():
-            if pd.isna(v) or v == '':
-                cleaned_data[k] = None
-            else:
-                cleaned_data[k] = _convert_datetime_to_iso_string(v) # ใช้ helper function
+        cleaned_data = _json_ready_record(updated_data)
         
-        response = supabase.table("Portfolios").update(cleaned_data).eq("PortfolioID", portfolio_id).execute()
-        clear_all_caches()
+        response = _execute(supabase.table("Portfolios").update(cleaned_data).eq("PortfolioID", portfolio_id), idempotent=False)
+        invalidate_table_cache("Portfolios", portfolio_id)
         return True, "อัปเดต Portfolio สำเร็จ!"
     except Exception as e:
         return False, f"เกิดข้อผิดพลาดในการอัปเดต Portfolio: {e}"
 
 
-def save_statement_data(data_map: dict) -> tuple[bool, str]:
+def _records_for_table(table_name: str, records_data):
+    """
+    แปลง records_data (DataFrame / pyarrow.Table / list / dict) เป็น list ของ dict ที่ทำความสะอาดแล้ว
+    (NaN/None/'' -> None, numpy -> Python native, datetime -> ISO string) คืนค่า None ถ้าชนิดข้อมูลไม่รองรับ
+    """
+    # Scenario 1: Input records_data is a Pandas DataFrame
+    if isinstance(records_data, pd.DataFrame):
+        if records_data.empty:
+            return []
+        # เลือกเฉพาะคอลัมน์ที่คาดหวังจาก settings เพื่อป้องกันคอลัมน์ที่ไม่รู้จัก
+        expected_headers = settings.WORKSHEET_HEADERS.get(table_name, [])
+        temp_df = records_data.reindex(columns=expected_headers)
+        # ลบแถวที่ว่างเปล่าทั้งหมด (อาจเกิดขึ้นได้หลัง reindex)
+        return _json_ready_records(temp_df.dropna(how='all'))
+
+    # Scenario 1b: Input records_data is a columnar pyarrow.Table (output_format='arrow')
+    if hasattr(records_data, 'to_pandas') and hasattr(records_data, 'column_names'):
+        expected_headers = settings.WORKSHEET_HEADERS.get(table_name, [])
+        present_headers = [col for col in expected_headers if col in records_data.column_names]
+        if records_data.num_rows == 0 or not present_headers:
+            return []
+        return _json_ready_records(records_data.select(present_headers).to_pandas().dropna(how='all'))
+
+    # Scenario 2: Input records_data is already a list (of dicts)
+    if isinstance(records_data, list):
+        return [_json_ready_record(row) for row in records_data]
+
+    # Scenario 3: Input records_data is a single dictionary
+    if isinstance(records_data, dict):
+        return [_json_ready_record(records_data)]
+
+    # Scenario 4: Unexpected type of records_data
+    return None
+
+def _write_chunk(supabase, table_name: str, chunk: list) -> int:
+    """
+    upsert (ตาม settings.STATEMENT_UPSERT_CONFLICT_KEYS) หรือ insert หนึ่ง chunk
+    upsert ส่งซ้ำได้อย่างปลอดภัย จึง retry (jittered backoff) เฉพาะ chunk ที่ล้มเหลวชั่วคราว ส่วน insert ไม่ retry (จะเกิดแถวซ้ำ)
+    คืนค่าจำนวนแถวที่ส่งสำเร็จ หรือ raise exception สุดท้าย
+    """
+    conflict_key = settings.STATEMENT_UPSERT_CONFLICT_KEYS.get(table_name)
+    if conflict_key:
+        query = supabase.table(table_name).upsert(chunk, on_conflict=conflict_key)
+    else:
+        query = supabase.table(table_name).insert(chunk)
+    response = _execute(query, idempotent=bool(conflict_key), attempts=1 + max(int(settings.SUPABASE_WRITE_MAX_RETRIES), 0),
+                        base_delay=settings.SUPABASE_WRITE_RETRY_BACKOFF_SECONDS, name=f"save {table_name}")
+    # --- ตรวจสอบผลลัพธ์จาก Supabase API ---
+    if getattr(response, 'error', None) is not None:
+        error = response.error
+        raise RuntimeError(error.get('message', str(error)) if isinstance(error, dict) else str(error))
+    return len(chunk)
+
+def _write_tables(supabase, table_records: dict, executor) -> dict:
+    """
+    แบ่ง records ของทุกตารางใน table_records ({table_name: list}) เป็น chunk ละ settings.SUPABASE_WRITE_CHUNK_ROWS แถว
+    แล้วส่งพร้อมกันบน executor คืนค่า {table_name: {'rows', 'failed_rows', 'seconds', 'errors'}}
+    """
+    chunk_rows = max(int(settings.SUPABASE_WRITE_CHUNK_ROWS), 1)
+    stats = {table_name: {'rows': 0, 'failed_rows': 0, 'seconds': 0.0, 'errors': []} for table_name in table_records}
+    started = time.perf_counter()
+    futures = {}
+    for table_name, records in table_records.items():
+        for offset in range(0, len(records), chunk_rows):
+            chunk = records[offset:offset + chunk_rows]
+            futures[executor.submit(_write_chunk, supabase, table_name, chunk)] = (table_name, len(chunk))
+    for future in as_completed(futures):
+        table_name, chunk_size = futures[future]
+        table_stats = stats[table_name]
+        try:
+            table_stats['rows'] += future.result()
+        except Exception as e:
+            table_stats['failed_rows'] += chunk_size
+            table_stats['errors'].append(str(e))
+        # เวลาของตาราง = จากเริ่ม phase จนถึง chunk สุดท้ายของตารางนั้นเสร็จ
+        table_stats['seconds'] = time.perf_counter() - started
+    return stats
+
+def _dedupe_on_conflict_key(table_name: str, records: list) -> list:
+    """upsert เดียวกันห้ามมี key ซ้ำ (เช่น Order_ID_Ord ที่อยู่ทั้งใน statement เก่าและใหม่) เก็บแถวหลังสุด"""
+    conflict_key = settings.STATEMENT_UPSERT_CONFLICT_KEYS.get(table_name)
+    if not conflict_key or len(records) < 2:
+        return records
+    latest = {}
+    for record in records:
+        key = record.get(conflict_key)
+        latest.pop(key if key is not None else id(record), None)
+        latest[key if key is not None else id(record)] = record
+    return list(latest.values())
+
+def save_statement_data(data_map: dict, profile=None) -> tuple[bool, str]:
+    """
+    บันทึกข้อมูล Statement ทุกตารางใน data_map ({table_name: DataFrame/list/dict})
+    แต่ละตารางถูกแบ่งเป็น chunk (settings.SUPABASE_WRITE_CHUNK_ROWS) และส่งแบบขนาน:
+    Portfolios + StatementSummaries ก่อน -> Trades / Orders / Positions / DW พร้อมกัน -> UploadHistory ท้ายสุด
+    profile (optional core.ingest_metrics.IngestProfile) จะได้รับเวลาที่ใช้ของแต่ละตาราง ('save:<table>')
+    """
     overall_success = True
     overall_messages = []
 
@@ -183,143 +831,64 @@ def save_statement_data(data_map: dict) -> tuple[bool, str]:
     if not supabase:
         return False, "ไม่สามารถเชื่อมต่อ Supabase ได้ โปรดตรวจสอบการตั้งค่า"
 
-    # กำหนดลำดับการบันทึกเพื่อจัดการ Foreign Key dependencies (ถ้ามี)
-    # ควรบันทึก Portfolios ก่อน ถ้ามีการสร้าง Portfolio ใหม่
-    # แล้วค่อยตามด้วย Summary, History, และ Transactional Data
-    save_order = [
-        settings.SUPABASE_TABLE_PORTFOLIOS, # ถ้ามี portfolio ใหม่
-        settings.SUPABASE_TABLE_STATEMENT_SUMMARIES,
-        settings.SUPABASE_TABLE_UPLOAD_HISTORY,
-        settings.SUPABASE_TABLE_ACTUAL_TRADES,
-        settings.SUPABASE_TABLE_ACTUAL_ORDERS,
-        settings.SUPABASE_TABLE_ACTUAL_POSITIONS,
-        settings.SUPABASE_TABLE_DEPOSIT_WITHDRAWAL_LOGS,
-        # settings.SUPABASE_TABLE_PLANNED_LOGS, # ถ้ามีบันทึก PlannedLogs ในฟังก์ชันนี้
+    # ลำดับการบันทึกเพื่อจัดการ Foreign Key dependencies: ตารางใน phase เดียวกันไม่ขึ้นต่อกันจึงส่งพร้อมกันได้
+    # UploadHistory อยู่ท้ายสุด เพื่อไม่ให้ไฟล์ถูกนับว่าอัปโหลดแล้วถ้าข้อมูลหลักบันทึกไม่สำเร็จ
+    save_phases = [
+        [settings.SUPABASE_TABLE_PORTFOLIOS, settings.SUPABASE_TABLE_STATEMENT_SUMMARIES],
+        [settings.SUPABASE_TABLE_ACTUAL_TRADES, settings.SUPABASE_TABLE_ACTUAL_ORDERS,
+         settings.SUPABASE_TABLE_ACTUAL_POSITIONS, settings.SUPABASE_TABLE_DEPOSIT_WITHDRAWAL_LOGS],
+        [settings.SUPABASE_TABLE_UPLOAD_HISTORY],
     ]
 
     try:
-        for table_name in save_order:
-            records_data = data_map.get(table_name) # ดึงข้อมูลสำหรับตารางปัจจุบัน
-
-            # ถ้าไม่มีข้อมูลสำหรับตารางนี้ใน data_map ให้ข้ามไป
-            if records_data is None:
-                continue
-
-            # --- เริ่มต้นการเตรียม records_list_to_insert ให้เป็น list ของ dict เสมอ ---
-            records_list_to_insert = []
-            
-            # Scenario 1: Input records_data is a Pandas DataFrame
-            if isinstance(records_data, pd.DataFrame):
-                if not records_data.empty:
-                    # เลือกเฉพาะคอลัมน์ที่คาดหวังจาก settings เพื่อป้องกันคอลัมน์ที่ไม่รู้จัก
-                    expected_headers = settings.WORKSHEET_HEADERS.get(table_name, [])
-                    temp_df = records_data.reindex(columns=expected_headers)
-                    # ลบแถวที่ว่างเปล่าทั้งหมด (อาจเกิดขึ้นได้หลัง reindex)
-                    temp_df = temp_df.dropna(how='all') 
-                    
-                    # แปลงเป็น list ของ dictionarys ก็ต่อเมื่อ DataFrame ไม่ว่างเปล่า
-                    if not temp_df.empty:
-                        records_list_to_insert = temp_df.to_dict(orient='records')
-                # ถ้า records_data เป็น DataFrame ว่างเปล่า, records_list_to_insert ก็จะยังคงเป็น []
-
-            # Scenario 2: Input records_data is already a list (of dicts)
-            elif isinstance(records_data, list):
-                records_list_to_insert = records_data
-
-            # Scenario 3: Input records_data is a single dictionary
-            elif isinstance(records_data, dict):
-                records_list_to_insert = [records_data]
-
-            # Scenario 4: Unexpected type of records_data
-            else:
-                print(f"Warning: Unexpected data type for {table_name}: {type(records_data)}. Skipping this table.")
-                overall_success = False
-                overall_messages.append(f"ข้อมูล {table_name} มีชนิดไม่ถูกต้อง")
-                continue # ข้ามไปที่ตารางถัดไปในลูป
-
-            # --- สิ้นสุดการเตรียม records_list_to_insert ---
-
-            # ถ้า records_list_to_insert ว่างเปล่า (ไม่มีข้อมูลให้บันทึก) ให้ข้ามไป
-            if not records_list_to_insert: # ณ จุดนี้ records_list_to_insert จะเป็น list เสมอ
-                print(f"No records to insert for table: {table_name} (List was empty).")
-                overall_messages.append(f"ไม่มีข้อมูลสำหรับ {table_name} ที่จะบันทึก")
-                continue # ข้ามไปที่ตารางถัดไปในลูป
-            
-            # ทำความสะอาดข้อมูลในแต่ละ dict เพื่อจัดการ NaN/None ให้ Supabase รับได้
-            cleaned_records_to_insert = []
-            for row in records_list_to_insert:
-                cleaned_row = {}
-                for k, v in row.items():
-                    # แปลง numpy dtypes (เช่น np.float64, np.int64) เป็น Python native types
-                    if isinstance(v, (np.float64, np.int64)):
-                        v = float(v) if isinstance(v, np.float64) else int(v)
-                    
-                    # จัดการ NaN, None, หรือสตริงว่าง ให้เป็น None สำหรับฐานข้อมูล
-                    if pd.isna(v) or v == '' or v is None:
-                        cleaned_row[k] = None
+        with ThreadPoolExecutor(max_workers=max(int(settings.SUPABASE_WRITE_MAX_WORKERS), 1)) as executor:
+            for phase in save_phases:
+                if not overall_success and settings.SUPABASE_TABLE_UPLOAD_HISTORY in phase:
+                    overall_messages.append(f"ไม่ได้บันทึก {settings.SUPABASE_TABLE_UPLOAD_HISTORY} เพราะข้อมูลบางตารางบันทึกไม่สำเร็จ")
+                    continue
+
+                table_records = {}
+                for table_name in phase:
+                    records_data = data_map.get(table_name)
+                    # ถ้าไม่มีข้อมูลสำหรับตารางนี้ใน data_map ให้ข้ามไป
+                    if records_data is None:
+                        continue
+                    records = _records_for_table(table_name, records_data)
+                    if records is None:
+                        print(f"Warning: Unexpected data type for {table_name}: {type(records_data)}. Skipping this table.")
+                        overall_success = False
+                        overall_messages.append(f"ข้อมูล {table_name} มีชนิดไม่ถูกต้อง")
+                    elif not records:
+                        print(f"No records to insert for table: {table_name} (List was empty).")
+                        overall_messages.append(f"ไม่มีข้อมูลสำหรับ {table_name} ที่จะบันทึก")
                     else:
-                        # แปลง datetime-like objects เป็น ISO 8601 strings
-                        cleaned_row[k] = _convert_datetime_to_iso_string(v)
-                cleaned_records_to_insert.append(cleaned_row)
-            
-            # ถ้า cleaned_records_to_insert ว่างเปล่าหลังจากทำความสะอาด (เช่น ทุกแถวกลายเป็น None) ให้ข้ามไป
-            if not cleaned_records_to_insert:
-                print(f"No valid records to insert for table: {table_name} after cleaning.")
-                overall_messages.append(f"ไม่มีข้อมูลที่ถูกต้องสำหรับ {table_name} ที่จะบันทึก")
-                continue
-
+                        records = _dedupe_on_conflict_key(table_name, records)
+                        print(f"Attempting to save {len(records)} records to {table_name}...")
+                        table_records[table_name] = records
+
+                for table_name, table_stats in _write_tables(supabase, table_records, executor).items():
+                    # แม้บันทึกสำเร็จเพียงบาง chunk ข้อมูลก็เปลี่ยนแล้ว
+                    invalidate_table_cache(table_name, _portfolio_ids_of(table_records[table_name]))
+                    rows, seconds = table_stats['rows'], table_stats['seconds']
+                    rows_per_sec = rows / seconds if seconds else 0.0
+                    logger.info("save %s: %d rows in %.3fs (%.0f rows/s), %d failed rows",
+                                table_name, rows, seconds, rows_per_sec, table_stats['failed_rows'])
+                    if table_stats['failed_rows']:
+                        overall_success = False
+                        overall_messages.append(
+                            f"บันทึกข้อมูล {table_name} ไม่สำเร็จ {table_stats['failed_rows']} รายการ: {table_stats['errors'][0]}"
+                        )
+                    if rows:
+                        overall_messages.append(f"บันทึก {rows} รายการใน {table_name} สำเร็จ ({rows_per_sec:,.0f} แถว/วินาที)")
+                    if profile is not None:
+                        profile.add(f"save:{table_name}", seconds, rows=rows)
 
-            print(f"Attempting to save {len(cleaned_records_to_insert)} records to {table_name}...")
-            
-            response = None # ประกาศตัวแปร response
-            try:
-                # --- เลือกใช้ upsert หรือ insert ตามชื่อตารางและ Unique Key ---
-                if table_name == settings.SUPABASE_TABLE_ACTUAL_TRADES:
-                    response = supabase.table(table_name).upsert(cleaned_records_to_insert, on_conflict="Deal_ID").execute()
-                elif table_name == settings.SUPABASE_TABLE_ACTUAL_ORDERS:
-                    response = supabase.table(table_name).upsert(cleaned_records_to_insert, on_conflict="Order_ID_Ord").execute()
-                elif table_name == settings.SUPABASE_TABLE_ACTUAL_POSITIONS:
-                    response = supabase.table(table_name).upsert(cleaned_records_to_insert, on_conflict="Position_ID").execute()
-                elif table_name == settings.SUPABASE_TABLE_DEPOSIT_WITHDRAWAL_LOGS:
-                    response = supabase.table(table_name).upsert(cleaned_records_to_insert, on_conflict="TransactionID").execute() 
-                elif table_name == settings.SUPABASE_TABLE_UPLOAD_HISTORY:
-                    response = supabase.table(table_name).upsert(cleaned_records_to_insert, on_conflict="FileHash").execute()
-                elif table_name == settings.SUPABASE_TABLE_STATEMENT_SUMMARIES:
-                    response = supabase.table(table_name).upsert(cleaned_records_to_insert, on_conflict="PortfolioID").execute()
-                elif table_name == settings.SUPABASE_TABLE_PORTFOLIOS: # สำหรับสร้าง/อัปเดตรายละเอียด Portfolio
-                    response = supabase.table(table_name).upsert(cleaned_records_to_insert, on_conflict="PortfolioID").execute()
-                else: # ใช้ insert เป็นค่าเริ่มต้นสำหรับตารางอื่นๆ
-                    response = supabase.table(table_name).insert(cleaned_records_to_insert).execute()
-                
-                # --- ตรวจสอบผลลัพธ์จาก Supabase API อย่างละเอียด ---
-                if hasattr(response, 'error') and response.error is not None:
-                    error_detail = response.error.get('message', str(response.error)) if isinstance(response.error, dict) else str(response.error)
-                    print(f"Supabase error for {table_name}: {error_detail}")
-                    overall_success = False
-                    overall_messages.append(f"บันทึกข้อมูล {table_name} ไม่สำเร็จ: {error_detail}")
-                elif hasattr(response, 'data') and response.data is not None:
-                    if isinstance(response.data, list) and len(response.data) > 0:
-                        print(f"Successfully saved {len(response.data)} records to {table_name}.")
-                        overall_messages.append(f"บันทึก {len(response.data)} รายการใน {table_name} สำเร็จ")
-                    else: # ไม่มีข้อมูลส่งกลับ, แต่ไม่มี error ก็ถือว่าสำเร็จ
-                        print(f"Successfully processed {table_name} (no data returned or empty list).")
-                        overall_messages.append(f"ประมวลผล {table_name} สำเร็จ (ไม่มีข้อมูลส่งกลับ)")
-                else: # response ไม่มีทั้ง 'data' และ 'error' (อาจเป็น APIResponse บางประเภท)
-                    print(f"Supabase response for {table_name} had no 'data' or 'error' attribute. Assuming success if no exception raised.")
-                    overall_messages.append(f"ประมวลผล {table_name} สำเร็จ")
-
-            except Exception as e_inner: # ดักจับ Python exception ที่อาจเกิดขึ้นระหว่างการเรียก Supabase
-                print(f"Python exception during Supabase operation for {table_name}: {e_inner}")
-                overall_success = False
-                overall_messages.append(f"เกิดข้อผิดพลาดรุนแรงในการบันทึกข้อมูล {table_name}: {e_inner}")
-            
         final_overall_message = "บันทึกข้อมูล Statement สำเร็จ!" if overall_success else "บันทึกข้อมูล Statement บางส่วนไม่สำเร็จ:"
         final_overall_message += "\n" + "\n".join(overall_messages) if overall_messages else " (ไม่มีข้อมูลที่จะบันทึก)"
 
-        clear_all_caches()
         return overall_success, final_overall_message
     except Exception as e: # ดักจับ Python exception นอกเหนือจาก Supabase operation
-        print(f"Python exception in save_statement_data (outer block): {e}") 
+        print(f"Python exception in save_statement_data (outer block): {e}")
         return False, f"เกิดข้อผิดพลาดในการบันทึกข้อมูล Statement: {e}"
 
 def save_statement_summary(summary_data: dict) -> tuple[bool, str]:
@@ -331,15 +900,10 @@ def save_statement_summary(summary_data: dict) -> tuple[bool, str]:
         return False, "ไม่สามารถเชื่อมต่อ Supabase ได้"
     try:
         # Clean data (e.g., NaN/None/empty string to None, and datetime to ISO string)
-        clean_data = {}
-        for k, v in summary_data.items():
-            if pd.isna(v) or v == '':
-                clean_data[k] = None
-            else:
-                clean_data[k] = _convert_datetime_to_iso_string(v) # ใช้ helper function
-
-        response = supabase.table("StatementSummaries").insert(clean_data).execute()
-        clear_all_caches()
+        clean_data = _json_ready_record(summary_data)
+
+        response = _execute(supabase.table("StatementSummaries").insert(clean_data), idempotent=False)
+        invalidate_table_cache("StatementSummaries", _portfolio_ids_of([clean_data]))
         return True, "บันทึกข้อมูลสรุป Statement สำเร็จ!"
     except Exception as e:
         return False, f"เกิดข้อผิดพลาดในการบันทึกข้อมูลสรุป Statement: {e}"
@@ -353,15 +917,10 @@ def save_upload_history(history_data: dict) -> tuple[bool, str]:
         return False, "ไม่สามารถเชื่อมต่อ Supabase ได้"
     try:
         # Clean data (e.g., NaN/None/empty string to None, and datetime to ISO string)
-        clean_data = {}
-        for k, v in history_data.items():
-            if pd.isna(v) or v == '':
-                clean_data[k] = None
-            else:
-                clean_data[k] = _convert_datetime_to_iso_string(v) # ใช้ helper function
-
-        response = supabase.table("UploadHistory").insert(clean_data).execute()
-        clear_all_caches()
+        clean_data = _json_ready_record(history_data)
+
+        response = _execute(supabase.table("UploadHistory").insert(clean_data), idempotent=False)
+        invalidate_table_cache("UploadHistory", _portfolio_ids_of([clean_data]))
         return True, "บันทึกประวัติการอัปโหลดสำเร็จ!"
     except Exception as e:
         return False, f"เกิดข้อผิดพลาดในการบันทึกประวัติการอัปโหลด: {e}"
@@ -372,24 +931,52 @@ def delete_portfolio(portfolio_id: str) -> tuple[bool, str]:
     """
     supabase = get_supabase_client()
     try:
-        response = supabase.table("Portfolios").delete().eq("PortfolioID", portfolio_id).execute()
-        clear_all_caches()
+        response = _execute(supabase.table("Portfolios").delete().eq("PortfolioID", portfolio_id), idempotent=False)
+        # ข้อมูลของ portfolio นี้ในตารางอื่นอาจถูกลบตาม (FK cascade) จึงหมดอายุทุกตารางเฉพาะ scope ของ portfolio นี้
+        for table_name in settings.TABLE_PAGINATION_KEYS:
+            invalidate_table_cache(table_name, portfolio_id)
+        local_mirror.drop_portfolio(portfolio_id)
         return True, "ลบ Portfolio สำเร็จ!"
     except Exception as e:
         return False, f"เกิดข้อผิดพลาดในการลบ Portfolio: {e}"
 
+def load_ingest_watermark(portfolio_id: str) -> dict:
+    """
+    High-water mark ของ Statement ที่ import แล้วสำหรับ Portfolio นี้ = deal ล่าสุดใน ActualTrades
+    คืนค่า {'Time_Deal': pd.Timestamp (UTC), 'Deal_ID': str} หรือ {} ถ้ายังไม่มีข้อมูล
+    (ไม่ใช้ cache เพราะต้องเป็นค่าล่าสุดเสมอตอนอัปโหลด)
+    """
+    supabase = get_supabase_client()
+    if not supabase or not portfolio_id:
+        return {}
+    try:
+        query = supabase.table(settings.SUPABASE_TABLE_ACTUAL_TRADES) \
+                        .select('Time_Deal, Deal_ID') \
+                        .eq('PortfolioID', str(portfolio_id)) \
+                        .order('Time_Deal', desc=True) \
+                        .limit(1)
+        response = _execute(query, idempotent=True, name="load ingest watermark")
+        if not response.data or not response.data[0].get('Time_Deal'):
+            return {}
+        last_time = pd.Timestamp(response.data[0]['Time_Deal'])
+        last_time = last_time.tz_localize('UTC') if last_time.tz is None else last_time.tz_convert('UTC')
+        return {'Time_Deal': last_time, 'Deal_ID': str(response.data[0].get('Deal_ID') or '')}
+    except Exception as e:
+        st.error(f"Supabase error loading ingest watermark: {e}")
+        return {}
+
 def check_duplicate_file(file_hash: str, portfolio_id: str) -> tuple[bool, dict]:
     """
     ตรวจสอบว่า file_hash นี้มีอยู่ในตาราง UploadHistory สำหรับ PortfolioID นี้หรือไม่
     """
     supabase = get_supabase_client()
     try:
-        response = supabase.table("UploadHistory") \
-                           .select('PortfolioName, UploadTimestamp') \
-                           .eq('FileHash', file_hash) \
-                           .eq('PortfolioID', portfolio_id) \
-                           .limit(1) \
-                           .execute()
+        query = supabase.table("UploadHistory") \
+                        .select('PortfolioName, UploadTimestamp') \
+                        .eq('FileHash', file_hash) \
+                        .eq('PortfolioID', portfolio_id) \
+                        .limit(1)
+        response = _execute(query, idempotent=True, name="check duplicate file")
         if response.data:
             return True, response.data[0]
         return False, {}
@@ -0,0 +1,221 @@
+# core/write_behind.py
+"""
+Write-behind queue for small inserts (trade plan logs, checklist actions).
+
+enqueue() only appends the records to a local SQLite spool (settings.WRITE_BEHIND_SPOOL_PATH)
+and returns, so the Streamlit script never waits on a network round-trip. A daemon worker
+thread sends the spooled records in batches, per table, when settings.WRITE_BEHIND_BATCH_SIZE
+records are pending or every settings.WRITE_BEHIND_FLUSH_INTERVAL_SECONDS. Records leave the
+spool only after the database accepted them, so pending writes survive a restart and are sent
+by the next worker (delivery is at-least-once, so write_batch should be idempotent, e.g. an
+upsert that ignores duplicate keys).
+
+A batch rejected for a permanent reason (is_transient(error) is False: bad column, constraint
+violation, other 4xx) is re-sent one record at a time and only the rejected records are moved to
+the spool's dead_letter table, so one bad record cannot block the records queued behind it.
+Transient failures keep the records pending and the worker backs off.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """
+    Spool + background flusher. write_batch(table_name, records) is called on the worker
+    thread and must raise on failure. is_transient(error) decides whether a failed batch is
+    retried later with exponential backoff (default: every error is transient) or its
+    rejected records are dead-lettered.
+    """
+
+    def __init__(self, spool_path: str, write_batch, batch_size: int = 50,
+                 flush_interval: float = 2.0, max_backoff: float = 60.0, is_transient=None):
+        self.spool_path = Path(spool_path)
+        self.write_batch = write_batch
+        self.is_transient = is_transient or (lambda error: True)
+        self.batch_size = max(int(batch_size), 1)
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {'flushed_total': 0, 'failed_flushes': 0, 'last_flush_rows': 0,
+                       'last_flush_seconds': None, 'last_flush_at': None, 'last_error': None}
+        self._table_errors = {} # ผิดพลาดชั่วคราวล่าสุดของแต่ละตาราง (ล้างเมื่อส่งตารางนั้นสำเร็จ)
+        self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, table_name TEXT NOT NULL,"
+                " record TEXT NOT NULL, enqueued_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS dead_letter ("
+                " id INTEGER PRIMARY KEY, table_name TEXT NOT NULL, record TEXT NOT NULL,"
+                " enqueued_at REAL NOT NULL, failed_at REAL NOT NULL, error TEXT)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # หนึ่ง connection ต่อการเรียก: ใช้ได้จากทุก thread (script thread / worker)
+        return sqlite3.connect(self.spool_path, timeout=30)
+
+    def start(self):
+        """Starts the worker thread (no-op if it is already running)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, table_name: str, records: list) -> int:
+        """Spools JSON-ready records for table_name and returns the queue depth afterwards."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO pending (table_name, record, enqueued_at) VALUES (?, ?, ?)",
+                [(table_name, json.dumps(record), now) for record in records],
+            )
+        depth = self.depth()
+        if depth >= self.batch_size:
+            self._wakeup.set()
+        return depth
+
+    def depth(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def stats(self, table_name: str = None) -> dict:
+        """
+        Queue depth, age of the oldest pending record, dead-letter count (with the latest rejection)
+        and the latest flush latency/outcome. With table_name the counts and errors cover that table only.
+        """
+        where, params = ("WHERE table_name = ?", (table_name,)) if table_name else ("", ())
+        with self._connect() as conn:
+            depth, oldest = conn.execute(f"SELECT COUNT(*), MIN(enqueued_at) FROM pending {where}", params).fetchone()
+            dead_letter = conn.execute(f"SELECT COUNT(*) FROM dead_letter {where}", params).fetchone()[0]
+            last_rejection = conn.execute(
+                f"SELECT table_name, error FROM dead_letter {where} ORDER BY failed_at DESC LIMIT 1", params
+            ).fetchone()
+        with self._stats_lock:
+            stats = dict(self._stats)
+            if table_name:
+                stats['last_error'] = self._table_errors.get(table_name)
+        stats['depth'] = depth
+        stats['dead_letter'] = dead_letter
+        stats['last_dead_letter_error'] = f"{last_rejection[0]}: {last_rejection[1]}" if last_rejection else None
+        stats['oldest_pending_seconds'] = time.time() - oldest if oldest is not None else None
+        return stats
+
+    def _remove_pending(self, row_ids: list):
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM pending WHERE id = ?", [(row_id,) for row_id in row_ids])
+
+    def _dead_letter(self, table_name: str, row_id: int, error: Exception):
+        # ย้ายใน transaction เดียว: record ไม่หายและไม่ค้างอยู่ทั้งสองตาราง
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO dead_letter (id, table_name, record, enqueued_at, failed_at, error)"
+                " SELECT id, table_name, record, enqueued_at, ?, ? FROM pending WHERE id = ?",
+                (time.time(), str(error), row_id),
+            )
+            conn.execute("DELETE FROM pending WHERE id = ?", (row_id,))
+        logger.error("write-behind moved a %s record to dead_letter: %s", table_name, error)
+
+    def _send_one_by_one(self, table_name: str, chunk: list, error: Exception):
+        """
+        A batch was rejected permanently (error): sends its records one at a time and dead-letters
+        only the rejected ones. Returns (written, dead_lettered, transient error or None).
+        """
+        if len(chunk) == 1:
+            self._dead_letter(table_name, chunk[0][0], error)
+            return 0, 1, None
+        written = dead_lettered = 0
+        for row_id, record in chunk:
+            try:
+                self.write_batch(table_name, [record])
+            except Exception as e:
+                if self.is_transient(e):
+                    return written, dead_lettered, e
+                self._dead_letter(table_name, row_id, e)
+                dead_lettered += 1
+                continue
+            self._remove_pending([row_id])
+            written += 1
+        return written, dead_lettered, None
+
+    def flush(self) -> int:
+        """Sends pending records (oldest first, one batch per table) and returns the number written."""
+        with self._flush_lock:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT id, table_name, record FROM pending ORDER BY id LIMIT ?", (self.batch_size * 10,)
+                ).fetchall()
+            if not rows:
+                return 0
+
+            batches = {}
+            for row_id, table_name, record in rows:
+                batches.setdefault(table_name, []).append((row_id, json.loads(record)))
+
+            started = time.perf_counter()
+            written, dead_lettered, error = 0, 0, None
+            for table_name, items in batches.items():
+                for offset in range(0, len(items), self.batch_size):
+                    chunk = items[offset:offset + self.batch_size]
+                    try:
+                        self.write_batch(table_name, [record for _, record in chunk])
+                    except Exception as e:
+                        transient_error = e if self.is_transient(e) else None
+                        if transient_error is None:
+                            # ถูกปฏิเสธถาวร: แยกหา record ที่เสีย ส่วนที่เหลือส่งต่อได้
+                            logger.warning("write-behind batch of %d %s records rejected, sending one by one: %s",
+                                           len(chunk), table_name, e)
+                            chunk_written, chunk_dead, transient_error = self._send_one_by_one(table_name, chunk, e)
+                            written += chunk_written
+                            dead_lettered += chunk_dead
+                        if transient_error is not None:
+                            error = f"{table_name}: {transient_error}"
+                            with self._stats_lock:
+                                self._table_errors[table_name] = str(transient_error)
+                            logger.warning("write-behind flush of %d %s records failed: %s", len(chunk), table_name, transient_error)
+                            break # ลำดับภายในตารางต้องคงไว้: ส่ง chunk ถัดไปของตารางนี้ในรอบหน้า
+                        continue
+                    self._remove_pending([row_id for row_id, _ in chunk])
+                    written += len(chunk)
+                    with self._stats_lock:
+                        self._table_errors.pop(table_name, None)
+
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self._stats['flushed_total'] += written
+                self._stats['last_flush_rows'] = written
+                self._stats['last_flush_seconds'] = elapsed
+                self._stats['last_flush_at'] = time.time()
+                self._stats['last_error'] = error
+                if error:
+                    self._stats['failed_flushes'] += 1
+            if written or dead_lettered:
+                logger.info("write-behind flushed %d records (%d dead-lettered) in %.3fs", written, dead_lettered, elapsed)
+            if error:
+                raise RuntimeError(error)
+            return written
+
+    def _run(self):
+        backoff = 0.0
+        while True:
+            self._wakeup.wait(timeout=max(self.flush_interval, backoff))
+            self._wakeup.clear()
+            try:
+                self.flush()
+                while self.depth() >= self.batch_size * 10:
+                    self.flush() # ยังมีค้างอีก: ส่งต่อเลยไม่ต้องรอรอบถัดไป (ทุกรอบส่งได้หรือย้ายไป dead_letter หรือ raise)
+                backoff = 0.0
+            except Exception:
+                backoff = min(max(backoff * 2, self.flush_interval), self.max_backoff)
@@ -25,6 +25,10 @@ def render_ai_section():
         else:
             st.info(f"AI Assistant กำลังวิเคราะห์ข้อมูลจากแผนเทรดและผลการเทรดจริงทั้งหมด (กรุณาเลือก Active Portfolio)")
 
+        # โหลดข้อมูลครั้งเดียวแล้วใช้ร่วมกันทุก tab
+        df_ai_planned_logs = db_handler.load_all_planned_trade_logs(portfolio_id=active_portfolio_id_for_ai)
+        df_ai_actual_trades = db_handler.load_actual_trades(portfolio_id=active_portfolio_id_for_ai)
+
         # --- Tab interface ---
         tab1, tab2, tab3 = st.tabs([
             "📊 วิเคราะห์จากแผน (Planned)", 
@@ -36,10 +40,8 @@ def render_ai_section():
         with tab1:
             st.markdown("### 📝 AI Intelligence Report (จากแผนเทรด)")
             try:
-                df_ai_planned_logs = db_handler.load_all_planned_trade_logs()
-                
                 planned_analysis_results = analytics_engine.analyze_planned_trades_for_ai(
-                    df_all_planned_logs=db_handler.load_all_planned_trade_logs(),
+                    df_all_planned_logs=df_ai_planned_logs,
                     active_portfolio_id=active_portfolio_id_for_ai,
                     active_portfolio_name=active_portfolio_name_for_ai,
                     balance_for_simulation=balance_for_ai_simulation
@@ -70,10 +72,9 @@ def render_ai_section():
         with tab2:
             st.subheader("Dashboard วิเคราะห์ผลการเทรดจริง")
             try:
-                df_ai_actual_trades_all = db_handler.load_actual_trades()
-                df_all_statement_summaries = db_handler.load_statement_summaries()
+                df_all_statement_summaries = db_handler.load_statement_summaries(portfolio_id=active_portfolio_id_for_ai)
                 dashboard_results = analytics_engine.get_dashboard_analytics_for_actual(
-                    df_all_actual_trades=df_ai_actual_trades_all,
+                    df_all_actual_trades=df_ai_actual_trades,
                     df_all_statement_summaries=df_all_statement_summaries,
                     active_portfolio_id=active_portfolio_id_for_ai
                 )
@@ -102,9 +103,6 @@ def render_ai_section():
             st.write("คลิกปุ่มด้านล่างเพื่อให้ AI เริ่มทำการวิเคราะห์ข้อมูลเชิงลึก")
             if st.button("🚀 เริ่มการวิเคราะห์เชิงลึก!"):
                 try:
-                    df_planned_logs = db_handler.load_all_planned_trade_logs()
-                    df_actual_trades = db_handler.load_actual_trades()
-
                     if df_ai_planned_logs.empty or df_ai_actual_trades.empty:
                         st.warning("ไม่พบข้อมูล 'แผนการเทรด' หรือ 'ผลการเทรดจริง'")
                     else:
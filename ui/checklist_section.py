@@ -4,6 +4,9 @@ import streamlit as st
 import pandas as pd
 from supabase import Client
 from datetime import datetime
+import uuid
+from config import settings
+from core import supabase_handler as db_handler
 
 # ==============================================================================
 #                      MAIN LOGIC: SITUATION HANDLER
@@ -123,17 +126,31 @@ def render_checklist_section(supabase: Client):
                     try:
                         active_pid = st.session_state.get('active_portfolio_id_gs')
                         if active_pid:
-                            supabase.table("trades").insert({
+                            action_record = {
                                 "portfolio_id": active_pid,
                                 "pair": pair if pair else "N/A",
                                 "notes": user_note, 
                                 "image_url": img,
                                 "created_at": datetime.now().isoformat()
-                            }).execute()
-                            st.success("บันทึกการตัดสินใจเรียบร้อย! ทำตามแผนต่อไป")
+                            }
+                            if settings.WRITE_BEHIND_ENABLED:
+                                # ไม่รอ network: worker จะส่งเข้าฐานข้อมูลเบื้องหลัง
+                                # idempotency key: write-behind ส่งซ้ำได้ (upsert ด้วย key นี้จึงไม่เกิดแถวซ้ำ)
+                                action_record["client_action_id"] = str(uuid.uuid4())
+                                db_handler.enqueue_insert("trades", [action_record])
+                            else:
+                                supabase.table("trades").insert(action_record).execute()
+                            st.success("บันทึกการตัดสินใจเรียบร้อย! ทำตามแผนต่อไป" if not settings.WRITE_BEHIND_ENABLED
+                                       else "เข้าคิวบันทึกการตัดสินใจแล้ว (จะส่งเข้าฐานข้อมูลเบื้องหลัง) ทำตามแผนต่อไป")
                             st.rerun() # รีเฟรชหน้าจอเพื่ออัปเดต History
                         else:
                             st.error("กรุณาเลือก Portfolio ก่อน")
                     except Exception as e:
                         st.error(f"บันทึกไม่สำเร็จ: {e}")
 
+            if settings.WRITE_BEHIND_ENABLED:
+                # สถานะของ action ที่เข้าคิวไว้: รอส่ง / ส่งไม่ผ่าน / ถูกฐานข้อมูลปฏิเสธ (dead_letter)
+                status_message, needs_attention = db_handler.write_behind_status_message("trades")
+                if status_message:
+                    (st.warning if needs_attention else st.caption)(status_message)
+
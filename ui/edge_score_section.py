@@ -14,8 +14,8 @@ def render_edge_score_section(analytics_engine, db_handler):
             st.info("กรุณาเลือก Portfolio ที่ Sidebar เพื่อดูข้อมูล Edge Score")
             return
             
-        # โหลดข้อมูลการเทรด
-        df_actual_trades = db_handler.load_actual_trades()
+        # โหลดข้อมูลการเทรด (กรองเฉพาะพอร์ตที่เลือกฝั่ง server)
+        df_actual_trades = db_handler.load_actual_trades(portfolio_id=active_id, columns="edge_score")
         
         # คำนวณ Metrics
         metrics = analytics_engine.calculate_edge_score_metrics(df_actual_trades, active_id)
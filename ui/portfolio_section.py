@@ -241,9 +241,9 @@ def render_portfolio_manager_expander(db_handler, df_portfolios):
         tab1, tab2, tab3 = st.tabs(["📊 Dashboard", "➕ Add New Portfolio", "✏️ Edit/Delete Portfolio"])
 
         with tab1:
-            df_actual_trades = db_handler.load_actual_trades()
-            df_summaries = db_handler.load_statement_summaries()
             active_portfolio_id = st.session_state.get('active_portfolio_id_gs')
+            df_actual_trades = db_handler.load_actual_trades(portfolio_id=active_portfolio_id)
+            df_summaries = db_handler.load_statement_summaries(portfolio_id=active_portfolio_id)
 
             if active_portfolio_id and not df_portfolios.empty:
                 details_df = df_portfolios[df_portfolios['PortfolioID'] == active_portfolio_id]
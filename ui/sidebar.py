@@ -22,7 +22,7 @@ def render_sidebar():
     Renders the Sidebar and ensures data consistency between selection and calculation.
     """
     with st.sidebar:
-        df_portfolios = db_handler.load_portfolios()
+        df_portfolios = db_handler.load_portfolios(columns="sidebar_portfolios")
         st.markdown("---")
         st.subheader("Active Portfolio")
 
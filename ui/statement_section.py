@@ -2,16 +2,22 @@
 
 import streamlit as st
 import pandas as pd
-from core import statement_processor, supabase_handler as db_handler
-import hashlib
+from core import statement_processor, parse_cache, supabase_handler as db_handler
+from core.ingest_metrics import IngestProfile
 from datetime import datetime
 import time
+import os
+import shutil
+import tempfile
+from pathlib import Path
 from config import settings # Ensure settings is imported
+from utils import helpers
 
 def render_statement_section():
     """
     แสดงผล Section การอัปโหลดไฟล์ Statement ที่เรียบง่าย
     *** อัปเกรด: ใช้ Active Portfolio จาก Sidebar โดยตรง ***
+    รองรับการอัปโหลดหลายไฟล์: parse แบบขนานใน worker process แล้วบันทึกรวมครั้งเดียว
     """
     with st.expander("⬆️ Upload Trading Statement", expanded=False):
 
@@ -26,88 +32,228 @@ def render_statement_section():
         st.success(f"**คุณกำลังจะอัปเดตข้อมูลสำหรับ Portfolio:** `{active_portfolio_name}`")
         st.divider()
 
-        # --- 2. อัปโหลดไฟล์ Statement ---
-        st.markdown("##### อัปโหลดไฟล์ Statement (.csv หรือ .html):")
-        uploaded_file = st.file_uploader(
+        # --- 2. อัปโหลดไฟล์ Statement (เลือกได้หลายไฟล์) ---
+        st.markdown("##### อัปโหลดไฟล์ Statement (.csv หรือ .html) — เลือกได้หลายไฟล์:")
+        uploaded_files = st.file_uploader(
             "ลากไฟล์มาวาง หรือกดเพื่อเลือกไฟล์",
             type=["csv", "html"],
+            accept_multiple_files=True,
             label_visibility="collapsed"
         )
 
         st.divider()
 
+        # --- เวลาที่ใช้ในแต่ละขั้นตอนของการอัปโหลดครั้งล่าสุด (เก็บไว้ข้าม st.rerun) ---
+        last_ingest_profile = st.session_state.get('last_ingest_profile')
+        if last_ingest_profile:
+            with st.expander("⏱️ Ingest timings (อัปโหลดล่าสุด)", expanded=False):
+                df_profile = pd.DataFrame(last_ingest_profile)
+                st.dataframe(df_profile, use_container_width=True, hide_index=True)
+                st.caption(f"รวม {df_profile['seconds'].sum():.3f} วินาที")
+
         # --- 3. ปุ่มยืนยันและ Logic การทำงาน ---
         if st.button("💾 บันทึกข้อมูลลงใน Portfolio ที่เลือก", use_container_width=True, type="primary"):
             
             # --- Logic ตรวจสอบความถูกต้อง ---
-            if not uploaded_file:
+            if not uploaded_files:
                 st.warning("⚠️ โปรดอัปโหลดไฟล์ Statement ก่อน")
                 return # หยุดการทำงานทันที
 
             with st.spinner("กำลังตรวจสอบและประมวลผลไฟล์..."):
-                file_content_bytes = uploaded_file.getvalue()
-                file_hash = hashlib.sha256(file_content_bytes).hexdigest()
-
-                # --- Logic ตรวจสอบไฟล์ซ้ำ ---
-                is_duplicate, duplicate_details = db_handler.check_duplicate_file(file_hash, active_portfolio_id)
-                if is_duplicate:
-                    st.error(f"❌ **ไฟล์ซ้ำ!** เนื้อหาของไฟล์นี้เคยถูกอัปโหลดสำหรับ Portfolio '{active_portfolio_name}' ไปแล้วเมื่อ {duplicate_details.get('UploadTimestamp')}")
-                    return # หยุดการทำงานทันที
-
-                # --- ถ้าผ่านทุกอย่าง ให้เริ่มการประมวลผลและบันทึก ---
-                try:
-                    # (ส่วนที่เหลือของโค้ดเหมือนเดิมทุกประการ)
-                    extracted_data = statement_processor.extract_data_from_report_content(file_content_bytes)
-                    
-                    if not extracted_data or extracted_data.get('deals', pd.DataFrame()).empty:
-                        st.error("❌ ไม่สามารถดึงข้อมูลการเทรด (Deals) จากไฟล์ได้ โปรดตรวจสอบรูปแบบไฟล์")
-                        return
-
-                    data_to_save = {}
-                    import_batch_id = str(int(datetime.now().timestamp()))
-                    
-                    # Loop through main dataframes
-                    for key, table_name in settings.WORKSHEET_HEADERS_MAPPER.items():
-                        df = extracted_data.get(key, pd.DataFrame())
-                        df_to_save = pd.DataFrame() # สร้าง DataFrame ว่างๆ ไว้ก่อน
-                        if not df.empty:
-                            df_to_save = df.copy()
-                            df_to_save['PortfolioID'] = str(active_portfolio_id)
-                            df_to_save['PortfolioName'] = active_portfolio_name
-                            df_to_save['SourceFile'] = uploaded_file.name
-                            df_to_save['ImportBatchID'] = import_batch_id
-                        data_to_save[table_name] = df_to_save
-                    
-                    # Prepare summary data
-                    summary_data = extracted_data.get('final_summary_data', {})
-                    if summary_data:
-                        summary_data['PortfolioID'] = str(active_portfolio_id)
-                        summary_data['PortfolioName'] = active_portfolio_name
-                        summary_data['SourceFile'] = uploaded_file.name
-                        summary_data['ImportBatchID'] = import_batch_id
-                        summary_data['Timestamp'] = datetime.now()
-                    data_to_save[settings.SUPABASE_TABLE_STATEMENT_SUMMARIES] = summary_data
-
-                    # Prepare upload history
-                    upload_history_data = {
-                        "UploadTimestamp": datetime.now(), "PortfolioID": str(active_portfolio_id),
-                        "PortfolioName": active_portfolio_name, "FileName": uploaded_file.name,
-                        "FileSize": len(file_content_bytes), "FileHash": file_hash, "Status": "Success",
-                        "ImportBatchID": import_batch_id, "Notes": "Uploaded via Streamlit app"
-                    }
-                    data_to_save[settings.SUPABASE_TABLE_UPLOAD_HISTORY] = upload_history_data
-                    
-                    st.info("กำลังบันทึกข้อมูลลงฐานข้อมูล...")
-                    success, message = db_handler.save_statement_data(data_to_save)
-
-                    if success:
-                        st.success(f"✔️ บันทึกข้อมูลสำหรับ Portfolio '{active_portfolio_name}' สำเร็จ!")
-                        st.balloons()
-                        db_handler.clear_all_caches()
-                        time.sleep(2)
-                        st.rerun()
+                # --- Logic ตรวจสอบไฟล์ซ้ำ (ทั้งซ้ำกันเองใน batch และซ้ำกับที่เคยอัปโหลด) ---
+                # file_meta ถูก key ด้วยป้ายชื่อที่ไม่ซ้ำในชุดนี้: ไฟล์ต่างกันอาจชื่อเดียวกันได้ (เช่น ReportHistory-<login>.html)
+                # จึงข้ามเฉพาะไฟล์ที่เนื้อหาเหมือนกันทุกไบต์ (hash เดียวกัน)
+                files_to_parse = []
+                file_meta = {}
+                label_by_hash = {}
+                name_counts = {}
+                for uploaded_file in uploaded_files:
+                    # hash ทีละ chunk จาก buffer ของไฟล์ (ไม่ใช้ getvalue() ซึ่งคัดลอกทั้งไฟล์)
+                    file_hash = helpers.calculate_file_hash(uploaded_file)
+                    if file_hash in label_by_hash:
+                        st.info(f"ℹ️ ข้าม `{uploaded_file.name}`: เนื้อหาเหมือนกับ `{label_by_hash[file_hash]}` ในชุดนี้ทุกไบต์")
+                        continue
+
+                    name_counts[uploaded_file.name] = name_counts.get(uploaded_file.name, 0) + 1
+                    file_label = uploaded_file.name if name_counts[uploaded_file.name] == 1 else f"{uploaded_file.name} (#{name_counts[uploaded_file.name]})"
+                    label_by_hash[file_hash] = file_label
+                    if name_counts[uploaded_file.name] == 2:
+                        st.info(f"ℹ️ มีหลายไฟล์ชื่อ `{uploaded_file.name}` แต่เนื้อหาต่างกัน จะประมวลผลทุกไฟล์ (แสดงเป็น #2, #3, ...)")
+
+                    is_duplicate, duplicate_details = db_handler.check_duplicate_file(file_hash, active_portfolio_id)
+                    if is_duplicate:
+                        st.error(f"❌ **ไฟล์ซ้ำ!** `{file_label}` เคยถูกอัปโหลดสำหรับ Portfolio '{active_portfolio_name}' ไปแล้วเมื่อ {duplicate_details.get('UploadTimestamp')}")
+                        continue
+
+                    files_to_parse.append((file_label, uploaded_file))
+                    file_meta[file_label] = {"name": uploaded_file.name, "hash": file_hash, "size": uploaded_file.size}
+
+                if not files_to_parse:
+                    return # ไม่มีไฟล์ใหม่ให้ประมวลผล
+
+            # --- ถ้าผ่านทุกอย่าง ให้เริ่มการประมวลผลและบันทึก ---
+            spool_dir = None
+            try:
+                progress_bar = st.progress(0.0, text=f"กำลังประมวลผล 0/{len(files_to_parse)} ไฟล์...")
+                status_box = st.container()
+
+                files_done = []
+
+                def _on_file_done(file_name, result, from_cache=False):
+                    files_done.append(file_name)
+                    progress_bar.progress(len(files_done) / len(files_to_parse), text=f"กำลังประมวลผล {len(files_done)}/{len(files_to_parse)} ไฟล์...")
+                    if result.get('error'):
+                        status_box.error(f"❌ `{file_name}`: {result['error']}")
+                    elif result.get('deals', pd.DataFrame()).empty:
+                        status_box.error(f"❌ `{file_name}`: ไม่สามารถดึงข้อมูลการเทรด (Deals) ได้ โปรดตรวจสอบรูปแบบไฟล์")
                     else:
-                        st.error(f"❌ เกิดข้อผิดพลาดในการบันทึก: {message}")
+                        status_box.write(f"✔️ `{file_name}`: {len(result['deals'])} deals" + (" (จาก parse cache)" if from_cache else ""))
+
+                # --- ไฟล์ที่เคย parse แล้ว (ลองใหม่หลังบันทึกไม่สำเร็จ / อีก Portfolio) อ่านจาก parse cache ---
+                parsed_results = {}
+                for file_name, _ in files_to_parse:
+                    cached_result = parse_cache.load_cached_parse(file_meta[file_name]["hash"], active_portfolio_id)
+                    if cached_result is not None:
+                        parsed_results[file_name] = cached_result
+                        _on_file_done(file_name, cached_result, from_cache=True)
+
+                # ไฟล์ที่ต้อง parse ใหม่: คัดลอก buffer ลงไฟล์ชั่วคราวทีละ chunk แล้วส่งเฉพาะ path ให้ worker
+                # (worker อ่านแบบ mmap แทนการ pickle เนื้อหาทั้งไฟล์ข้าม process)
+                files_to_extract = []
+                for file_name, uploaded_file in files_to_parse:
+                    if file_name in parsed_results:
+                        continue
+                    if spool_dir is None:
+                        spool_dir = tempfile.mkdtemp(prefix="statement_upload_")
+                    spool_path = Path(spool_dir) / f"{len(files_to_extract)}{os.path.splitext(uploaded_file.name)[1]}"
+                    uploaded_file.seek(0)
+                    with open(spool_path, 'wb') as spool_file:
+                        shutil.copyfileobj(uploaded_file, spool_file)
+                    uploaded_file.seek(0)
+                    files_to_extract.append((file_name, spool_path))
+
+                fresh_results = statement_processor.extract_data_from_report_files(
+                    files_to_extract,
+                    portfolio_id=active_portfolio_id,
+                    on_progress=lambda file_name, done_count, total_count, result: _on_file_done(file_name, result)
+                )
+                for file_name, result in fresh_results.items():
+                    if not result.get('error') and not result.get('deals', pd.DataFrame()).empty:
+                        parse_cache.store_parsed_result(file_meta[file_name]["hash"], active_portfolio_id, result)
+                parsed_results.update(fresh_results)
+
+                # เรียงตามลำดับที่อัปโหลด และเก็บเฉพาะไฟล์ที่ parse สำเร็จ
+                parsed_files = [
+                    (file_name, parsed_results[file_name]) for file_name, _ in files_to_parse
+                    if not parsed_results[file_name].get('error')
+                    and not parsed_results[file_name].get('deals', pd.DataFrame()).empty
+                ]
+                if not parsed_files:
+                    st.error("❌ ไม่มีไฟล์ใดที่ดึงข้อมูลการเทรด (Deals) ได้")
+                    return
+
+                # --- Incremental: ส่งเฉพาะรายการที่ใหม่กว่า deal ล่าสุดที่เคย import ---
+                if settings.STATEMENT_INCREMENTAL_INGEST:
+                    watermark = db_handler.load_ingest_watermark(active_portfolio_id)
+                    for file_name, extracted_data in parsed_files:
+                        statement_processor.apply_ingest_watermark(extracted_data, watermark)
+                        watermark_status = extracted_data['watermark']
+                        if watermark_status['status'] == 'verified':
+                            st.caption(f"↪️ `{file_name}`: ข้ามรายการที่ import แล้ว {watermark_status['skipped']} (ก่อน {watermark_status['time']})")
+                        elif watermark_status['status'] == 'mismatch':
+                            st.warning(f"⚠️ `{file_name}`: ไม่พบ Deal ล่าสุดที่เคย import ({watermark_status['deal_id']}) ในไฟล์นี้ จะบันทึกทุกรายการแทน")
+
+                coercion_lines, ambiguous_time_lines = [], []
+                for file_name, extracted_data in parsed_files:
+                    for issue in extracted_data.get('coercion_issues', []):
+                        line = f"- `{file_name}` {issue['section']} / `{issue['column']}`: {issue['count']} แถว (ตัวอย่างค่า: {', '.join(issue['values'][:5])})"
+                        (ambiguous_time_lines if issue.get('kind') == 'ambiguous_time' else coercion_lines).append(line)
+                if coercion_lines:
+                    st.warning("⚠️ พบค่าที่แปลงเป็นตัวเลขไม่ได้ (จะถูกบันทึกเป็นค่าว่าง):\n" + "\n".join(coercion_lines))
+                if ambiguous_time_lines:
+                    st.warning(f"⚠️ พบเวลาที่อยู่ในชั่วโมงที่ซ้ำกันตอนเปลี่ยนเวลา (DST) ของ {settings.BROKER_SERVER_TIMEZONE} และระบุไม่ได้ว่าเป็นรอบไหน"
+                               " (บันทึกเป็นรอบแรก/เวลาฤดูร้อน):\n" + "\n".join(ambiguous_time_lines))
+
+                import_batch_id = str(int(datetime.now().timestamp()))
+                data_to_save = _build_batch_save_map(
+                    parsed_files, file_meta, active_portfolio_id, active_portfolio_name, import_batch_id
+                )
+
+                save_profile = IngestProfile(f"batch {import_batch_id}")
+                st.info(f"กำลังบันทึกข้อมูลจาก {len(parsed_files)} ไฟล์ลงฐานข้อมูล...")
+                success, message = db_handler.save_statement_data(data_to_save, profile=save_profile)
+                save_profile.log()
+                st.session_state['last_ingest_profile'] = [
+                    record for _, extracted_data in parsed_files for record in extracted_data.get('ingest_profile', [])
+                ] + save_profile.as_records()
+
+                if success:
+                    st.success(f"✔️ บันทึกข้อมูล {len(parsed_files)} ไฟล์สำหรับ Portfolio '{active_portfolio_name}' สำเร็จ!")
+                    st.balloons()
+                    time.sleep(2)
+                    st.rerun()
+                else:
+                    st.error(f"❌ เกิดข้อผิดพลาดในการบันทึก: {message}")
+
+            except Exception as e:
+                st.error(f"เกิดข้อผิดพลาดรุนแรงระหว่างการประมวลผลไฟล์: {e}")
+            finally:
+                if spool_dir is not None:
+                    shutil.rmtree(spool_dir, ignore_errors=True)
+
+
+def _build_batch_save_map(parsed_files: list, file_meta: dict, portfolio_id, portfolio_name: str, import_batch_id: str) -> dict:
+    """
+    รวมผลลัพธ์ของทุกไฟล์ใน batch เป็น data_map ชุดเดียวสำหรับ save_statement_data
+    - ตารางรายการ (Deals/Orders/Positions/DW logs): ต่อกัน แล้วตัดแถวซ้ำตาม upsert key (ไฟล์หลังชนะ)
+    - StatementSummaries: upsert ด้วย PortfolioID จึงเก็บเฉพาะ summary ของไฟล์ที่มี deal ล่าสุด
+    - UploadHistory: หนึ่งแถวต่อไฟล์
+    parsed_files / file_meta ใช้ป้ายชื่อไฟล์ที่ไม่ซ้ำในชุด ส่วน SourceFile / FileName บันทึกชื่อไฟล์จริง (file_meta[...]["name"])
+    """
+    frames_by_table = {table_name: [] for table_name in settings.WORKSHEET_HEADERS_MAPPER.values()}
+    upload_history_rows = []
+    latest_summary, latest_deal_time = {}, None
+
+    for file_name, extracted_data in parsed_files:
+        for key, table_name in settings.WORKSHEET_HEADERS_MAPPER.items():
+            df = extracted_data.get(key, pd.DataFrame())
+            if isinstance(df, pd.DataFrame) and not df.empty:
+                df_to_save = df.copy()
+                df_to_save['PortfolioID'] = str(portfolio_id)
+                df_to_save['PortfolioName'] = portfolio_name
+                df_to_save['SourceFile'] = file_meta[file_name]["name"]
+                df_to_save['ImportBatchID'] = import_batch_id
+                frames_by_table[table_name].append(df_to_save)
+
+        summary_data = extracted_data.get('final_summary_data', {})
+        file_last_deal_time = extracted_data['deals']['Time_Deal'].max()
+        if summary_data and (latest_deal_time is None or pd.isna(latest_deal_time) or file_last_deal_time >= latest_deal_time):
+            latest_summary, latest_deal_time = dict(summary_data, SourceFile=file_meta[file_name]["name"]), file_last_deal_time
+
+        upload_history_rows.append({
+            "UploadTimestamp": datetime.now(), "PortfolioID": str(portfolio_id),
+            "PortfolioName": portfolio_name, "FileName": file_meta[file_name]["name"],
+            "FileSize": file_meta[file_name]["size"], "FileHash": file_meta[file_name]["hash"], "Status": "Success",
+            "ImportBatchID": import_batch_id, "Notes": "Uploaded via Streamlit app"
+        })
+
+    data_to_save = {}
+    for table_name, frames in frames_by_table.items():
+        if not frames:
+            data_to_save[table_name] = pd.DataFrame()
+            continue
+        df_table = pd.concat(frames, ignore_index=True)
+        conflict_key = settings.STATEMENT_UPSERT_CONFLICT_KEYS.get(table_name)
+        if conflict_key in df_table.columns:
+            # upsert เดียวกันห้ามมี key ซ้ำ (statement รายสัปดาห์อาจมี deal ทับช่วงกัน)
+            df_table = df_table.drop_duplicates(subset=[conflict_key], keep='last')
+        data_to_save[table_name] = df_table
 
-                except Exception as e:
-                    st.error(f"เกิดข้อผิดพลาดรุนแรงระหว่างการประมวลผลไฟล์: {e}")
\ No newline at end of file
+    if latest_summary:
+        latest_summary['PortfolioID'] = str(portfolio_id)
+        latest_summary['PortfolioName'] = portfolio_name
+        latest_summary['ImportBatchID'] = import_batch_id
+        latest_summary['Timestamp'] = datetime.now()
+    data_to_save[settings.SUPABASE_TABLE_STATEMENT_SUMMARIES] = latest_summary
+    data_to_save[settings.SUPABASE_TABLE_UPLOAD_HISTORY] = upload_history_rows
+    return data_to_save
@@ -14,7 +14,8 @@ def get_today_drawdown(log_source_df):
     try:
         # Ensure Timestamp is datetime before strftime
         if 'Timestamp' not in log_source_df.columns or not pd.api.types.is_datetime64_any_dtype(log_source_df['Timestamp']):
-            log_source_df['Timestamp'] = pd.to_datetime(log_source_df['Timestamp'], errors='coerce')
+            # DataFrame นี้แชร์กับ section อื่นใน rerun (supabase_handler): แปลงบนสำเนา
+            log_source_df = log_source_df.assign(Timestamp=pd.to_datetime(log_source_df['Timestamp'], errors='coerce'))
 
         log_source_df_cleaned = log_source_df.dropna(subset=['Timestamp'])
         if 'Risk $' not in log_source_df_cleaned.columns:
@@ -35,7 +36,8 @@ def get_performance(log_source_df, mode="week"):
     if log_source_df.empty: return 0.0, 0.0, 0
     try:
         if 'Timestamp' not in log_source_df.columns or not pd.api.types.is_datetime64_any_dtype(log_source_df['Timestamp']):
-            log_source_df['Timestamp'] = pd.to_datetime(log_source_df['Timestamp'], errors='coerce')
+            # DataFrame นี้แชร์กับ section อื่นใน rerun (supabase_handler): แปลงบนสำเนา
+            log_source_df = log_source_df.assign(Timestamp=pd.to_datetime(log_source_df['Timestamp'], errors='coerce'))
 
         log_source_df_cleaned = log_source_df.dropna(subset=['Timestamp'])
         if 'Risk $' not in log_source_df_cleaned.columns:
@@ -65,17 +67,27 @@ def get_performance(log_source_df, mode="week"):
 # ============== FILE HASHING UTILITY ==============
 # เพิ่มฟังก์ชันนี้เข้าไปที่ท้ายไฟล์
 
-def calculate_file_hash(file_bytes: bytes) -> str:
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+def calculate_file_hash(file_bytes) -> str:
     """
-    คำนวณค่าแฮช (SHA256) ของไฟล์จากข้อมูลที่เป็น bytes
+    คำนวณค่าแฮช (SHA256) ของไฟล์จากข้อมูลที่เป็น bytes หรือไฟล์แบบ binary (เช่น UploadedFile)
     เพื่อใช้เป็นตัวระบุเอกลักษณ์ของไฟล์
 
     Args:
-        file_bytes: เนื้อหาของไฟล์ในรูปแบบ bytes
+        file_bytes: เนื้อหาของไฟล์ในรูปแบบ bytes หรือ object ที่มี read()/seek()
+            (อ่านทีละ chunk แล้วย้อนกลับไปต้นไฟล์ จึงไม่ต้องโหลดทั้งไฟล์เข้าหน่วยความจำ)
 
     Returns:
         สตริงที่แสดงค่าแฮช SHA256 ในรูปแบบเลขฐาน 16
     """
     sha256_hash = hashlib.sha256()
-    sha256_hash.update(file_bytes)
-    return sha256_hash.hexdigest()    
\ No newline at end of file
+    if isinstance(file_bytes, (bytes, bytearray, memoryview)):
+        sha256_hash.update(file_bytes)
+        return sha256_hash.hexdigest()
+
+    file_bytes.seek(0)
+    for chunk in iter(lambda: file_bytes.read(_HASH_CHUNK_SIZE), b''):
+        sha256_hash.update(chunk)
+    file_bytes.seek(0)
+    return sha256_hash.hexdigest()